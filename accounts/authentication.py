@@ -0,0 +1,100 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from knowledge_hub.cache import TieredCache
+
+# 进程内缓存条数和有效期(秒)，跨进程的失效只能依靠较短的有效期
+LOCAL_CACHE_SIZE = getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_SIZE', 1024)
+LOCAL_CACHE_TTL = getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_TTL', 10)
+# 共享缓存有效期(秒)
+SHARED_CACHE_TTL = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300)
+
+# 缓存内容格式变化时修改前缀，旧格式的条目自然过期
+token_cache = TieredCache(
+    'auth:token:v2', timeout=SHARED_CACHE_TTL, local_ttl=LOCAL_CACHE_TTL, local_size=LOCAL_CACHE_SIZE
+)
+
+
+def cache_key(key):
+    """缓存中不直接保存token明文"""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def token_lifetime():
+    """Token有效期，AUTH_TOKEN_EXPIRE_DAYS 为0或None(默认)表示永不过期"""
+    days = getattr(settings, 'AUTH_TOKEN_EXPIRE_DAYS', 0)
+    return timedelta(days=days) if days else None
+
+
+def is_token_expired(token):
+    lifetime = token_lifetime()
+    return lifetime is not None and token.created < timezone.now() - lifetime
+
+
+def invalidate_token(key):
+    """清除指定token的缓存"""
+    token_cache.delete(cache_key(key))
+
+
+def rotate_token(token):
+    """删除旧token(post_delete 信号清除其缓存)并为同一用户签发新token"""
+    user = token.user
+    Token.objects.filter(key=token.key).delete()
+    return Token.objects.create(user=user)
+
+
+def invalidate_user_tokens(user):
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+def user_snapshot(user):
+    """用户的可缓存字段(不含密码哈希)，值为普通数据"""
+    values = {}
+    for field in user._meta.concrete_fields:
+        if field.name == 'password':
+            continue
+        value = field.value_from_object(user)
+        # 文件字段只保存路径，FieldFile 序列化时会带上整个实例
+        values[field.attname] = value.name if isinstance(value, FieldFile) else value
+    return values
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """带两级缓存的Token认证
+
+    先查进程内LRU，再查共享缓存，都未命中时才访问数据库。
+    缓存内容为普通字典(用户字段不含密码，以及token的创建时间)，每个请求
+    据此构造新的 User/Token 实例，不在请求之间共享可变对象；
+    用户更新、注销或token删除时失效。
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(cache_key(key))
+        if snapshot is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('无效的Token')
+            snapshot = {'user': user_snapshot(token.user), 'created': token.created}
+            token_cache.set(cache_key(key), snapshot)
+
+        fields = snapshot['user']
+        # 密码作为延迟字段，需要时才从数据库读取；save() 也只会写回已加载的字段
+        user = get_user_model().from_db('default', list(fields), list(fields.values()))
+        token = Token(key=key, user=user, created=snapshot['created'])
+        if is_token_expired(token):
+            Token.objects.filter(key=key).delete()
+            invalidate_token(key)
+            raise exceptions.AuthenticationFailed('Token已过期，请重新登录')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('用户已被禁用')
+        return (user, token)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import invalidate_token, token_lifetime
+
+
+class Command(BaseCommand):
+    help = '删除已过期的认证Token'
+
+    def handle(self, *args, **options):
+        lifetime = token_lifetime()
+        if lifetime is None:
+            self.stdout.write('未设置Token有效期(AUTH_TOKEN_EXPIRE_DAYS)，无需清理')
+            return
+
+        expired = Token.objects.filter(created__lt=timezone.now() - lifetime)
+        keys = list(expired.values_list('key', flat=True))
+        expired.delete()
+        for key in keys:
+            invalidate_token(key)
+        self.stdout.write(self.style.SUCCESS(f'已删除 {len(keys)} 个过期Token'))
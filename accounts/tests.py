@@ -1,3 +1,90 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import CachedTokenAuthentication, token_cache
+from .models import User
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_second_lookup_is_served_from_cache(self):
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.username, 'alice')
+        self.assertEqual(token.key, self.token.key)
+
+    def test_each_request_gets_its_own_user_instance(self):
+        first, _ = self.auth.authenticate_credentials(self.token.key)
+        first.first_name = 'changed'
+        second, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.first_name, '')
+
+    def test_password_hash_is_not_cached(self):
+        self.auth.authenticate_credentials(self.token.key)
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertIn('password', user.get_deferred_fields())
+        # 需要时从数据库读取
+        self.assertTrue(user.check_password('secret'))
+
+    def test_user_update_invalidates_cache(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deleted_token_is_rejected(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_tokens_do_not_expire_by_default(self):
+        Token.objects.filter(key=self.token.key).update(created=timezone.now() - timedelta(days=365))
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+
+    @override_settings(AUTH_TOKEN_EXPIRE_DAYS=7)
+    def test_expired_token_is_deleted(self):
+        Token.objects.filter(key=self.token.key).update(created=timezone.now() - timedelta(days=8))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+
+
+class TokenRotationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.user = User.objects.create_user(username='bob', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_rotate_replaces_token(self):
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 200)
+        response = self.client.post('/api/auth/token/rotate/')
+        self.assertEqual(response.status_code, 200)
+        new_key = response.json()['token']
+        self.assertNotEqual(new_key, self.token.key)
+
+        # 旧token已在缓存中，也要立即失效
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {new_key}')
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 200)
@@ -5,5 +5,6 @@ urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
+    path('token/rotate/', views.TokenRotateView.as_view(), name='token-rotate'),
     path('user/', views.UserDetailView.as_view(), name='user-detail'),
 ]
\ No newline at end of file
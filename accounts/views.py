@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate, login, logout
+from .authentication import invalidate_token, is_token_expired, rotate_token
 from .models import User
 from .serializers import UserSerializer, RegisterSerializer
 
@@ -24,6 +25,9 @@ class LoginView(APIView):
             login(request, user)
             
             token, created = Token.objects.get_or_create(user=user)
+            if not created and is_token_expired(token):
+                # 过期的token直接轮换，避免旧token长期有效
+                token = rotate_token(token)
             
             return Response(
                 {
@@ -41,11 +45,24 @@ class LoginView(APIView):
 class LogoutView(APIView):
     def post(self, request):
         if request.user.is_authenticated:
-            Token.objects.filter(user=request.user).delete()
+            tokens = Token.objects.filter(user=request.user)
+            keys = list(tokens.values_list('key', flat=True))
+            tokens.delete()
+            for key in keys:
+                invalidate_token(key)
         
         logout(request)
         return Response({'detail': '已成功退出'}, status=status.HTTP_200_OK)
 
+class TokenRotateView(APIView):
+    """换发当前请求使用的token，旧token立即失效"""
+    
+    def post(self, request):
+        if not isinstance(request.auth, Token):
+            return Response({'detail': '当前请求未使用Token认证'}, status=status.HTTP_400_BAD_REQUEST)
+        token = rotate_token(request.auth)
+        return Response({'detail': 'Token已更新', 'token': token.key}, status=status.HTTP_200_OK)
+
 class UserDetailView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Category, Tag, Conversation, Message, KnowledgePoint
+from .models import (
+    Category, Tag, Conversation, ConversationArchive, Message, MessageReasoning, KnowledgePoint, EmbeddingJob,
+)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -16,10 +18,14 @@ class TagAdmin(admin.ModelAdmin):
 class MessageInline(admin.TabularInline):
     model = Message
     extra = 0
+    fields = ('role', 'content', 'metadata')
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).for_history()
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'category', 'created_at', 'updated_at')
+    list_display = ('title', 'user', 'category', 'created_at', 'updated_at', 'archived_at')
     list_filter = ('user', 'category')
     search_fields = ('title', 'summary')
     inlines = [MessageInline]
@@ -30,11 +36,43 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = ('role', 'conversation__user')
     search_fields = ('content',)
     
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # 只有列表页只取预览；编辑、删除、历史页面用同一方法取对象，需要完整字段
+        match = request.resolver_match
+        if match is not None and match.url_name == f'{self.opts.app_label}_{self.opts.model_name}_changelist':
+            return queryset.for_list()
+        return queryset
+    
     def content_preview(self, obj):
-        return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        preview = getattr(obj, 'preview', None)
+        if preview is None:
+            preview = obj.content
+        return preview[:50] + '...' if len(preview) > 50 else preview
 
 @admin.register(KnowledgePoint)
 class KnowledgePointAdmin(admin.ModelAdmin):
     list_display = ('title', 'category', 'user', 'created_at')
     list_filter = ('user', 'category')
-    search_fields = ('title', 'content')
\ No newline at end of file
+    search_fields = ('title', 'content')
+    raw_id_fields = ('source_message', 'extra_sources')
+
+@admin.register(EmbeddingJob)
+class EmbeddingJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'last_id', 'processed', 'failed', 'tokens', 'updated_at')
+    list_filter = ('status', 'target')
+    readonly_fields = ('started_at', 'finished_at', 'updated_at')
+
+@admin.register(MessageReasoning)
+class MessageReasoningAdmin(admin.ModelAdmin):
+    list_display = ('message', 'codec', 'size', 'created_at')
+    list_filter = ('codec',)
+    raw_id_fields = ('message',)
+    readonly_fields = ('codec', 'size', 'content')
+
+@admin.register(ConversationArchive)
+class ConversationArchiveAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'message_count', 'size', 'codec', 'archived_at')
+    list_filter = ('codec',)
+    raw_id_fields = ('conversation',)
+    readonly_fields = ('codec', 'message_count', 'size', 'archived_at')
@@ -22,6 +22,7 @@ class ModelProvider(models.Model):
     api_secret = models.CharField(max_length=100, blank=True, verbose_name="API密钥2")
     
     description = models.TextField(blank=True, verbose_name="提供商描述")
+    capabilities = models.JSONField(default=dict, blank=True, verbose_name="提供商能力")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     
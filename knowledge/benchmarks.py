@@ -0,0 +1,296 @@
+"""后端热点路径的基准测试用例
+
+通过 ``python manage.py benchmark`` 运行，用例在独立的测试数据库中执行，
+结果可以保存为基线并在后续运行中比较，超过阈值即视为性能回退。
+"""
+import hashlib
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import Category, Tag, Conversation, Message, KnowledgePoint
+
+User = get_user_model()
+
+# 名称 -> (用例函数, 默认规模列表)
+BENCHMARKS = {}
+
+MIXED_TEXT = (
+    "Django的ORM在处理大量数据时需要注意N+1查询问题。"
+    "Use select_related() for foreign keys and prefetch_related() for many-to-many relations. "
+    "向量检索(vector search)结合BM25可以显著提升召回率，尤其是对代码片段和专有名词。"
+)
+
+
+def benchmark(name, sizes=(None,)):
+    """注册基准测试用例
+
+    用例函数接收规模参数，完成数据准备后返回需要计时的无参可调用对象。
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, tuple(sizes))
+        return func
+    return decorator
+
+
+def run_isolated(workload):
+    """在事务中执行一次后回滚，返回耗时
+
+    有写入的用例(如知识提取)第二次运行时会走另一条路径(已存在重复知识点)，
+    回滚后每次运行都从同一份数据开始，预热和计时执行的是同一条路径。
+    """
+    with transaction.atomic():
+        start = time.perf_counter()
+        workload()
+        elapsed = time.perf_counter() - start
+        transaction.set_rollback(True)
+    return elapsed
+
+
+def run_case(name, size=None, repeat=5):
+    """运行单个用例，返回耗时和查询数统计"""
+    func, _ = BENCHMARKS[name]
+    workload = func(size)
+
+    # 预热一次并统计查询数
+    with CaptureQueriesContext(connection) as ctx:
+        run_isolated(workload)
+    # 用例内部的 atomic 嵌套在外层事务中变成保存点，这些语句不计入
+    savepoint_sql = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+    queries = sum(1 for query in ctx.captured_queries if not query['sql'].startswith(savepoint_sql))
+
+    timings = [run_isolated(workload) for _ in range(repeat)]
+
+    return {
+        'name': name,
+        'size': size,
+        'key': case_key(name, size),
+        'repeat': repeat,
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'queries': queries,
+    }
+
+
+def case_key(name, size):
+    return name if size is None else f"{name}[{size}]"
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """与基线比较，返回回退列表
+
+    耗时超过基线中位数 (1 + threshold) 倍，或查询数多于基线，均视为回退。
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(result['key'])
+        if not base:
+            continue
+        if result['median_s'] > base['median_s'] * (1 + threshold):
+            regressions.append(
+                f"{result['key']}: 耗时 {result['median_s'] * 1000:.2f}ms > "
+                f"基线 {base['median_s'] * 1000:.2f}ms (+{threshold:.0%})"
+            )
+        if result['queries'] > base.get('queries', result['queries']):
+            regressions.append(
+                f"{result['key']}: 查询数 {result['queries']} > 基线 {base['queries']}"
+            )
+    return regressions
+
+
+# ---------------------------------------------------------------------------
+# 数据准备
+# ---------------------------------------------------------------------------
+
+def make_user(prefix, is_staff=False):
+    username = f"{prefix}_{User.objects.count()}"
+    return User.objects.create(username=username, is_staff=is_staff)
+
+
+def seed_conversations(user, count, messages_per_conversation=2, batch_size=5000, seed=0):
+    """批量生成对话和消息"""
+    rng = random.Random(seed)
+    category = Category.objects.create(name='基准分类', user=user)
+    tags = Tag.objects.bulk_create([Tag(name=f'tag{i}', user=user) for i in range(5)])
+
+    conversations = Conversation.objects.bulk_create(
+        [Conversation(title=f'对话 {i} {rng.choice(MIXED_TEXT.split())}', user=user, category=category)
+         for i in range(count)],
+        batch_size=batch_size,
+    )
+    through = Conversation.tags.through
+    through.objects.bulk_create(
+        [through(conversation_id=c.id, tag_id=tags[i % len(tags)].id) for i, c in enumerate(conversations)],
+        batch_size=batch_size,
+    )
+
+    messages = []
+    for conversation in conversations:
+        for j in range(messages_per_conversation):
+            content = f"{MIXED_TEXT[rng.randrange(len(MIXED_TEXT) // 2):]} #{conversation.id}-{j}"
+            messages.append(Message(
+                conversation=conversation,
+                role='user' if j % 2 == 0 else 'assistant',
+                content=content,
+                message_hash=hashlib.md5(content.encode()).hexdigest(),
+            ))
+            if len(messages) >= batch_size:
+                Message.objects.bulk_create(messages)
+                messages = []
+    if messages:
+        Message.objects.bulk_create(messages)
+    return conversations
+
+
+def seed_knowledge_points(user, count, batch_size=5000, seed=0):
+    rng = random.Random(seed)
+    category = Category.objects.create(name='基准知识分类', user=user)
+    KnowledgePoint.objects.bulk_create(
+        [KnowledgePoint(
+            title=f'知识点 {i}',
+            content=MIXED_TEXT[rng.randrange(len(MIXED_TEXT) // 2):],
+            category=category,
+            user=user,
+        ) for i in range(count)],
+        batch_size=batch_size,
+    )
+
+
+def seed_token_usage(count, users=10, batch_size=10000, seed=0):
+    from .ai_models import ModelProvider, AIModel, TokenUsage
+
+    rng = random.Random(seed)
+    provider, _ = ModelProvider.objects.get_or_create(slug='mock', defaults={'name': 'Mock'})
+    models = [
+        AIModel.objects.get_or_create(model_id=f'bench-model-{i}', defaults={'name': f'Bench {i}', 'provider': provider})[0]
+        for i in range(3)
+    ]
+    user_objs = [make_user('bench_usage') for _ in range(users)]
+    now = timezone.now()
+
+    rows = []
+    for _ in range(count):
+        prompt_tokens = rng.randint(50, 2000)
+        completion_tokens = rng.randint(10, 1000)
+        rows.append(TokenUsage(
+            user=rng.choice(user_objs),
+            model=rng.choice(models),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            cost_usd=(prompt_tokens + completion_tokens) / 1000 * 0.002,
+            request_time=now - timedelta(seconds=rng.randint(0, 30 * 86400)),
+            response_time=rng.uniform(0.2, 5.0),
+        ))
+        if len(rows) >= batch_size:
+            TokenUsage.objects.bulk_create(rows)
+            rows = []
+    if rows:
+        TokenUsage.objects.bulk_create(rows)
+
+
+def call_action(viewset, action, user, params=None):
+    factory = APIRequestFactory()
+    request = factory.get('/', params or {})
+    force_authenticate(request, user=user)
+    return viewset.as_view({'get': action})(request)
+
+
+# ---------------------------------------------------------------------------
+# 用例
+# ---------------------------------------------------------------------------
+
+@benchmark('token_counter_mixed')
+def bench_token_counter(size):
+    from .models_service import TokenCounter
+
+    messages = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': MIXED_TEXT * 3} for i in range(10)]
+
+    def workload():
+        TokenCounter.count_tokens(MIXED_TEXT * 20, 'gpt-3.5-turbo')
+        TokenCounter.count_message_tokens(messages, 'qwen')
+    return workload
+
+
+@benchmark('conversation_serializer_list', sizes=(10, 100, 1000))
+def bench_conversation_serializer(size):
+    from .views import ConversationViewSet
+
+    user = make_user('bench_serializer')
+    seed_conversations(user, size)
+
+    def workload():
+        response = call_action(ConversationViewSet, 'list', user)
+        assert response.status_code == 200
+    return workload
+
+
+@benchmark('conversation_search', sizes=(10000,))
+def bench_conversation_search(size):
+    from .views import ConversationViewSet
+
+    user = make_user('bench_search')
+    seed_conversations(user, size // 2)
+
+    def workload():
+        call_action(ConversationViewSet, 'search', user, {'q': 'ORM'})
+    return workload
+
+
+@benchmark('knowledge_search', sizes=(10000,))
+def bench_knowledge_search(size):
+    from .views import KnowledgePointViewSet
+
+    user = make_user('bench_kp_search')
+    seed_knowledge_points(user, size)
+
+    def workload():
+        call_action(KnowledgePointViewSet, 'search', user, {'q': 'BM25'})
+    return workload
+
+
+@benchmark('extract_knowledge_structure', sizes=(20,))
+def bench_extract_knowledge(size):
+    from . import utils
+
+    user = make_user('bench_extract')
+    conversation = seed_conversations(user, 1, messages_per_conversation=10)[0]
+    analysis = {
+        'main_topic': '数据库优化',
+        'description': '关于ORM与索引的讨论',
+        'knowledge_points': [
+            {'title': f'知识点{i}', 'content': MIXED_TEXT, 'tags': [f'标签{i % 7}', f'标签{i % 3}']}
+            for i in range(size)
+        ],
+        'tags': ['ORM', '索引', '性能'],
+        'summary': '讨论了ORM查询优化',
+    }
+    stub = mock.MagicMock()
+    stub.chat.completions.create.return_value.choices[0].message.content = json.dumps(analysis, ensure_ascii=False)
+
+    def workload():
+        with mock.patch.object(utils, 'openai', stub):
+            assert utils.extract_knowledge_structure(conversation.id)
+    return workload
+
+
+@benchmark('token_usage_stats', sizes=(100000,))
+def bench_token_usage_stats(size):
+    from .views_model import TokenUsageViewSet
+
+    seed_token_usage(size)
+    admin = make_user('bench_admin', is_staff=True)
+
+    def workload():
+        response = call_action(TokenUsageViewSet, 'stats', admin, {'days': 30})
+        assert response.status_code == 200
+    return workload
@@ -0,0 +1,189 @@
+"""对话冷存储
+
+闲置超过 CONVERSATION_ARCHIVE_DAYS 天的对话，把消息连同思考过程和向量序列化
+后压缩为一个 blob 存入 ConversationArchive，并从消息表删除；对话本身(标题、
+摘要、分类、标签)和知识点不动，仍可列出和检索。打开对话时按原ID把消息写回。
+
+被知识点引用为来源(source_message 或 extra_sources)的消息留在消息表中
+(推荐和去重依赖它所属的对话)；
+Token使用记录关联的消息ID写入归档，恢复时重新关联。
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .ai_models import TokenUsage
+from .compression import compress, decompress
+from .models import Conversation, ConversationArchive, KnowledgePoint, Message, MessageReasoning, UserStats
+from .search import index_text
+
+ARCHIVE_DAYS = getattr(settings, 'CONVERSATION_ARCHIVE_DAYS', 90)
+FORMAT_VERSION = 1
+BATCH_SIZE = 500
+
+
+def archivable_messages():
+    """未被知识点引用为来源的消息"""
+    return Message.objects.filter(
+        ~Exists(KnowledgePoint.objects.filter(source_message=OuterRef('pk'))),
+        ~Exists(KnowledgePoint.extra_sources.through.objects.filter(message=OuterRef('pk'))),
+    )
+
+
+def idle_conversations(days=ARCHIVE_DAYS, user_id=None):
+    """返回 (闲置对话查询集, 截止时间)
+
+    恢复过的对话从恢复时起重新计算闲置时间；没有可归档消息(全部被知识点引用或
+    没有消息)的对话不返回，避免每次运行都重新扫描。
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    queryset = Conversation.objects.filter(archived_at__isnull=True, updated_at__lt=cutoff).filter(
+        Q(restored_at__isnull=True) | Q(restored_at__lt=cutoff),
+        Exists(archivable_messages().filter(conversation_id=OuterRef('pk'))),
+    )
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    return queryset, cutoff
+
+
+def pack_message(message, reasoning):
+    embedding = message.embedding
+    return {
+        'id': message.id,
+        'role': message.role,
+        'content': message.content,
+        'metadata': message.metadata,
+        'timestamp': message.timestamp.isoformat(),
+        'message_hash': message.message_hash,
+        'request_id': message.request_id,
+        'embedding': base64.b64encode(embedding.tobytes()).decode('ascii') if embedding is not None else None,
+        'embedding_hash': message.embedding_hash,
+        'reasoning': reasoning,
+    }
+
+
+def unpack_message(conversation_id, data):
+    return Message(
+        id=data['id'],
+        conversation_id=conversation_id,
+        role=data['role'],
+        content=data['content'],
+        metadata=data['metadata'],
+        message_hash=data['message_hash'],
+        request_id=data['request_id'],
+        embedding=base64.b64decode(data['embedding']) if data['embedding'] else None,
+        embedding_hash=data['embedding_hash'],
+        search_tokens=index_text(data['content']),
+    )
+
+
+@transaction.atomic
+def archive_conversation(conversation_id, cutoff=None):
+    """归档单个对话，返回归档的消息数
+
+    锁定对话行后再检查一次状态: 已归档、在截止时间后有更新或没有可归档的消息时返回 0。
+    """
+    conversation = (
+        Conversation.objects.select_for_update()
+        .filter(pk=conversation_id, archived_at__isnull=True).only('id', 'updated_at').first()
+    )
+    if conversation is None or (cutoff is not None and conversation.updated_at >= cutoff):
+        return 0
+
+    messages = list(
+        archivable_messages().with_embedding().defer('search_tokens')
+        .filter(conversation_id=conversation_id)
+        .order_by('timestamp', 'id')
+    )
+    if not messages:
+        return 0
+    ids = [message.id for message in messages]
+    reasonings = {r.message_id: r.content for r in MessageReasoning.objects.filter(message_id__in=ids)}
+    token_usage = {}
+    for usage_id, message_id in TokenUsage.objects.filter(message_id__in=ids).values_list('id', 'message_id'):
+        token_usage.setdefault(str(message_id), []).append(usage_id)
+
+    payload = json.dumps({
+        'version': FORMAT_VERSION,
+        'messages': [pack_message(message, reasonings.get(message.id)) for message in messages],
+        'token_usage': token_usage,
+    }, ensure_ascii=False)
+    codec, data = compress(payload)
+    ConversationArchive.objects.create(
+        conversation_id=conversation_id, codec=codec, data=data, message_count=len(messages), size=len(payload),
+    )
+    # Token使用记录的 message 置空，思考过程随消息级联删除
+    for start in range(0, len(ids), BATCH_SIZE):
+        Message.objects.filter(id__in=ids[start:start + BATCH_SIZE]).delete()
+    # update() 不会触发 auto_now，对话的排序位置不变
+    Conversation.objects.filter(pk=conversation_id).update(archived_at=timezone.now())
+    return len(messages)
+
+
+def restore_conversation(conversation):
+    """对话已归档时把消息写回消息表，返回恢复的消息数；未归档时直接返回 0
+
+    读取对话消息(详情、消息列表、继续对话)之前调用。
+    """
+    if conversation.archived_at is None:
+        return 0
+    now = timezone.now()
+    with transaction.atomic():
+        # 锁定后再检查，并发打开同一对话时只恢复一次
+        archived_at = (
+            Conversation.objects.select_for_update().filter(pk=conversation.pk)
+            .values_list('archived_at', flat=True).first()
+        )
+        archive = ConversationArchive.objects.filter(conversation_id=conversation.pk).first()
+        if archived_at is None or archive is None:
+            conversation.archived_at = None
+            return 0
+        payload = json.loads(decompress(archive.codec, archive.data))
+
+        entries = payload['messages']
+        times = {data['id']: parse_datetime(data['timestamp']) for data in entries}
+        reasonings = {data['id']: data['reasoning'] for data in entries if data['reasoning']}
+        messages = [unpack_message(conversation.pk, data) for data in entries]
+        # 归档期间新增的同内容消息会与唯一约束冲突，以新消息为准
+        Message.objects.bulk_create(messages, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        restored = set(Message.objects.filter(id__in=list(times)).values_list('id', flat=True))
+        messages = [message for message in messages if message.id in restored]
+        # bulk_create 会用 auto_now_add 覆盖时间，写入后恢复原始时间
+        for message in messages:
+            message.timestamp = times[message.id]
+        Message.objects.bulk_update(messages, ['timestamp'], batch_size=BATCH_SIZE)
+        MessageReasoning.objects.bulk_create(
+            [MessageReasoning.build(message, reasonings[message.id]) for message in messages if message.id in reasonings],
+            batch_size=BATCH_SIZE,
+        )
+        for message_id, usage_ids in payload['token_usage'].items():
+            if int(message_id) in restored:
+                TokenUsage.objects.filter(id__in=usage_ids, message_id__isnull=True).update(message_id=int(message_id))
+
+        archive.delete()
+        Conversation.objects.filter(pk=conversation.pk).update(archived_at=None, restored_at=now)
+        # bulk_create 不发送信号，手动递增版本号使检索缓存重新加载这些消息
+        UserStats.bump_for_conversation(conversation.pk)
+    conversation.archived_at, conversation.restored_at = None, now
+    return len(messages)
+
+
+def archive_idle(days=ARCHIVE_DAYS, user_id=None, limit=None, stdout=None):
+    """归档闲置对话，返回 {'conversations': 对话数, 'messages': 消息数}"""
+    queryset, cutoff = idle_conversations(days, user_id)
+    ids = list(queryset.order_by('updated_at').values_list('id', flat=True)[:limit])
+    counts = {'conversations': 0, 'messages': 0}
+    for conversation_id in ids:
+        archived = archive_conversation(conversation_id, cutoff)
+        if archived:
+            counts['conversations'] += 1
+            counts['messages'] += archived
+            if stdout and counts['conversations'] % 100 == 0:
+                stdout.write(f"已归档 {counts['conversations']} 个对话, {counts['messages']} 条消息")
+    return counts
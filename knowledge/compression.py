@@ -0,0 +1,40 @@
+"""文本压缩
+
+安装了 zstandard 时使用 zstd(压缩率和速度都更好)，否则使用标准库 zlib。
+压缩结果附带编码名称，读取时按名称解压，两种编码的数据可以共存。
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+def compress(text, codec=None):
+    """返回 (编码名称, 压缩后的字节)"""
+    codec = codec or default_codec()
+    raw = text.encode('utf-8')
+    if codec == 'zstd':
+        return codec, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    if codec == 'zlib':
+        return codec, zlib.compress(raw, ZLIB_LEVEL)
+    raise ValueError(f"不支持的压缩编码: {codec}")
+
+
+def decompress(codec, data):
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('读取zstd压缩的数据需要安装 zstandard: pip install zstandard')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    raise ValueError(f"不支持的压缩编码: {codec}")
@@ -0,0 +1,77 @@
+"""HTTP条件请求(ETag/Last-Modified)
+
+校验值只由 max(updated_at) 和行数这类聚合得出，一次窄查询即可判断
+客户端缓存是否仍然有效；命中时直接返回304，不再取数和序列化。
+行数用于发现删除(删除不会改变剩余行的最大更新时间)。
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def compute_validators(*querysets, extra=None, field='updated_at'):
+    """计算一组查询集的 (etag, last_modified时间戳)
+
+    每个查询集执行一次聚合查询，元素也可以是 (查询集, 时间字段)；
+    extra 为参与ETag计算的附加值(如用户ID、查询参数)，
+    用于区分同一URL下不同的响应内容。
+    """
+    parts = [str(extra)] if extra is not None else []
+    latest = None
+    for queryset in querysets:
+        queryset, time_field = queryset if isinstance(queryset, tuple) else (queryset, field)
+        row = queryset.order_by().aggregate(latest=Max(time_field), count=Count('pk'))
+        parts.append(f"{queryset.model._meta.label}:{row['count']}:{row['latest'].isoformat() if row['latest'] else ''}")
+        if row['latest'] and (latest is None or row['latest'] > latest):
+            latest = row['latest']
+    etag = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return etag, int(latest.timestamp()) if latest else None
+
+
+def set_validators(response, etag, last_modified):
+    """给响应加上校验头
+
+    内容随登录用户变化，需按 Authorization 区分缓存；no-cache 要求浏览器
+    每次都带校验头回源，避免按 Last-Modified 启发式缓存而读到旧数据。
+    """
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = quote_etag(etag)
+    if last_modified and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def conditional_response(request, querysets, build_response, extra=None):
+    """校验值未变化时返回304，否则调用 build_response() 生成完整响应"""
+    etag, last_modified = compute_validators(*querysets, extra=extra)
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build_response()
+    return set_validators(response, etag, last_modified)
+
+
+class ConditionalListMixin:
+    """为视图集的 list 增加条件请求支持
+
+    默认以当前用户过滤后的查询集为校验对象；响应中还包含关联对象的
+    字段(如分类名称、标签)时，重写 get_validator_querysets 一并返回。
+    """
+
+    def get_validator_querysets(self):
+        return [self.filter_queryset(self.get_queryset())]
+
+    def get_validator_extra(self):
+        return (self.request.user.pk, self.request.get_full_path())
+
+    def list(self, request, *args, **kwargs):
+        build_list = super().list
+        return conditional_response(
+            request, self.get_validator_querysets(),
+            lambda: build_list(request, *args, **kwargs),
+            extra=self.get_validator_extra(),
+        )
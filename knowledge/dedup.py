@@ -0,0 +1,178 @@
+"""知识点近似重复检测与合并
+
+每个知识点保存标题+内容的 64 位 SimHash，并拆成 4 个 16 位分段分别建索引。
+海明距离不超过 3 的两个指纹至少有一个分段完全相同(鸽巢原理)，因此查重只需
+按分段等值查询候选集，再在候选集内计算海明距离，代价与知识点总数无关。
+"""
+import hashlib
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import KnowledgePoint
+from .recommend import tokenize
+
+SIMHASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = SIMHASH_BITS // BAND_COUNT
+# 海明距离阈值，必须小于 BAND_COUNT 才能保证分段查询不漏检
+MAX_DISTANCE = 3
+
+BAND_FIELDS = [f'simhash_band{i}' for i in range(BAND_COUNT)]
+
+
+def simhash(text):
+    """计算文本的 64 位 SimHash(无符号整数)"""
+    weights = [0] * SIMHASH_BITS
+    for token, count in Counter(tokenize(text)).items():
+        h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+    value = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            value |= 1 << bit
+    return value
+
+
+def to_signed(value):
+    """数据库 bigint 为有符号整数"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distance(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def fingerprint(title, content):
+    """返回 simhash 及各分段字段值"""
+    value = simhash(f"{title}\n{content}")
+    fields = {'simhash': to_signed(value)}
+    for i, name in enumerate(BAND_FIELDS):
+        fields[name] = value >> (i * BAND_BITS) & ((1 << BAND_BITS) - 1)
+    return fields
+
+
+def find_duplicate(user_id, title, content, exclude_id=None, max_distance=MAX_DISTANCE):
+    """查找用户已有的近似重复知识点，返回距离最近(同距离取最早)的一个"""
+    fields = fingerprint(title, content)
+    condition = Q()
+    for name in BAND_FIELDS:
+        condition |= Q(**{name: fields[name]})
+    candidates = KnowledgePoint.objects.filter(condition, user_id=user_id)
+    if exclude_id is not None:
+        candidates = candidates.exclude(pk=exclude_id)
+
+    best = None
+    for pk, value in candidates.values_list('id', 'simhash').order_by('id'):
+        distance = hamming_distance(value, fields['simhash'])
+        if distance <= max_distance and (best is None or distance < best[1]):
+            best = (pk, distance)
+    return KnowledgePoint.objects.get(pk=best[0]) if best else None
+
+
+def add_source(point, message_id):
+    """记录知识点的来源消息: 没有主来源时作为 source_message，否则加入 extra_sources"""
+    if message_id is None or message_id == point.source_message_id:
+        return
+    if point.source_message_id is None:
+        point.source_message_id = message_id
+        point.save(update_fields=['source_message'])
+    else:
+        point.extra_sources.add(message_id)
+
+
+@transaction.atomic
+def merge_points(survivor, duplicates):
+    """将重复知识点合并到 survivor: 合并标签和全部来源消息，删除重复项"""
+    duplicates = [d for d in duplicates if d.pk != survivor.pk]
+    if not duplicates:
+        return survivor
+    duplicate_ids = [d.pk for d in duplicates]
+
+    tag_ids = set(KnowledgePoint.tags.through.objects.filter(
+        knowledgepoint_id__in=duplicate_ids
+    ).values_list('tag_id', flat=True))
+    if tag_ids:
+        survivor.tags.add(*tag_ids)
+
+    # 重复项的主来源在前，按重复项顺序决定 survivor 缺少主来源时用哪一个
+    sources = [d.source_message_id for d in duplicates if d.source_message_id]
+    sources += KnowledgePoint.extra_sources.through.objects.filter(
+        knowledgepoint_id__in=duplicate_ids
+    ).order_by('id').values_list('message_id', flat=True)
+    for message_id in dict.fromkeys(sources):
+        add_source(survivor, message_id)
+
+    KnowledgePoint.objects.filter(pk__in=duplicate_ids).delete()
+    return survivor
+
+
+def backfill_fingerprints(user_id=None, batch_size=1000):
+    """为缺少指纹的知识点(如批量导入的数据)补算 simhash"""
+    queryset = KnowledgePoint.objects.filter(simhash__isnull=True)
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+
+    updated = 0
+    batch = []
+    for point in queryset.only('id', 'title', 'content').iterator(chunk_size=batch_size):
+        for name, value in fingerprint(point.title, point.content).items():
+            setattr(point, name, value)
+        batch.append(point)
+        if len(batch) >= batch_size:
+            KnowledgePoint.objects.bulk_update(batch, ['simhash'] + BAND_FIELDS)
+            updated += len(batch)
+            batch = []
+    if batch:
+        KnowledgePoint.objects.bulk_update(batch, ['simhash'] + BAND_FIELDS)
+        updated += len(batch)
+    return updated
+
+
+def dedup_user(user_id, max_distance=MAX_DISTANCE, dry_run=False):
+    """合并用户的全部近似重复知识点，返回被合并(删除)的数量
+
+    在内存中按分段分桶，每个知识点只与同桶的知识点比较。
+    """
+    rows = list(
+        KnowledgePoint.objects.filter(user_id=user_id, simhash__isnull=False)
+        .values_list('id', 'simhash', *BAND_FIELDS).order_by('id')
+    )
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    buckets = [defaultdict(list) for _ in range(BAND_COUNT)]
+    for pk, value, *bands in rows:
+        for i, band in enumerate(bands):
+            for other_pk, other_value in buckets[i][band]:
+                if hamming_distance(value, other_value) <= max_distance:
+                    root, other_root = find(pk), find(other_pk)
+                    if root != other_root:
+                        # 较早的知识点作为保留项
+                        parent[max(root, other_root)] = min(root, other_root)
+            buckets[i][band].append((pk, value))
+
+    clusters = defaultdict(list)
+    for pk, *_ in rows:
+        root = find(pk)
+        if root != pk:
+            clusters[root].append(pk)
+
+    merged = sum(len(ids) for ids in clusters.values())
+    if dry_run:
+        return merged
+    for root, ids in clusters.items():
+        survivor = KnowledgePoint.objects.get(pk=root)
+        merge_points(survivor, list(KnowledgePoint.objects.filter(pk__in=ids)))
+    return merged
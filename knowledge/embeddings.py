@@ -0,0 +1,259 @@
+"""批量生成 embedding
+
+找出缺少向量或内容已变化的消息/知识点(embedding_hash 与当前内容哈希不一致)，
+按主键顺序分块读取，每块内用 TokenCounter 按提供商的条数和token上限分批，
+在线程池中并发请求 embeddings 接口，结果用 bulk_update 写回，并在
+EmbeddingJob 中记录检查点，中断后可从上次写回的位置继续。
+
+限速按提供商每分钟的请求数/token数(capabilities 中的 rate_limit_rpm/
+rate_limit_tpm)计数，计数存放在共享缓存中，多个 worker 共同受限。
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from knowledge_hub.cache import TieredCache
+
+from .ai_models import AIModel
+from .models import EmbeddingJob, KnowledgePoint, Message
+from .models_service import OpenAICompatibleService, TokenCounter
+from .search import bump_embedding_version
+
+DEFAULT_CHUNK_SIZE = 1000
+CONCURRENCY = getattr(settings, 'EMBEDDING_CONCURRENCY', 4)
+MAX_RETRIES = 3
+
+logger = logging.getLogger(__name__)
+
+rate_cache = TieredCache('ratelimit', timeout=120, local_ttl=0)
+
+# 目标: 模型、内容哈希字段、参与计算的文本字段
+TARGETS = {
+    'messages': {
+        'model': Message,
+        'hash_field': 'message_hash',
+        'text_fields': ('content',),
+        'search_target': 'messages',
+    },
+    'knowledge-points': {
+        'model': KnowledgePoint,
+        'hash_field': 'content_hash',
+        'text_fields': ('title', 'content'),
+        'search_target': 'knowledge',
+    },
+}
+
+
+class RateLimiter:
+    """按分钟窗口计数的共享限速"""
+
+    def __init__(self, key, rpm=None, tpm=None):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+
+    def acquire(self, tokens):
+        if not self.rpm and not self.tpm:
+            return
+        while True:
+            window = int(time.time() // 60)
+            requests_key = f'{self.key}:rpm:{window}'
+            tokens_key = f'{self.key}:tpm:{window}'
+            rate_cache.add(requests_key, 0)
+            rate_cache.add(tokens_key, 0)
+            used_requests = rate_cache.incr(requests_key)
+            used_tokens = rate_cache.incr(tokens_key, tokens)
+            # 单批超过tpm时，只要是窗口内的第一个请求就放行，否则永远无法发出
+            if (not self.rpm or used_requests <= self.rpm) and (
+                not self.tpm or used_tokens <= self.tpm or used_tokens == tokens
+            ):
+                return
+            # 超限: 归还本次占用，等到下一个窗口
+            rate_cache.incr(requests_key, -1)
+            rate_cache.incr(tokens_key, -tokens)
+            time.sleep(60 - time.time() % 60 + 0.05)
+
+
+def get_embedding_service(model_id=None):
+    """返回 embedding 类型模型的服务，未指定时使用 EMBEDDING_MODEL_ID 或第一个启用的模型"""
+    model_id = model_id or getattr(settings, 'EMBEDDING_MODEL_ID', None)
+    queryset = AIModel.objects.select_related('provider').filter(
+        model_type='embedding', is_active=True, provider__is_active=True
+    )
+    config = queryset.filter(model_id=model_id).first() if model_id else queryset.order_by('display_order').first()
+    if config is None:
+        raise ValueError(f"找不到可用的向量模型: {model_id}" if model_id else "系统中没有可用的向量模型")
+    return OpenAICompatibleService(config.model_id, model_config=config)
+
+
+def pending_queryset(target, user_id=None):
+    """缺少向量或内容哈希与生成向量时不一致的行；指定 user_id 时只取该用户的"""
+    stale = Q(embedding_hash__isnull=True) | ~Q(embedding_hash=F(TARGETS[target]['hash_field']))
+    if target == 'messages':
+        queryset = Message.objects.filter(stale, role__in=['user', 'assistant'], message_hash__isnull=False)
+        return queryset.filter(conversation__user_id=user_id) if user_id is not None else queryset
+    # 批量写入的知识点可能还没有 content_hash，处理时一并补上
+    queryset = KnowledgePoint.objects.filter(stale | Q(content_hash__isnull=True))
+    return queryset.filter(user_id=user_id) if user_id is not None else queryset
+
+
+def row_text(target, obj):
+    if target == 'knowledge-points':
+        return f"{obj.title}\n{obj.content}"
+    return obj.content
+
+
+def make_batches(items, max_inputs, max_tokens):
+    """把 (对象, 文本, token数) 按条数和token数上限分批"""
+    batch = []
+    batch_tokens = 0
+    for item in items:
+        if batch and (len(batch) >= max_inputs or batch_tokens + item[2] > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += item[2]
+    if batch:
+        yield batch
+
+
+def embed_batch(service, limiter, batch):
+    """请求一批向量，失败时指数退避重试"""
+    texts = [text for _, text, _ in batch]
+    tokens = sum(count for _, _, count in batch)
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire(tokens)
+        try:
+            return service.embed(texts)
+        except Exception:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+class EmbeddingPipeline:
+    """对一个目标执行一轮可续跑的批量向量生成"""
+
+    def __init__(self, target, model_id=None, chunk_size=DEFAULT_CHUNK_SIZE, concurrency=CONCURRENCY, stdout=None,
+                 user_id=None):
+        if target not in TARGETS:
+            raise ValueError(f"未知的向量目标: {target}")
+        self.target = target
+        self.user_id = user_id
+        self.spec = TARGETS[target]
+        self.service = get_embedding_service(model_id)
+        self.chunk_size = chunk_size
+        self.concurrency = max(1, concurrency)
+        self.stdout = stdout
+
+        capabilities = self.service.capabilities
+        self.max_inputs = capabilities.get('embedding_batch_size') or 64
+        self.max_tokens = capabilities.get('embedding_batch_tokens') or 8000
+        self.limiter = RateLimiter(
+            self.service.provider.slug,
+            rpm=capabilities.get('rate_limit_rpm'),
+            tpm=capabilities.get('rate_limit_tpm'),
+        )
+
+    def get_job(self, restart=False):
+        model_id = self.service.model_config.model_id
+        # 只处理单个用户时使用独立的检查点，不影响全量任务的续跑位置
+        name = f'{self.target}:{model_id}' if self.user_id is None else f'{self.target}:{model_id}:user-{self.user_id}'
+        job, _ = EmbeddingJob.objects.get_or_create(
+            name=name, defaults={'target': self.target, 'model_id': model_id}
+        )
+        if restart or job.status == 'completed' or job.started_at is None:
+            job.last_id = 0
+            job.processed = job.failed = job.tokens = 0
+            job.started_at = timezone.now()
+            job.finished_at = None
+        job.status = 'running'
+        job.error = ''
+        job.save()
+        return job
+
+    def prepare(self, rows):
+        """计算每行的文本和token数，超长文本按比例截断到单批上限"""
+        items = []
+        for obj in rows:
+            if self.target == 'knowledge-points' and not obj.content_hash:
+                obj.content_hash = KnowledgePoint.make_content_hash(obj.title, obj.content)
+            text = row_text(self.target, obj)
+            tokens = TokenCounter.count_tokens(text, self.service.token_model)
+            if tokens > self.max_tokens:
+                text = text[:int(len(text) * self.max_tokens / tokens)]
+                tokens = self.max_tokens
+            items.append((obj, text, max(tokens, 1)))
+        return items
+
+    def run(self, restart=False):
+        model = self.spec['model']
+        hash_field = self.spec['hash_field']
+        update_fields = ['embedding', 'embedding_hash']
+        if self.target == 'knowledge-points':
+            update_fields.append('content_hash')
+
+        job = self.get_job(restart)
+        queryset = pending_queryset(self.target, self.user_id).order_by('id').only('id', hash_field, *self.spec['text_fields'])
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                rows = list(queryset.filter(id__gt=job.last_id)[:self.chunk_size])
+                if not rows:
+                    break
+
+                batches = list(make_batches(self.prepare(rows), self.max_inputs, self.max_tokens))
+                futures = {executor.submit(embed_batch, self.service, self.limiter, batch): batch for batch in batches}
+                updated = []
+                failed = 0
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    try:
+                        vectors, usage = future.result()
+                    except Exception as e:
+                        logger.warning("%s 向量生成失败(%d 条): %s", self.target, len(batch), e)
+                        failed += len(batch)
+                        job.error = str(e)
+                        continue
+                    job.tokens += usage.get('total_tokens') or 0
+                    for (obj, _, _), vector in zip(batch, vectors):
+                        obj.embedding = vector
+                        obj.embedding_hash = getattr(obj, hash_field)
+                        updated.append(obj)
+
+                if not updated:
+                    # 整块都失败(多半是服务不可用)，保留检查点等待下次续跑
+                    job.status = 'failed'
+                    job.save(update_fields=['status', 'error', 'tokens', 'updated_at'])
+                    raise RuntimeError(f"向量生成失败，已在 id={job.last_id} 处保存检查点: {job.error}")
+
+                # 部分失败的行哈希仍不一致，下一轮会重新处理
+                with transaction.atomic():
+                    model.objects.bulk_update(updated, update_fields, batch_size=500)
+                    job.last_id = rows[-1].id
+                    job.processed += len(updated)
+                    job.failed += failed
+                    job.save()
+                bump_embedding_version(self.spec['search_target'])
+                if self.stdout:
+                    self.stdout.write(f"{self.target}: 已处理 {job.processed} 条, 失败 {job.failed} 条, last_id={job.last_id}")
+
+        job.status = 'completed'
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+
+def embed_pending(targets=None, model_id=None, restart=False, **options):
+    """对各目标依次执行一轮，返回 {目标: 处理条数}"""
+    results = {}
+    for target in targets or list(TARGETS):
+        job = EmbeddingPipeline(target, model_id=model_id, **options).run(restart=restart)
+        results[target] = job.processed
+    return results
@@ -0,0 +1,193 @@
+"""Token使用记录和对话的流式导出
+
+只取需要的列(values_list，关联字段在SQL中JOIN)，通过 .iterator(chunk_size)
+使用服务端游标逐批读取，CSV逐行写出，Parquet按批写入，内存占用与总行数无关。
+"""
+import csv
+import datetime
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ai_models import TokenUsage
+from .models import Conversation, ConversationArchive, Message
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# 数据集: 列名 -> values_list 字段
+DATASETS = {
+    'token-usage': {
+        'model': TokenUsage,
+        'time_field': 'request_time',
+        'order_by': 'request_time',
+        'columns': [
+            ('id', 'id'),
+            ('request_time', 'request_time'),
+            ('user_id', 'user_id'),
+            ('username', 'user__username'),
+            ('model_id', 'model__model_id'),
+            ('model_name', 'model__name'),
+            ('conversation_id', 'conversation_id'),
+            ('message_id', 'message_id'),
+            ('prompt_tokens', 'prompt_tokens'),
+            ('completion_tokens', 'completion_tokens'),
+            ('total_tokens', 'total_tokens'),
+            ('cost_usd', 'cost_usd'),
+            ('cost_rmb', 'cost_rmb'),
+            ('response_time', 'response_time'),
+            ('is_successful', 'is_successful'),
+        ],
+    },
+    'conversations': {
+        'model': Conversation,
+        'time_field': 'updated_at',
+        'order_by': 'id',
+        'columns': [
+            ('id', 'id'),
+            ('title', 'title'),
+            ('summary', 'summary'),
+            ('user_id', 'user_id'),
+            ('username', 'user__username'),
+            ('category', 'category__name'),
+            ('message_count', 'message_count'),
+            ('created_at', 'created_at'),
+            ('updated_at', 'updated_at'),
+        ],
+    },
+}
+
+
+def parse_date(value, end=False):
+    """YYYY-MM-DD 转为当前时区的时间点；end 为真时取次日零点(作为开区间上界)"""
+    if not value:
+        return None
+    day = datetime.datetime.strptime(value, '%Y-%m-%d')
+    if end:
+        day += datetime.timedelta(days=1)
+    return timezone.make_aware(day)
+
+
+def build_queryset(name, start=None, end=None, user_id=None, model_id=None):
+    """按条件过滤的导出查询集；model_id 只用于 token-usage(按模型ID字符串过滤)"""
+    spec = DATASETS[name]
+    queryset = spec['model'].objects.all()
+    if name == 'conversations':
+        # 用相关子查询计数而不是 JOIN + GROUP BY: 分组聚合要先算完全部对话才能
+        # 输出第一行，服务端游标就失去了流式的意义。
+        # 已归档对话的消息不在消息表中，加上归档记录的条数
+        messages = (
+            Message.objects.filter(conversation=OuterRef('pk')).order_by()
+            .values('conversation').annotate(count=Count('id')).values('count')
+        )
+        archived = ConversationArchive.objects.filter(conversation=OuterRef('pk')).values('message_count')
+        queryset = queryset.annotate(
+            message_count=Coalesce(Subquery(messages, output_field=IntegerField()), 0)
+            + Coalesce(Subquery(archived, output_field=IntegerField()), 0),
+        )
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    if model_id:
+        queryset = queryset.filter(model__model_id=model_id)
+    if start is not None:
+        queryset = queryset.filter(**{f"{spec['time_field']}__gte": start})
+    if end is not None:
+        queryset = queryset.filter(**{f"{spec['time_field']}__lt": end})
+    return queryset.order_by(spec['order_by'])
+
+
+def header(name):
+    return [column for column, _ in DATASETS[name]['columns']]
+
+
+def iter_rows(name, queryset=None, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """逐行产出元组"""
+    if queryset is None:
+        queryset = build_queryset(name, **filters)
+    fields = [field for _, field in DATASETS[name]['columns']]
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    return value
+
+
+class Echo:
+    """csv.writer 的伪文件对象，write 直接返回写入内容"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(name, rows):
+    """生成CSV文本行，供 StreamingHttpResponse 使用"""
+    writer = csv.writer(Echo())
+    yield '\ufeff'  # BOM，便于Excel识别UTF-8
+    yield writer.writerow(header(name))
+    for row in rows:
+        yield writer.writerow([format_value(value) for value in row])
+
+
+def write_csv(name, rows, output):
+    writer = csv.writer(output)
+    writer.writerow(header(name))
+    count = 0
+    for row in rows:
+        writer.writerow([format_value(value) for value in row])
+        count += 1
+    return count
+
+
+def resolve_field(model, path):
+    """按 values_list 路径(如 user__username)找到最终的模型字段"""
+    *relations, attname = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(attname)
+
+
+def arrow_schema(name):
+    """由模型字段类型推出固定的Parquet schema，避免各批次推断出的类型不一致"""
+    import pyarrow as pa
+
+    types = {
+        'AutoField': pa.int64(), 'BigAutoField': pa.int64(), 'IntegerField': pa.int64(),
+        'BigIntegerField': pa.int64(), 'PositiveIntegerField': pa.int64(), 'ForeignKey': pa.int64(),
+        'FloatField': pa.float64(), 'BooleanField': pa.bool_(),
+        'DateTimeField': pa.timestamp('us', tz='UTC'),
+    }
+    spec = DATASETS[name]
+    fields = []
+    for column, path in spec['columns']:
+        if column == 'message_count':
+            arrow_type = pa.int64()
+        else:
+            arrow_type = types.get(resolve_field(spec['model'], path).get_internal_type(), pa.string())
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def write_parquet(name, rows, path, batch_size=DEFAULT_CHUNK_SIZE):
+    """按批写入Parquet文件，需要安装 pyarrow"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('导出Parquet需要安装 pyarrow: pip install pyarrow')
+
+    schema = arrow_schema(name)
+    columns = header(name)
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+            count += 1
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    return count
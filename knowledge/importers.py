@@ -0,0 +1,398 @@
+"""外部聊天记录批量导入
+
+支持 ChatGPT 和 DeepSeek 导出的 conversations.json(顶层为对话数组，
+消息以 mapping 树的形式保存)，以及每行一个对话的 JSONL:
+    {"title": "...", "created_at": "...", "messages": [{"role": "user", "content": "...", "timestamp": ...}]}
+
+文件按块增量解析，不会整体读入内存；对话和消息按批 bulk_create，
+不经过 add_message，也不调用大模型。知识提取和向量生成在导入完成后分批异步执行。
+"""
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Conversation, Message, MessageReasoning, UserStats
+from .search import index_text
+
+DEFAULT_BATCH_SIZE = 500
+# 每个异步提取任务处理的对话数
+EXTRACT_BATCH_SIZE = 50
+
+TITLE_MAX_LENGTH = Conversation._meta.get_field('title').max_length
+ROLES = {'user', 'assistant', 'system'}
+
+
+class ImportFormatError(ValueError):
+    """无法识别的导出格式"""
+
+
+def iter_json_array(fp, chunk_size=1 << 16):
+    """增量解析顶层为数组的JSON，逐个产出数组元素"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # 跳过空白和分隔符
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = '', 0
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+        if position >= len(buffer):
+            if started:
+                raise ImportFormatError('JSON数组不完整')
+            return
+        if not started:
+            if buffer[position] != '[':
+                raise ImportFormatError('JSON顶层应为数组')
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ImportFormatError('JSON格式错误')
+            # 当前元素还没读完，继续读入
+            buffer = buffer[position:]
+            position = 0
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        position = end
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+
+
+def iter_jsonl(fp):
+    for line_number, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise ImportFormatError(f'第 {line_number} 行不是合法的JSON')
+
+
+def iter_records(fp, fmt='auto'):
+    """按格式产出原始对话记录；auto 时根据首个非空白字符判断数组或JSONL"""
+    if fmt == 'jsonl':
+        return iter_jsonl(fp)
+    if fmt in ('json', 'chatgpt', 'deepseek'):
+        return iter_json_array(fp)
+
+    head = ''
+    while True:
+        char = fp.read(1)
+        if not char or not char.isspace():
+            head = char
+            break
+    if head == '[':
+        return iter_json_array(_Prepend(head, fp))
+    if head == '{':
+        return iter_jsonl(_Prepend(head, fp))
+    raise ImportFormatError('无法识别的文件格式，应为JSON数组或JSONL')
+
+
+class _Prepend:
+    """把已读出的字符放回文件流前面"""
+
+    def __init__(self, head, fp):
+        self.head = head
+        self.fp = fp
+
+    def read(self, size=-1):
+        head, self.head = self.head, ''
+        return head + self.fp.read(size)
+
+    def __iter__(self):
+        head, self.head = self.head, ''
+        first = True
+        for line in self.fp:
+            if first:
+                line, first = head + line, False
+            yield line
+        if first and head:
+            yield head
+
+
+def parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        # 格式正确但日期不存在(如 2月30日)时 parse_datetime 抛出 ValueError
+        parsed = parse_datetime(str(value))
+    except (ValueError, OverflowError, OSError):
+        raise ImportFormatError(f'无法解析的时间: {value!r}')
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def active_branch(mapping, current_node=None):
+    """mapping 树中当前分支上的节点，按时间顺序"""
+    if current_node and current_node in mapping:
+        nodes = []
+        node_id = current_node
+        while node_id:
+            node = mapping.get(node_id)
+            if node is None:
+                break
+            nodes.append(node)
+            node_id = node.get('parent')
+        return list(reversed(nodes))
+
+    # 没有 current_node 时从根节点沿最后一个子节点(最新的重新生成)向下
+    roots = [node for node in mapping.values() if not node.get('parent')]
+    nodes = []
+    node = roots[0] if roots else None
+    while node is not None:
+        nodes.append(node)
+        children = node.get('children') or []
+        node = mapping.get(children[-1]) if children else None
+    return nodes
+
+
+def chatgpt_message(message):
+    role = (message.get('author') or {}).get('role')
+    content = message.get('content') or {}
+    parts = [part for part in content.get('parts') or [] if isinstance(part, str)]
+    text = content.get('text') if not parts else '\n'.join(parts)
+    if role not in ROLES or not text:
+        return None
+    return {'role': role, 'content': text, 'timestamp': parse_time(message.get('create_time'))}
+
+
+def deepseek_message(message):
+    fragments = message.get('fragments') or []
+    timestamp = parse_time(message.get('inserted_at'))
+    request = ''.join(f.get('content', '') for f in fragments if f.get('type') == 'REQUEST')
+    if request:
+        return {'role': 'user', 'content': request, 'timestamp': timestamp}
+    response = ''.join(f.get('content', '') for f in fragments if f.get('type') == 'RESPONSE')
+    if not response:
+        return None
+    reasoning = ''.join(f.get('content', '') for f in fragments if f.get('type') == 'THINK')
+    return {'role': 'assistant', 'content': response, 'timestamp': timestamp, 'reasoning': reasoning or None}
+
+
+def plain_message(item):
+    """JSONL 格式的一条消息；角色不支持或内容为空时返回 None"""
+    if not isinstance(item, dict):
+        raise ImportFormatError('消息应为JSON对象')
+    role, content = item.get('role'), item.get('content') or ''
+    if not isinstance(content, str):
+        raise ImportFormatError('消息内容应为字符串')
+    if not isinstance(role, str) or role not in ROLES or not content:
+        return None
+    return {
+        'role': role,
+        'content': content,
+        'timestamp': parse_time(item.get('timestamp') or item.get('created_at')),
+        'metadata': item.get('metadata'),
+    }
+
+
+def normalize(record):
+    """把一条原始记录转换为 {'title', 'created_at', 'updated_at', 'messages'}
+
+    字段类型不符合预期的记录抛出 ImportFormatError。
+    """
+    if not isinstance(record, dict):
+        raise ImportFormatError('对话记录应为JSON对象')
+    try:
+        return _normalize(record)
+    except (AttributeError, TypeError, KeyError) as e:
+        # 导出文件中的嵌套结构(mapping、fragments 等)类型不对
+        raise ImportFormatError(f'对话记录格式错误: {e}')
+
+
+def _normalize(record):
+    if 'mapping' in record:
+        messages = []
+        for node in active_branch(record['mapping'] or {}, record.get('current_node')):
+            message = node.get('message')
+            if not message:
+                continue
+            parsed = deepseek_message(message) if 'fragments' in message else chatgpt_message(message)
+            if parsed:
+                messages.append(parsed)
+        created_at = parse_time(record.get('create_time') or record.get('inserted_at'))
+        updated_at = parse_time(record.get('update_time') or record.get('updated_at'))
+    else:
+        items = record.get('messages') or []
+        if not isinstance(items, list):
+            raise ImportFormatError('messages 应为数组')
+        messages = [message for message in map(plain_message, items) if message]
+        created_at = parse_time(record.get('created_at'))
+        updated_at = parse_time(record.get('updated_at'))
+
+    title = (record.get('title') or '').strip()
+    if not title:
+        first_user = next((m['content'] for m in messages if m['role'] == 'user'), '')
+        title = first_user.strip().split('\n', 1)[0] or '导入的对话'
+    return {
+        'title': title[:TITLE_MAX_LENGTH],
+        'created_at': created_at,
+        'updated_at': updated_at,
+        'messages': messages,
+    }
+
+
+class ConversationImporter:
+    """按批写入对话和消息
+
+    auto_now/auto_now_add 会在 bulk_create 时覆盖时间字段，写入后再用
+    bulk_update 恢复导出文件中的原始时间。
+    """
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, stdout=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.conversation_ids = []
+        self.counts = {'conversations': 0, 'messages': 0, 'skipped': 0}
+        self._pending = []
+        self._pending_messages = 0
+
+    def add(self, record):
+        conversation = normalize(record)
+        if not conversation['messages']:
+            self.counts['skipped'] += 1
+            return
+        self._pending.append(conversation)
+        self._pending_messages += len(conversation['messages'])
+        if len(self._pending) >= self.batch_size or self._pending_messages >= self.batch_size * 20:
+            self.flush()
+
+    def run(self, records):
+        for record in records:
+            self.add(record)
+        self.flush()
+        return self.counts
+    
+    def finish(self, extract=True, allow_inline=False):
+        """更新统计并安排后续处理；导入中途失败时也要对已提交的批次调用"""
+        if self.conversation_ids:
+            UserStats.recompute(self.user.id)
+        batches = self.schedule_processing(extract, allow_inline)
+        self.counts['extract_batches'] = batches or 0
+        self.counts['processing_skipped'] = batches is None
+        return self.counts
+
+    @transaction.atomic
+    def flush(self):
+        if not self._pending:
+            return
+        now = timezone.now()
+        batch, self._pending, self._pending_messages = self._pending, [], 0
+
+        conversations = []
+        for item in batch:
+            timestamps = [m['timestamp'] for m in item['messages'] if m['timestamp']]
+            created_at = item['created_at'] or (min(timestamps) if timestamps else now)
+            updated_at = item['updated_at'] or (max(timestamps) if timestamps else created_at)
+            conversations.append(Conversation(
+                title=item['title'], user=self.user, created_at=created_at, updated_at=updated_at
+            ))
+        original_times = [(c.created_at, c.updated_at) for c in conversations]
+        conversations = Conversation.objects.bulk_create(conversations, batch_size=self.batch_size)
+        for conversation, (created_at, updated_at) in zip(conversations, original_times):
+            conversation.created_at, conversation.updated_at = created_at, updated_at
+        Conversation.objects.bulk_update(conversations, ['created_at', 'updated_at'], batch_size=self.batch_size)
+
+        messages = []
+        reasonings = []
+        for conversation, item in zip(conversations, batch):
+            seen = set()
+            timestamp = conversation.created_at
+            for data in item['messages']:
+                message_hash = hashlib.md5(data['content'].encode()).hexdigest()
+                # 与 (conversation, role, message_hash) 唯一约束保持一致
+                if (data['role'], message_hash) in seen:
+                    continue
+                seen.add((data['role'], message_hash))
+                timestamp = data['timestamp'] or timestamp
+                messages.append(Message(
+                    conversation=conversation, role=data['role'], content=data['content'],
+                    metadata=data.get('metadata'), message_hash=message_hash,
+                    search_tokens=index_text(data['content']), timestamp=timestamp, request_id='import',
+                ))
+                reasonings.append(data.get('reasoning'))
+        original_times = [m.timestamp for m in messages]
+        messages = Message.objects.bulk_create(messages, batch_size=self.batch_size * 4)
+        for message, timestamp in zip(messages, original_times):
+            message.timestamp = timestamp
+        Message.objects.bulk_update(messages, ['timestamp'], batch_size=self.batch_size * 4)
+        # 思考过程单独存放
+        MessageReasoning.objects.bulk_create(
+            [MessageReasoning.build(message, content)
+             for message, content in zip(messages, reasonings) if content],
+            batch_size=self.batch_size,
+        )
+
+        self.conversation_ids.extend(c.pk for c in conversations)
+        self.counts['conversations'] += len(conversations)
+        self.counts['messages'] += len(messages)
+        if self.stdout:
+            self.stdout.write(f"已导入 {self.counts['conversations']} 个对话, {self.counts['messages']} 条消息")
+
+    def schedule_processing(self, extract=True, allow_inline=False):
+        """导入事务提交后分批投递知识提取任务，最后投递一次该用户的批量向量生成
+
+        同步执行(CELERY_TASK_ALWAYS_EAGER)时投递即在当前线程中逐个调用大模型，
+        除非调用方允许(如管理命令)，否则不投递，返回 None；之后可用
+        build_embeddings 命令生成向量。
+        """
+        from .tasks import embed_pending, extract_conversations_batch
+
+        if extract_conversations_batch.app.conf.task_always_eager and not allow_inline:
+            return None
+        ids = list(self.conversation_ids) if extract else []
+        batches = [ids[i:i + EXTRACT_BATCH_SIZE] for i in range(0, len(ids), EXTRACT_BATCH_SIZE)]
+
+        def enqueue():
+            for batch in batches:
+                extract_conversations_batch.delay(batch)
+            if self.conversation_ids:
+                embed_pending.delay(user_id=self.user.id)
+
+        transaction.on_commit(enqueue)
+        return len(batches)
+
+
+def import_file(fp, user, fmt='auto', batch_size=DEFAULT_BATCH_SIZE, extract=True, stdout=None,
+                allow_inline=False):
+    """从文本文件对象导入，返回统计信息
+
+    每批单独提交，中途出错时之前的批次保留: 照常安排知识提取和向量生成，
+    已导入的统计信息放在异常的 counts 属性上后重新抛出。
+    allow_inline 见 ConversationImporter.schedule_processing。
+    """
+    importer = ConversationImporter(user, batch_size=batch_size, stdout=stdout)
+    try:
+        importer.run(iter_records(fp, fmt))
+    except Exception as e:
+        e.counts = importer.finish(extract, allow_inline)
+        raise
+    return importer.finish(extract, allow_inline)
@@ -0,0 +1,187 @@
+"""请求级性能埋点
+
+``PerformanceMiddleware`` 为每个请求建立一个 ``RequestMetrics``，记录数据库查询
+数量与耗时，以及通过 ``track()`` / ``timed()`` 标记的大模型调用、知识检索、分词和序列化耗时。
+结果以 ``Server-Timing`` 响应头和结构化日志输出，安装了 prometheus_client 且
+开启 ``PERF_PROMETHEUS_ENABLED`` 时还会导出到 ``/metrics``。
+"""
+import contextvars
+import functools
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover - 可选依赖
+    prometheus_client = None
+
+logger = logging.getLogger('knowledge.perf')
+
+_current_metrics = contextvars.ContextVar('knowledge_request_metrics', default=None)
+
+# 输出到 Server-Timing 的分项及说明
+COMPONENTS = (
+    ('db', '数据库'),
+    ('llm', '大模型调用'),
+    ('retrieval', '知识检索'),
+    ('tokenize', '分词计数'),
+    ('serialize', '序列化'),
+)
+
+
+class RequestMetrics:
+    """单个请求的耗时统计(秒)"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._depth = defaultdict(int)
+
+    def add(self, name, duration, count=1):
+        self.durations[name] += duration
+        self.counts[name] += count
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        data = {'total_ms': round(self.total * 1000, 2)}
+        for name, _ in COMPONENTS:
+            data[f'{name}_ms'] = round(self.durations[name] * 1000, 2)
+            data[f'{name}_count'] = self.counts[name]
+        return data
+
+    def server_timing(self):
+        parts = []
+        for name, _ in COMPONENTS:
+            if self.counts[name]:
+                parts.append(f'{name};dur={self.durations[name] * 1000:.2f};desc="{self.counts[name]}"')
+        parts.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def get_current_metrics():
+    return _current_metrics.get()
+
+
+@contextmanager
+def track(name):
+    """统计代码块耗时，嵌套调用同一分项时只计最外层"""
+    metrics = _current_metrics.get()
+    if metrics is None or metrics._depth[name]:
+        yield
+        return
+    metrics._depth[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._depth[name] -= 1
+        metrics.add(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """track() 的装饰器形式"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedSerializerMixin:
+    """为序列化器的 to_representation 计时"""
+
+    def to_representation(self, instance):
+        with track('serialize'):
+            return super().to_representation(instance)
+
+
+class QueryTimer:
+    """数据库 execute_wrapper，将查询数量和耗时计入当前请求"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.add('db', time.perf_counter() - start)
+
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'knowledge_request_duration_seconds', '请求总耗时', ['method', 'route', 'status'],
+    )
+    COMPONENT_LATENCY = prometheus_client.Histogram(
+        'knowledge_request_component_seconds', '请求各分项耗时', ['route', 'component'],
+    )
+    DB_QUERIES = prometheus_client.Histogram(
+        'knowledge_request_db_queries', '每请求数据库查询数', ['route'],
+        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+    )
+
+
+def prometheus_enabled():
+    return prometheus_client is not None and getattr(settings, 'PERF_PROMETHEUS_ENABLED', False)
+
+
+def metrics_view(request):
+    """Prometheus 抓取端点"""
+    if not prometheus_enabled():
+        return HttpResponse(status=404)
+    return HttpResponse(prometheus_client.generate_latest(), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+class PerformanceMiddleware:
+    """记录每个请求的数据库、大模型、分词和序列化耗时"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'PERF_SERVER_TIMING', True)
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        request.perf_metrics = metrics
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(QueryTimer(metrics)))
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing()
+
+        route = getattr(getattr(request, 'resolver_match', None), 'route', None) or 'unmatched'
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            **metrics.as_dict(),
+        }
+        logger.info(json.dumps(fields, ensure_ascii=False), extra={'perf': fields})
+
+        if prometheus_enabled():
+            REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(metrics.total)
+            for name, _ in COMPONENTS:
+                if metrics.counts[name]:
+                    COMPONENT_LATENCY.labels(route, name).observe(metrics.durations[name])
+            DB_QUERIES.labels(route).observe(metrics.counts['db'])
+        return response
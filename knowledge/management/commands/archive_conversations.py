@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.cold_storage import ARCHIVE_DAYS, archive_idle, idle_conversations, restore_conversation
+from knowledge.models import Conversation
+
+
+class Command(BaseCommand):
+    help = '把闲置对话的消息压缩后转入冷存储，或恢复指定的已归档对话'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_DAYS, help='闲置超过此天数的对话被归档')
+        parser.add_argument('--user', type=int, help='只处理指定用户ID')
+        parser.add_argument('--limit', type=int, help='本次最多归档的对话数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计将被归档的对话数')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='CONVERSATION_ID', help='恢复指定对话')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            for conversation_id in options['restore']:
+                conversation = Conversation.objects.filter(pk=conversation_id).first()
+                if conversation is None:
+                    raise CommandError(f'对话 {conversation_id} 不存在')
+                restored = restore_conversation(conversation)
+                self.stdout.write(f'对话 {conversation_id}: 恢复 {restored} 条消息')
+            return
+
+        if options['dry_run']:
+            queryset, _ = idle_conversations(options['days'], options['user'])
+            self.stdout.write(f"将归档 {queryset.count()} 个对话")
+            return
+
+        counts = archive_idle(options['days'], user_id=options['user'], limit=options['limit'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"完成, 归档 {counts['conversations']} 个对话, {counts['messages']} 条消息"
+        ))
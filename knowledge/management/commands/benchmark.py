@@ -0,0 +1,74 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from knowledge.benchmarks import BENCHMARKS, compare_with_baseline, run_case
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    help = '在独立的测试数据库中运行后端基准测试，并与保存的基线比较'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='只运行指定的用例')
+        parser.add_argument('--size', type=int, action='append', dest='sizes',
+                            help='覆盖用例的默认规模，可多次指定')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+        parser.add_argument('--save-baseline', action='store_true', help='将本次结果写入基线文件')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='允许的耗时增长比例，超过则失败(默认0.25)')
+        parser.add_argument('--list', action='store_true', help='列出所有用例')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, (_, sizes) in BENCHMARKS.items():
+                self.stdout.write(f"{name} {list(s for s in sizes if s is not None) or ''}")
+            return
+
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"未知的用例: {', '.join(unknown)}")
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = []
+            for name in names:
+                _, default_sizes = BENCHMARKS[name]
+                sizes = options['sizes'] if options['sizes'] and default_sizes != (None,) else default_sizes
+                for size in sizes:
+                    result = run_case(name, size, repeat=options['repeat'])
+                    results.append(result)
+                    self.stdout.write(
+                        f"{result['key']:<45} median={result['median_s'] * 1000:9.2f}ms "
+                        f"min={result['min_s'] * 1000:9.2f}ms queries={result['queries']}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        baseline = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        if options['save_baseline']:
+            baseline.update({r['key']: {'median_s': r['median_s'], 'queries': r['queries']} for r in results})
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w', encoding='utf-8') as f:
+                json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"基线已保存: {options['baseline']}"))
+            return
+
+        regressions = compare_with_baseline(results, baseline, options['threshold'])
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(f"检测到 {len(regressions)} 项性能回退")
+        if baseline:
+            self.stdout.write(self.style.SUCCESS('未发现性能回退'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.embeddings import CONCURRENCY, DEFAULT_CHUNK_SIZE, TARGETS, EmbeddingPipeline
+
+
+class Command(BaseCommand):
+    help = '为缺少向量或内容已变化的消息/知识点批量生成向量，支持中断后续跑'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS) + ['all'], default='all')
+        parser.add_argument('--model', help='向量模型ID，默认使用 EMBEDDING_MODEL_ID 或第一个启用的向量模型')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每次读取并写回检查点的行数')
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='并发请求数')
+        parser.add_argument('--restart', action='store_true', help='忽略检查点，从头开始')
+
+    def handle(self, *args, **options):
+        targets = list(TARGETS) if options['target'] == 'all' else [options['target']]
+        for target in targets:
+            try:
+                pipeline = EmbeddingPipeline(
+                    target, model_id=options['model'], chunk_size=options['chunk_size'],
+                    concurrency=options['concurrency'], stdout=self.stdout,
+                )
+                job = pipeline.run(restart=options['restart'])
+            except (ValueError, RuntimeError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"{target}: 完成 {job.processed} 条, 失败 {job.failed} 条, 消耗 {job.tokens} tokens"
+            ))
@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from knowledge.recommend import build_neighbors, build_recommendations
+
+
+class Command(BaseCommand):
+    help = '离线计算知识点近邻列表和用户推荐'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='只处理指定用户ID')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or get_user_model().objects.values_list('id', flat=True).iterator()
+        for user_id in user_ids:
+            points = build_neighbors(user_id)
+            recommended = build_recommendations(user_id)
+            self.stdout.write(f"用户 {user_id}: {points} 个知识点, {recommended} 条推荐")
+        self.stdout.write(self.style.SUCCESS('完成'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from knowledge.search import TARGETS, backfill_search_tokens
+
+
+class Command(BaseCommand):
+    help = '为缺少全文检索词项的知识点和消息(如批量写入的数据)补算 search_tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS) + ['all'], default='all')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        targets = list(TARGETS) if options['target'] == 'all' else [options['target']]
+        for target in targets:
+            updated = backfill_search_tokens(target, batch_size=options['batch_size'])
+            self.stdout.write(f"{target}: 补算 {updated} 条")
+        self.stdout.write(self.style.SUCCESS('完成'))
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from knowledge.dedup import MAX_DISTANCE, backfill_fingerprints, dedup_user
+
+
+class Command(BaseCommand):
+    help = '补算知识点SimHash指纹并合并近似重复的知识点'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='只处理指定用户ID')
+        parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE, help='判定为重复的最大海明距离')
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不合并')
+
+    def handle(self, *args, **options):
+        if options['max_distance'] > MAX_DISTANCE:
+            self.stdout.write(self.style.WARNING(f'海明距离超过 {MAX_DISTANCE} 时分段索引可能漏检'))
+
+        user_ids = options['users'] or get_user_model().objects.values_list('id', flat=True).iterator()
+        total = 0
+        for user_id in user_ids:
+            filled = backfill_fingerprints(user_id)
+            merged = dedup_user(user_id, max_distance=options['max_distance'], dry_run=options['dry_run'])
+            total += merged
+            self.stdout.write(f"用户 {user_id}: 补算 {filled} 个指纹, {'发现' if options['dry_run'] else '合并'} {merged} 个重复知识点")
+        self.stdout.write(self.style.SUCCESS(f'完成, 共 {total} 个重复知识点'))
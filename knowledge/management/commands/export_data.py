@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.exports import DATASETS, DEFAULT_CHUNK_SIZE, iter_rows, parse_date, write_csv, write_parquet
+
+
+class Command(BaseCommand):
+    help = '流式导出Token使用记录或对话为CSV/Parquet，内存占用与行数无关'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS), help='导出的数据集')
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+        parser.add_argument('--output', '-o', help='输出文件，CSV未指定时写到标准输出')
+        parser.add_argument('--start-date', help='起始日期 YYYY-MM-DD(含)')
+        parser.add_argument('--end-date', help='结束日期 YYYY-MM-DD(含)')
+        parser.add_argument('--user', type=int, help='只导出指定用户')
+        parser.add_argument('--model', help='只导出指定模型ID的Token使用记录')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='服务端游标每批行数')
+
+    def handle(self, *args, **options):
+        try:
+            filters = {
+                'start': parse_date(options['start_date']),
+                'end': parse_date(options['end_date'], end=True),
+                'user_id': options['user'],
+            }
+            if options['model']:
+                if options['dataset'] != 'token-usage':
+                    raise CommandError('--model 只适用于 token-usage')
+                filters['model_id'] = options['model']
+        except ValueError:
+            raise CommandError('日期格式应为YYYY-MM-DD')
+
+        rows = iter_rows(options['dataset'], chunk_size=options['chunk_size'], **filters)
+        if options['format'] == 'parquet':
+            if not options['output']:
+                raise CommandError('导出Parquet需要指定 --output')
+            try:
+                count = write_parquet(options['dataset'], rows, options['output'], batch_size=options['chunk_size'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+        elif options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                count = write_csv(options['dataset'], rows, output)
+        else:
+            count = write_csv(options['dataset'], rows, sys.stdout)
+
+        self.stderr.write(self.style.SUCCESS(f'已导出 {count} 行'))
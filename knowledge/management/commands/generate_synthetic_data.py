@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from knowledge.synthetic import DEFAULT_EPOCH, SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = '按固定种子批量生成用于规模测试的合成数据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42, help='随机种子，相同种子生成相同数据')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--conversations', type=float, default=1000, help='每用户对话数均值')
+        parser.add_argument('--messages', type=float, default=20, help='每对话消息数均值')
+        parser.add_argument('--categories', type=int, default=200, help='每用户分类数')
+        parser.add_argument('--tags', type=int, default=200, help='每用户标签数')
+        parser.add_argument('--knowledge-ratio', type=float, default=0.3,
+                            help='助手消息生成知识点的概率')
+        parser.add_argument('--token-usage', type=int, default=0, help='TokenUsage总行数')
+        parser.add_argument('--days', type=int, default=180, help='时间跨度(天)')
+        parser.add_argument('--epoch', help=f'数据的截止时间(ISO格式)，默认 {DEFAULT_EPOCH.isoformat()}')
+        parser.add_argument('--sigma', type=float, default=1.0,
+                            help='对数正态分布的离散程度，0表示固定数量')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--no-copy', action='store_true', help='不使用COPY，改用bulk_create')
+
+    def handle(self, *args, **options):
+        epoch = None
+        if options['epoch']:
+            epoch = parse_datetime(options['epoch'])
+            if epoch is None:
+                raise CommandError(f"无法解析的时间: {options['epoch']}")
+            if timezone.is_naive(epoch):
+                epoch = timezone.make_aware(epoch)
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            use_copy=not options['no_copy'],
+            days=options['days'],
+            epoch=epoch,
+            stdout=self.stdout,
+        )
+        self.stdout.write(f"写入方式: {'COPY' if generator.use_copy else 'bulk_create'}")
+
+        start = time.time()
+        counts = generator.generate(
+            users=options['users'],
+            conversations=options['conversations'],
+            messages=options['messages'],
+            categories=options['categories'],
+            tags=options['tags'],
+            knowledge_ratio=options['knowledge_ratio'],
+            token_usage=options['token_usage'],
+            sigma=options['sigma'],
+        )
+
+        for label, count in counts.items():
+            self.stdout.write(f"{label}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"完成，耗时 {time.time() - start:.1f}s"))
@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge.importers import DEFAULT_BATCH_SIZE, ImportFormatError, import_file
+
+
+class Command(BaseCommand):
+    help = '从 ChatGPT/DeepSeek 导出文件或JSONL批量导入对话和消息'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='conversations.json 或 .jsonl 文件')
+        parser.add_argument('--user', required=True, help='导入到的用户(ID或用户名)')
+        parser.add_argument('--format', choices=['auto', 'chatgpt', 'deepseek', 'json', 'jsonl'], default='auto')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批写入的对话数')
+        parser.add_argument('--no-extract', action='store_true', help='导入后不提取知识点')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"用户不存在: {options['user']}")
+
+        try:
+            with open(options['path'], encoding='utf-8-sig') as fp:
+                counts = import_file(
+                    fp, user, fmt=options['format'], batch_size=options['batch_size'],
+                    extract=not options['no_extract'], stdout=self.stdout, allow_inline=True,
+                )
+        except (OSError, ImportFormatError, UnicodeDecodeError) as e:
+            counts = getattr(e, 'counts', None)
+            if counts and counts['conversations']:
+                self.stderr.write(
+                    f"出错前已导入 {counts['conversations']} 个对话, {counts['messages']} 条消息, "
+                    f"提交 {counts['extract_batches']} 批知识提取任务"
+                )
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成: {counts['conversations']} 个对话, {counts['messages']} 条消息, "
+            f"跳过 {counts['skipped']} 个空对话, 提交 {counts['extract_batches']} 批知识提取任务"
+        ))
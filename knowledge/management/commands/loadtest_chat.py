@@ -0,0 +1,207 @@
+import contextlib
+import json
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from knowledge.ai_models import AIModel, ModelProvider, TokenUsage
+from knowledge.models import Conversation
+from knowledge.models_service import FALLBACK_RESPONSES
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    """线性插值百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+class QueryCounter:
+    """统计当前线程数据库连接上执行的查询数量和耗时"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = '对聊天链路(add_message → get_ai_response → generate_response)进行压测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='总请求数')
+        parser.add_argument('--concurrency', type=int, default=4, help='并发数')
+        parser.add_argument('--users', type=int, default=1, help='参与压测的用户数')
+        parser.add_argument('--model-id', default='mock-chat', help='使用的模型ID')
+        parser.add_argument('--start-mock', action='store_true',
+                            help='在进程内启动模拟大模型服务并指向它')
+        parser.add_argument('--mock-config', default=None,
+                            help='模拟服务配置(JSON)，如 \'{"latency": 0.1, "tokens_per_second": 200}\'')
+        parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+        parser.add_argument('--verbose', action='store_true', help='保留视图中的调试输出')
+
+    def handle(self, *args, **options):
+        mock_server = None
+        if options['start_mock']:
+            from knowledge.mock_llm import start_in_thread
+            mock_config = json.loads(options['mock_config']) if options['mock_config'] else None
+            mock_server, base_url = start_in_thread(config=mock_config)
+            self.setup_mock_model(options['model_id'], base_url)
+
+        users = self.setup_users(options['users'])
+        total = options['requests']
+        jobs = [users[i % len(users)] for i in range(total)]
+
+        started = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            if not options['verbose']:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                results = list(executor.map(
+                    lambda job: self.run_request(job[0], job[1], options['model_id']), jobs
+                ))
+        elapsed = time.perf_counter() - started
+
+        if mock_server is not None:
+            mock_server.shutdown()
+
+        report = self.build_report(results, elapsed, options)
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self.print_report(report)
+
+    def setup_mock_model(self, model_id, base_url):
+        provider, _ = ModelProvider.objects.get_or_create(
+            slug='mock',
+            defaults={'name': 'Mock', 'auth_required': False, 'description': '本地模拟服务'},
+        )
+        provider.capabilities = {**(provider.capabilities or {}), 'api_base': base_url}
+        provider.is_active = True
+        provider.save()
+        AIModel.objects.update_or_create(
+            model_id=model_id,
+            defaults={'name': 'Mock Chat', 'provider': provider, 'is_active': True},
+        )
+
+    def setup_users(self, count):
+        users = []
+        for i in range(count):
+            user, created = User.objects.get_or_create(username=f'loadtest_{i}')
+            if created:
+                user.set_unusable_password()
+                user.save()
+            token, _ = Token.objects.get_or_create(user=user)
+            conversation = Conversation.objects.create(title=f'压测会话 {uuid.uuid4().hex[:8]}', user=user)
+            users.append((token.key, conversation.id))
+        return users
+
+    def run_request(self, token, conversation_id, model_id):
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        counter = QueryCounter()
+        payload = {'message': f'压测消息 {uuid.uuid4().hex}', 'model_id': model_id}
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                response = client.post(
+                    f'/api/conversations/{conversation_id}/add_message/',
+                    data=json.dumps(payload),
+                    content_type='application/json',
+                )
+            latency = time.perf_counter() - start
+            # 同一会话可能有并发请求，按本次请求的用户消息找对应的使用记录
+            metadata = {}
+            ok = response.status_code == 200
+            if ok:
+                data = response.json()
+                usage = (
+                    TokenUsage.objects.filter(message_id=data['user_message']['id'])
+                    .order_by('-id').values('metadata', 'is_successful').first()
+                )
+                metadata = (usage or {}).get('metadata') or {}
+                # 模型调用失败时接口仍返回200和后备回复，按失败计
+                fallback = data['assistant_message']['content'] in FALLBACK_RESPONSES
+                ok = not fallback and (usage is None or usage['is_successful'])
+            return {
+                'ok': ok,
+                'status': response.status_code,
+                'latency': latency,
+                'queries': counter.count,
+                'db_time': counter.duration,
+                'ttft': metadata.get('ttft'),
+            }
+        finally:
+            connection.close()
+
+    def build_report(self, results, elapsed, options):
+        latencies = [r['latency'] for r in results]
+        queries = [r['queries'] for r in results]
+        ttfts = [r['ttft'] for r in results if r['ttft'] is not None]
+        db_times = [r['db_time'] for r in results]
+        statuses = {}
+        for r in results:
+            statuses[r['status']] = statuses.get(r['status'], 0) + 1
+
+        def summary(values, scale=1.0):
+            if not values:
+                return None
+            return {
+                'mean': statistics.mean(values) * scale,
+                'p50': percentile(values, 50) * scale,
+                'p95': percentile(values, 95) * scale,
+                'p99': percentile(values, 99) * scale,
+                'max': max(values) * scale,
+            }
+
+        return {
+            'requests': len(results),
+            'concurrency': options['concurrency'],
+            'errors': sum(1 for r in results if not r['ok']),
+            'status_codes': statuses,
+            'elapsed_s': elapsed,
+            'throughput_rps': len(results) / elapsed if elapsed else 0.0,
+            'latency_ms': summary(latencies, 1000),
+            'ttft_ms': summary(ttfts, 1000),
+            'db_time_ms': summary(db_times, 1000),
+            'queries_per_request': summary(queries),
+        }
+
+    def print_report(self, report):
+        self.stdout.write(self.style.SUCCESS('压测完成'))
+        self.stdout.write(f"请求数: {report['requests']}  并发: {report['concurrency']}  "
+                          f"失败: {report['errors']}  状态码: {report['status_codes']}")
+        self.stdout.write(f"总耗时: {report['elapsed_s']:.2f}s  吞吐量: {report['throughput_rps']:.2f} req/s")
+        for key, label in (
+            ('latency_ms', '请求延迟(ms)'),
+            ('ttft_ms', '首token延迟(ms)'),
+            ('db_time_ms', '数据库耗时(ms)'),
+            ('queries_per_request', '每请求查询数'),
+        ):
+            stats = report[key]
+            if stats is None:
+                self.stdout.write(f"{label}: 无数据")
+                continue
+            self.stdout.write(
+                f"{label}: mean={stats['mean']:.1f} p50={stats['p50']:.1f} "
+                f"p95={stats['p95']:.1f} p99={stats['p99']:.1f} max={stats['max']:.1f}"
+            )
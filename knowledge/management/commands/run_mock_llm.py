@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from knowledge.mock_llm import DEFAULT_CONFIG, serve
+
+
+class Command(BaseCommand):
+    help = '启动本地OpenAI兼容的模拟大模型服务(provider slug: mock)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', default=None,
+                            help='首token延迟: 秒数，或JSON分布，如 \'{"dist": "lognormal", "mean": 0.3, "sigma": 0.5}\'')
+        parser.add_argument('--tokens-per-second', type=float, default=DEFAULT_CONFIG['tokens_per_second'])
+        parser.add_argument('--completion-tokens', default=None, help='回复token数，如 100 或 50,200')
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--error-status', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        config = {
+            'tokens_per_second': options['tokens_per_second'],
+            'error_rate': options['error_rate'],
+            'error_status': options['error_status'],
+            'seed': options['seed'],
+        }
+        if options['latency']:
+            try:
+                config['latency'] = json.loads(options['latency'])
+            except ValueError:
+                config['latency'] = float(options['latency'])
+        if options['completion_tokens']:
+            bounds = [int(v) for v in options['completion_tokens'].split(',')]
+            config['completion_tokens'] = bounds if len(bounds) > 1 else bounds[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f"模拟大模型服务已启动: http://{options['host']}:{options['port']}/v1"
+        ))
+        try:
+            serve(options['host'], options['port'], config)
+        except KeyboardInterrupt:
+            self.stdout.write('已停止')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from knowledge.partitions import (
+    ARCHIVE_DIR, PARTITIONS_AHEAD, RETENTION_MONTHS,
+    archive_expired, ensure_partitions, is_partitioned, list_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = '维护Token使用记录的按月分区，并把超出保留期的数据归档为压缩文件后删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=PARTITIONS_AHEAD, help='提前创建的未来月份分区数')
+        parser.add_argument('--retention-months', type=int, default=RETENTION_MONTHS, help='保留最近几个月的数据')
+        parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='归档文件目录')
+        parser.add_argument('--no-archive', action='store_true', help='只创建分区，不归档')
+        parser.add_argument('--dry-run', action='store_true', help='只列出将被归档的分区')
+        parser.add_argument('--list', action='store_true', help='列出现有分区')
+
+    def handle(self, *args, **options):
+        partitioned = is_partitioned()
+        if options['list']:
+            if not partitioned:
+                self.stdout.write('Token使用记录表未分区')
+            for name, start in list_partitions() if partitioned else []:
+                self.stdout.write(f'{name}  {start:%Y-%m}')
+            return
+
+        if partitioned and not options['dry_run']:
+            for name in ensure_partitions(months_ahead=options['months_ahead']):
+                self.stdout.write(f'已创建分区 {name}')
+
+        if options['no_archive']:
+            return
+        archived = archive_expired(
+            retention_months=options['retention_months'],
+            directory=options['archive_dir'],
+            dry_run=options['dry_run'],
+        )
+        for name, path in archived:
+            action = '将归档' if options['dry_run'] else '已归档'
+            self.stdout.write(f'{action} {name} -> {path}')
+        self.stdout.write(self.style.SUCCESS(f'完成, 归档 {len(archived)} 项'))
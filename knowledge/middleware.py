@@ -1,6 +1,7 @@
 import time
 import json
 from django.utils import timezone
+from .instrumentation import get_current_metrics
 
 class RequestLogMiddleware:
     def __init__(self, get_response):
@@ -61,6 +62,12 @@ class RequestLogMiddleware:
         # 打印响应信息
         print(f"⬅️ 发送响应: {response.status_code}")
         print(f"⏱️ 耗时: {response_data['duration']}")
+        metrics = get_current_metrics()
+        if metrics is not None:
+            breakdown = metrics.as_dict()
+            print(f"📊 分项: 数据库 {breakdown['db_ms']}ms/{breakdown['db_count']}次查询, "
+                  f"大模型 {breakdown['llm_ms']}ms, 分词 {breakdown['tokenize_ms']}ms, "
+                  f"序列化 {breakdown['serialize_ms']}ms")
         if 'content' in response_data:
             print(f"📄 响应内容: {response_data['content']}")
         print("---------------------------------------------------\n")
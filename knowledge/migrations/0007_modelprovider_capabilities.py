@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_promptscene_prompttemplate_example_values_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelprovider',
+            name='capabilities',
+            field=models.JSONField(blank=True, default=dict, verbose_name='提供商能力'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+def build_category_paths(apps, schema_editor):
+    Category = apps.get_model('knowledge', 'Category')
+    nodes = list(Category.objects.only('id', 'parent_id'))
+    by_parent = {}
+    for node in nodes:
+        by_parent.setdefault(node.parent_id, []).append(node)
+
+    level = [(node, '/', -1) for node in by_parent.get(None, [])]
+    while level:
+        next_level = []
+        for node, parent_path, parent_depth in level:
+            node.path, node.depth = f"{parent_path}{node.pk}/", parent_depth + 1
+            next_level.extend((child, node.path, node.depth) for child in by_parent.get(node.pk, []))
+        level = next_level
+    Category.objects.bulk_update(nodes, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_modelprovider_capabilities'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(build_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0008_category_path_depth'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='knowledge_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('conversations', models.IntegerField(default=0)),
+                ('knowledge_points', models.IntegerField(default=0)),
+                ('categories', models.IntegerField(default=0)),
+                ('tags', models.IntegerField(default=0)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '用户统计',
+                'verbose_name_plural': '用户统计',
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0009_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgePointNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='knowledge.knowledgepoint')),
+                ('point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='knowledge.knowledgepoint')),
+            ],
+            options={
+                'verbose_name': '相似知识点',
+                'verbose_name_plural': '相似知识点',
+                'constraints': [models.UniqueConstraint(fields=('point', 'neighbor'), name='unique_knowledge_neighbor')],
+            },
+        ),
+        migrations.CreateModel(
+            name='KnowledgeRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('point', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='knowledge.knowledgepoint')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '知识点推荐',
+                'verbose_name_plural': '知识点推荐',
+                'indexes': [models.Index(fields=['user', '-score'], name='knowledge_k_user_id_add0a4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'point'), name='unique_user_recommendation')],
+            },
+        ),
+    ]
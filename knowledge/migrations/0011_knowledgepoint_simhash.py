@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0010_knowledge_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='simhash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='simhash_band0',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='simhash_band1',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='simhash_band2',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='simhash_band3',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgepoint',
+            index=models.Index(fields=['user', 'simhash_band0'], name='knowledge_k_user_id_23d9c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgepoint',
+            index=models.Index(fields=['user', 'simhash_band1'], name='knowledge_k_user_id_a8b8f1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgepoint',
+            index=models.Index(fields=['user', 'simhash_band2'], name='knowledge_k_user_id_7f2cf4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgepoint',
+            index=models.Index(fields=['user', 'simhash_band3'], name='knowledge_k_user_id_54debf_idx'),
+        ),
+    ]
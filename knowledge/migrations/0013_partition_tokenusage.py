@@ -0,0 +1,110 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.conf import settings
+from django.db import migrations
+
+# 仅PostgreSQL: 把 knowledge_tokenusage 改为按 request_time 按月范围分区的表。
+# 分区表的主键必须包含分区键，数据库中主键为 (id, request_time)；
+# id 仍由序列生成且唯一，Django 侧模型定义不变。
+TABLE = 'knowledge_tokenusage'
+OLD = 'knowledge_tokenusage_unpartitioned'
+MONTHS_AHEAD = 3
+
+
+def month_starts(cursor):
+    cursor.execute(
+        f"""
+        SELECT generate_series(
+            date_trunc('month', COALESCE((SELECT min(request_time) FROM {OLD}), now())),
+            date_trunc('month', now()) + interval '{MONTHS_AHEAD} months',
+            interval '1 month'
+        )
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def foreign_keys(apps):
+    """(列, 被引用的表)；用户表由 AUTH_USER_MODEL 决定"""
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    return (
+        ('user_id', user_table),
+        ('model_id', 'knowledge_aimodel'),
+        ('conversation_id', 'knowledge_conversation'),
+        ('message_id', 'knowledge_message'),
+    )
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD}")
+        cursor.execute(f"CREATE TABLE {TABLE} (LIKE {OLD} INCLUDING DEFAULTS) PARTITION BY RANGE (request_time)")
+        cursor.execute(f"CREATE SEQUENCE {TABLE}_part_id_seq OWNED BY {TABLE}.id")
+        cursor.execute(
+            f"SELECT setval('{TABLE}_part_id_seq', COALESCE((SELECT max(id) FROM {OLD}), 0) + 1, false)"
+        )
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_part_id_seq')")
+
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+        for start in month_starts(cursor):
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{start:%Y_%m} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)",
+                [start, end],
+            )
+
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD}")
+        cursor.execute(f"DROP TABLE {OLD}")
+
+        # 旧表删除后按原名称重建主键、索引和外键(在分区表上创建会自动作用于各分区)
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, request_time)")
+        cursor.execute(f"CREATE INDEX knowledge_t_user_id_139c3b_idx ON {TABLE} (user_id, request_time)")
+        cursor.execute(f"CREATE INDEX knowledge_t_model_i_f03239_idx ON {TABLE} (model_id, request_time)")
+        for column, target in foreign_keys(apps):
+            if column != 'user_id':
+                cursor.execute(f"CREATE INDEX {TABLE}_{column}_idx ON {TABLE} ({column})")
+            cursor.execute(
+                f"""
+                ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_{column}_fk
+                FOREIGN KEY ({column}) REFERENCES {target} (id) DEFERRABLE INITIALLY DEFERRED
+                """
+            )
+
+
+def unpartition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD}")
+        cursor.execute(f"CREATE TABLE {TABLE} (LIKE {OLD} INCLUDING DEFAULTS)")
+        cursor.execute(f"ALTER SEQUENCE {TABLE}_part_id_seq OWNED BY {TABLE}.id")
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD}")
+        cursor.execute(f"DROP TABLE {OLD} CASCADE")
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)")
+        cursor.execute(f"CREATE INDEX knowledge_t_user_id_139c3b_idx ON {TABLE} (user_id, request_time)")
+        cursor.execute(f"CREATE INDEX knowledge_t_model_i_f03239_idx ON {TABLE} (model_id, request_time)")
+        for column, target in foreign_keys(apps):
+            if column != 'user_id':
+                cursor.execute(f"CREATE INDEX {TABLE}_{column}_idx ON {TABLE} ({column})")
+            cursor.execute(
+                f"""
+                ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_{column}_fk
+                FOREIGN KEY ({column}) REFERENCES {target} (id) DEFERRABLE INITIALLY DEFERRED
+                """
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = True
+
+    dependencies = [
+        ('knowledge', '0012_tag_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
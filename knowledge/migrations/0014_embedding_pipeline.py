@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0013_partition_tokenusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='embedding_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='embedding',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='embedding_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.CreateModel(
+            name='EmbeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, unique=True)),
+                ('target', models.CharField(max_length=50)),
+                ('model_id', models.CharField(max_length=100)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('running', '运行中'), ('completed', '已完成'), ('failed', '失败')], default='running', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '向量生成任务',
+                'verbose_name_plural': '向量生成任务',
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations
+
+import knowledge.fields
+
+BATCH_SIZE = 1000
+
+
+def copy_embeddings(apps, source, target, convert):
+    for model_name in ('Message', 'KnowledgePoint'):
+        model = apps.get_model('knowledge', model_name)
+        batch = []
+        queryset = model.objects.filter(**{f'{source}__isnull': False}).only('id', source)
+        for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+            value = convert(getattr(obj, source))
+            if value is None:
+                continue
+            setattr(obj, target, value)
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, [target])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [target])
+
+
+def json_to_binary(apps, schema_editor):
+    # 只转换非空的浮点数列表
+    copy_embeddings(apps, 'embedding', 'embedding_vector', lambda value: value if isinstance(value, list) and value else None)
+
+
+def binary_to_json(apps, schema_editor):
+    copy_embeddings(apps, 'embedding_vector', 'embedding', lambda value: None if value is None else value.tolist())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0014_embedding_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='embedding_vector',
+            field=knowledge.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='embedding_vector',
+            field=knowledge.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='message',
+            name='embedding',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgepoint',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='message',
+            old_name='embedding_vector',
+            new_name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='knowledgepoint',
+            old_name='embedding_vector',
+            new_name='embedding',
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+# 仅PostgreSQL: search_tokens 的全文检索 GIN 索引，表达式需与 knowledge.search 中的查询一致
+INDEXES = [
+    ('knowledge_message_search_gin', 'knowledge_message'),
+    ('knowledge_knowledgepoint_search_gin', 'knowledge_knowledgepoint'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, table in INDEXES:
+            cursor.execute(
+                f"CREATE INDEX {name} ON {table} USING gin (to_tsvector('simple', search_tokens))"
+            )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, _ in INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0015_binary_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_tokens',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='search_tokens',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
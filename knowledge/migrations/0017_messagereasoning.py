@@ -0,0 +1,63 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def move_reasoning(apps, schema_editor):
+    """把 metadata['reasoning'] 移到 MessageReasoning"""
+    Message = apps.get_model('knowledge', 'Message')
+    MessageReasoning = apps.get_model('knowledge', 'MessageReasoning')
+    queryset = Message.objects.filter(metadata__has_key='reasoning').only('id', 'metadata')
+    messages, reasonings = [], []
+
+    def flush():
+        MessageReasoning.objects.bulk_create(reasonings, ignore_conflicts=True)
+        Message.objects.bulk_update(messages, ['metadata'])
+        messages.clear()
+        reasonings.clear()
+
+    for message in queryset.iterator(chunk_size=BATCH_SIZE):
+        content = message.metadata.pop('reasoning')
+        if content:
+            reasonings.append(MessageReasoning(message_id=message.id, content=content))
+        message.metadata = message.metadata or None
+        messages.append(message)
+        if len(messages) >= BATCH_SIZE:
+            flush()
+    if messages:
+        flush()
+
+
+def restore_reasoning(apps, schema_editor):
+    Message = apps.get_model('knowledge', 'Message')
+    MessageReasoning = apps.get_model('knowledge', 'MessageReasoning')
+    for reasoning in MessageReasoning.objects.iterator(chunk_size=BATCH_SIZE):
+        message = Message.objects.only('id', 'metadata').get(pk=reasoning.message_id)
+        message.metadata = {**(message.metadata or {}), 'reasoning': reasoning.content}
+        message.save(update_fields=['metadata'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0016_search_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReasoning',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reasoning', serialize=False, to='knowledge.message')),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '思考过程',
+                'verbose_name_plural': '思考过程',
+            },
+        ),
+        migrations.RunPython(move_reasoning, restore_reasoning),
+    ]
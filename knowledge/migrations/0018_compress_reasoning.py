@@ -0,0 +1,87 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+import zlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def compress_reasoning(apps, schema_editor):
+    """压缩已有的思考过程，并把挂在用户消息上的记录移到紧随其后的助手回复上"""
+    Message = apps.get_model('knowledge', 'Message')
+    MessageReasoning = apps.get_model('knowledge', 'MessageReasoning')
+    # 先取出全部主键，避免遍历过程中读到刚迁移过去的记录
+    pks = list(MessageReasoning.objects.values_list('pk', flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = MessageReasoning.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).select_related('message')
+        for reasoning in batch:
+            compress_one(Message, MessageReasoning, reasoning)
+    if schema_editor.connection.vendor == 'postgresql':
+        # 改挂消息时外键检查是延迟的，先执行完，否则随后删除 content 列的
+        # ALTER TABLE 会因 "pending trigger events" 失败
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def compress_one(Message, MessageReasoning, reasoning):
+    raw = reasoning.content.encode('utf-8')
+    fields = {'codec': 'zlib', 'data': zlib.compress(raw, 6), 'size': len(reasoning.content)}
+    message = reasoning.message
+    if message.role == 'user':
+        reply_id = (
+            Message.objects.filter(
+                conversation_id=message.conversation_id, role='assistant', timestamp__gte=message.timestamp,
+            )
+            .exclude(reasoning__isnull=False)
+            .order_by('timestamp', 'id').values_list('id', flat=True).first()
+        )
+        if reply_id is not None:
+            fields['message_id'] = reply_id
+    MessageReasoning.objects.filter(pk=reasoning.pk).update(**fields)
+
+
+def decompress_reasoning(apps, schema_editor):
+    MessageReasoning = apps.get_model('knowledge', 'MessageReasoning')
+    for reasoning in MessageReasoning.objects.iterator(chunk_size=BATCH_SIZE):
+        if reasoning.codec != 'zlib':
+            raise RuntimeError(f'无法回滚 {reasoning.codec} 编码的思考过程')
+        content = zlib.decompress(bytes(reasoning.data)).decode('utf-8')
+        MessageReasoning.objects.filter(pk=reasoning.pk).update(content=content)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0017_messagereasoning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagereasoning',
+            name='codec',
+            field=models.CharField(default='zlib', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='messagereasoning',
+            name='data',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='messagereasoning',
+            name='size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(compress_reasoning, decompress_reasoning),
+        # 回滚时 content 列先于 decompress_reasoning 重新加回，需要有默认值
+        migrations.AlterField(
+            model_name='messagereasoning',
+            name='content',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='messagereasoning',
+            name='content',
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+import base64
+import json
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+
+from knowledge.compression import compress, decompress
+
+BATCH_SIZE = 500
+
+
+def restore_archives(apps, schema_editor):
+    """回滚前把已归档对话的消息写回消息表，否则删除归档表会丢失这些消息
+
+    与 knowledge.cold_storage.restore_conversation 相同，但只使用历史模型；
+    search_tokens 留空，之后执行 build_search_index 补算。
+    """
+    Conversation = apps.get_model('knowledge', 'Conversation')
+    ConversationArchive = apps.get_model('knowledge', 'ConversationArchive')
+    Message = apps.get_model('knowledge', 'Message')
+    MessageReasoning = apps.get_model('knowledge', 'MessageReasoning')
+    TokenUsage = apps.get_model('knowledge', 'TokenUsage')
+    for archive in ConversationArchive.objects.iterator(chunk_size=10):
+        payload = json.loads(decompress(archive.codec, archive.data))
+        entries = payload['messages']
+        messages = [
+            Message(
+                id=data['id'],
+                conversation_id=archive.conversation_id,
+                role=data['role'],
+                content=data['content'],
+                metadata=data['metadata'],
+                message_hash=data['message_hash'],
+                request_id=data['request_id'],
+                embedding=base64.b64decode(data['embedding']) if data['embedding'] else None,
+                embedding_hash=data['embedding_hash'],
+            )
+            for data in entries
+        ]
+        Message.objects.bulk_create(messages, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        restored = set(Message.objects.filter(id__in=[data['id'] for data in entries]).values_list('id', flat=True))
+        # bulk_create 会用 auto_now_add 覆盖时间，写入后恢复原始时间
+        for message, data in zip(messages, entries):
+            message.timestamp = parse_datetime(data['timestamp'])
+        Message.objects.bulk_update([m for m in messages if m.id in restored], ['timestamp'], batch_size=BATCH_SIZE)
+        reasonings = []
+        for data in entries:
+            if data['reasoning'] and data['id'] in restored:
+                codec, blob = compress(data['reasoning'], 'zlib')
+                reasonings.append(MessageReasoning(
+                    message_id=data['id'], codec=codec, data=blob, size=len(data['reasoning']),
+                ))
+        MessageReasoning.objects.bulk_create(reasonings, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        for message_id, usage_ids in payload['token_usage'].items():
+            if int(message_id) in restored:
+                TokenUsage.objects.filter(id__in=usage_ids, message_id__isnull=True).update(message_id=int(message_id))
+        Conversation.objects.filter(pk=archive.conversation_id).update(archived_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0018_compress_reasoning'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='restored_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', '-updated_at'], name='conversation_user_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='ConversationArchive',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='knowledge.conversation')),
+                ('codec', models.CharField(default='zlib', max_length=10)),
+                ('data', models.BinaryField()),
+                ('message_count', models.IntegerField(default=0)),
+                ('size', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '对话归档',
+                'verbose_name_plural': '对话归档',
+            },
+        ),
+        # 回滚时逆序执行: 在删除归档表之前恢复消息
+        migrations.RunPython(migrations.RunPython.noop, restore_archives),
+    ]
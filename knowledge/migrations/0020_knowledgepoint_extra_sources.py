@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0019_conversation_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgepoint',
+            name='extra_sources',
+            field=models.ManyToManyField(blank=True, related_name='merged_points', to='knowledge.message'),
+        ),
+    ]
@@ -0,0 +1,259 @@
+"""本地OpenAI兼容的模拟大模型服务
+
+用于在不调用付费接口的情况下压测 add_message → get_ai_response → generate_response
+整条链路。支持流式/非流式响应和 embeddings 接口、可配置的延迟分布、生成速率和错误注入。
+
+每个请求可以通过请求体中的 ``mock`` 字段覆盖默认配置，对应到模型或提供商的
+``capabilities.extra_body``，例如::
+
+    {"extra_body": {"mock": {"latency": {"dist": "lognormal", "mean": 0.3, "sigma": 0.5},
+                             "tokens_per_second": 80, "error_rate": 0.01}}}
+"""
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONFIG = {
+    # 首token延迟分布: fixed / uniform / normal / lognormal
+    'latency': {'dist': 'fixed', 'value': 0.2},
+    # 生成速率(token/秒)，0表示不限速
+    'tokens_per_second': 50,
+    # 回复长度(token数)，整数或 [最小值, 最大值]
+    'completion_tokens': [50, 200],
+    # 每个流式分片包含的token数
+    'tokens_per_chunk': 4,
+    # 错误注入
+    'error_rate': 0.0,
+    'error_status': 500,
+    # 随机种子，None表示不固定
+    'seed': None,
+}
+
+# 模拟 embeddings 接口的默认向量维度
+EMBEDDING_DIMENSIONS = 256
+
+WORDS = [
+    '知识', '模型', '数据', '分析', '系统', '结构', '学习', '方法', '问题', '结果',
+    'the', 'model', 'data', 'query', 'index', 'cache', 'token', 'latency', 'vector', 'search',
+]
+
+
+def sample_latency(spec, rng):
+    """按配置的分布采样延迟(秒)"""
+    if isinstance(spec, (int, float)):
+        return max(0.0, float(spec))
+    dist = spec.get('dist', 'fixed')
+    if dist == 'uniform':
+        value = rng.uniform(spec.get('min', 0.0), spec.get('max', 1.0))
+    elif dist == 'normal':
+        value = rng.gauss(spec.get('mean', 0.2), spec.get('stddev', 0.05))
+    elif dist == 'lognormal':
+        # mean 为中位数，sigma 为对数标准差，便于模拟长尾
+        value = rng.lognormvariate(math.log(max(spec.get('mean', 0.2), 1e-6)), spec.get('sigma', 0.5))
+    else:
+        value = spec.get('value', 0.0)
+    return max(0.0, float(value))
+
+
+def estimate_prompt_tokens(messages):
+    """粗略估算提示词token数，与OpenAI的格式开销保持同一量级"""
+    total = 0
+    for message in messages or []:
+        content = message.get('content') or ''
+        total += len(content) // 2 + 4
+    return total + 2
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """带默认配置的多线程HTTP服务"""
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, MockLLMHandler)
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        seed = self.config.get('seed')
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def request_rng(self):
+        """为每个请求派生独立的随机数生成器，保证固定种子下结果可复现"""
+        with self.rng_lock:
+            return random.Random(self.rng.random())
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: MockLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self.send_json(200, {'object': 'list', 'data': [
+                {'id': 'mock-chat', 'object': 'model', 'owned_by': 'mock'},
+                {'id': 'mock-embedding', 'object': 'model', 'owned_by': 'mock'},
+            ]})
+        else:
+            self.send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'invalid json', 'type': 'invalid_request_error'}})
+            return
+
+        if self.path.rstrip('/').endswith('/embeddings'):
+            self.send_embeddings(body)
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+            return
+
+        config = {**self.server.config, **(body.get('mock') or {})}
+        rng = self.server.request_rng()
+
+        time.sleep(sample_latency(config['latency'], rng))
+
+        if config['error_rate'] and rng.random() < config['error_rate']:
+            self.send_json(config['error_status'], {
+                'error': {'message': 'injected mock error', 'type': 'server_error', 'code': config['error_status']}
+            })
+            return
+
+        length_spec = config['completion_tokens']
+        if isinstance(length_spec, (list, tuple)):
+            n_tokens = rng.randint(int(length_spec[0]), int(length_spec[1]))
+        else:
+            n_tokens = int(length_spec)
+        tokens = [rng.choice(WORDS) + ' ' for _ in range(n_tokens)]
+        usage = {
+            'prompt_tokens': estimate_prompt_tokens(body.get('messages')),
+            'completion_tokens': n_tokens,
+            'total_tokens': 0,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        model = body.get('model', 'mock-chat')
+        if body.get('stream'):
+            include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+            self.stream_completion(completion_id, model, tokens, usage if include_usage else None, config)
+        else:
+            rate = config['tokens_per_second']
+            if rate:
+                time.sleep(n_tokens / rate)
+            self.send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+
+    def send_embeddings(self, body):
+        """按文本哈希生成确定性的单位向量，相同输入总是得到相同结果"""
+        config = {**self.server.config, **(body.get('mock') or {})}
+        rng = self.server.request_rng()
+        time.sleep(sample_latency(config['latency'], rng))
+        if config['error_rate'] and rng.random() < config['error_rate']:
+            self.send_json(config['error_status'], {
+                'error': {'message': 'injected mock error', 'type': 'server_error', 'code': config['error_status']}
+            })
+            return
+
+        texts = body.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        dimensions = int(body.get('dimensions') or EMBEDDING_DIMENSIONS)
+        data = []
+        for index, text in enumerate(texts):
+            text_rng = random.Random(hashlib.md5(str(text).encode('utf-8')).hexdigest())
+            vector = [text_rng.gauss(0, 1) for _ in range(dimensions)]
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            data.append({'object': 'embedding', 'index': index, 'embedding': [v / norm for v in vector]})
+        prompt_tokens = sum(len(str(text)) // 2 + 1 for text in texts)
+        self.send_json(200, {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model', 'mock-embedding'),
+            'usage': {'prompt_tokens': prompt_tokens, 'total_tokens': prompt_tokens},
+        })
+
+    def stream_completion(self, completion_id, model, tokens, usage, config):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def chunk(choices, chunk_usage=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': choices,
+            }
+            if chunk_usage is not None:
+                payload['usage'] = chunk_usage
+            self.write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n")
+
+        step = max(1, int(config['tokens_per_chunk']))
+        rate = config['tokens_per_second']
+        chunk([{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])
+        for i in range(0, len(tokens), step):
+            piece = tokens[i:i + step]
+            chunk([{'index': 0, 'delta': {'content': ''.join(piece)}, 'finish_reason': None}])
+            if rate:
+                time.sleep(len(piece) / rate)
+        chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if usage is not None:
+            chunk([], usage)
+        self.write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host='127.0.0.1', port=8765, config=None):
+    """启动模拟服务(阻塞)"""
+    server = MockLLMServer((host, port), config)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, config=None):
+    """在后台线程中启动模拟服务，返回 (server, base_url)"""
+    server = MockLLMServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
@@ -0,0 +1,42 @@
+"""可用AI模型目录缓存
+
+序列化后的目录按版本号保存在共享缓存中，各进程另有一份本地副本。
+模型或提供商发生写入(信号、queryset.update 之后的显式调用)时递增版本号，
+旧版本的缓存条目随之失效，无需逐个删除。
+"""
+from django.conf import settings
+
+from knowledge_hub.cache import TieredCache
+
+CATALOG_TTL = getattr(settings, 'MODEL_CATALOG_CACHE_TTL', 60 * 60)
+# 本地副本按版本号取用，版本号本身只在本地保留几秒，决定多久回共享缓存确认一次
+LOCAL_VERSION_TTL = getattr(settings, 'MODEL_CATALOG_LOCAL_TTL', 5)
+
+catalog_cache = TieredCache('ai-models', timeout=CATALOG_TTL, local_ttl=CATALOG_TTL, local_size=8)
+
+VERSION_KEY = 'catalog:version'
+
+
+def get_version():
+    version = catalog_cache.get(VERSION_KEY, local_ttl=LOCAL_VERSION_TTL)
+    if version is None:
+        catalog_cache.add(VERSION_KEY, 1, timeout=None)
+        version = catalog_cache.get(VERSION_KEY, 1, local_ttl=LOCAL_VERSION_TTL)
+    return version
+
+
+def bump_version():
+    """目录发生变化后调用"""
+    version = catalog_cache.incr(VERSION_KEY)
+    catalog_cache.clear_local()
+    return version
+
+
+def catalog_key(version):
+    return f'available:v{version}'
+
+
+def get_available_catalog(build):
+    """返回 (版本号, 序列化后的可用模型列表)，未命中时调用 build() 生成"""
+    version = get_version()
+    return version, catalog_cache.get_or_set(catalog_key(version), build)
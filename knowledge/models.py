@@ -1,11 +1,24 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Concat, Length, Now, Substr
 from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .fields import VectorField
 
 class Category(models.Model):
-    """知识分类"""
+    """知识分类
+
+    除 parent 邻接表外还维护物化路径 path (形如 "/1/5/9/")，
+    子树查询只需 path 前缀匹配，无需逐层递归。
+    """
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    path = models.CharField(max_length=500, blank=True, db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -17,11 +30,75 @@ class Category(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def build_path(self, old_path=''):
+        if self.parent_id is None:
+            return f"/{self.pk}/", 0
+        parent = Category.objects.only('path', 'depth').get(pk=self.parent_id)
+        if old_path and parent.path.startswith(old_path):
+            raise ValidationError('不能将分类移动到它自己的子分类下')
+        return f"{parent.path}{self.pk}/", parent.depth + 1
+    
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk:
+            old = Category.objects.filter(pk=self.pk).values('parent_id', 'path', 'depth').first()
+            if old:
+                # 以数据库中的路径为准，避免过期实例覆盖祖先移动后的新路径
+                self.path, self.depth = old['path'], old['depth']
+        super().save(*args, **kwargs)
+        
+        if old and old['parent_id'] == self.parent_id and old['path']:
+            return
+        old_path, old_depth = (old['path'], old['depth']) if old else ('', 0)
+        self.path, self.depth = self.build_path(old_path)
+        Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        
+        # 移动分类时整体改写子孙节点的路径前缀
+        if old_path and old_path != self.path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_depth),
+                updated_at=Now(),
+            )
+    
+    def get_descendants(self, include_self=True):
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+    
+    @classmethod
+    def rebuild_paths(cls, user_id=None):
+        """按层级重建物化路径，用于批量写入(bulk_create/COPY)之后"""
+        queryset = cls.objects.all()
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        nodes = list(queryset.only('id', 'parent_id', 'path', 'depth'))
+        by_parent = {}
+        for node in nodes:
+            by_parent.setdefault(node.parent_id, []).append(node)
+        
+        level = [(node, '/', -1) for node in by_parent.get(None, [])]
+        changed = []
+        while level:
+            next_level = []
+            for node, parent_path, parent_depth in level:
+                path, depth = f"{parent_path}{node.pk}/", parent_depth + 1
+                if node.path != path or node.depth != depth:
+                    node.path, node.depth = path, depth
+                    changed.append(node)
+                next_level.extend((child, path, depth) for child in by_parent.get(node.pk, []))
+            level = next_level
+        cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=1000)
+        return len(changed)
 
 class Tag(models.Model):
     """标签"""
     name = models.CharField(max_length=50)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = "标签"
@@ -40,15 +117,57 @@ class Conversation(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 消息转入冷存储(ConversationArchive)的时间，为空表示消息在消息表中
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # 最近一次从冷存储恢复的时间，恢复后同样闲置满期限才会再次归档
+    restored_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     class Meta:
         verbose_name = "对话"
         verbose_name_plural = "对话"
         ordering = ['-updated_at']
+        indexes = [
+            # 对话列表按用户过滤、按更新时间倒序
+            models.Index(fields=['user', '-updated_at'], name='conversation_user_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
+class EmbeddingQuerySet(models.QuerySet):
+    def with_embedding(self):
+        """需要向量时显式加载(默认管理器不读取该列)"""
+        return self.defer(None)
+
+
+class EmbeddingManager(models.Manager.from_queryset(EmbeddingQuerySet)):
+    """默认延迟加载向量和检索词项，列表、详情和关联查询都不会取出这些大字段"""
+    deferred_fields = ('embedding', 'search_tokens')
+    
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.deferred_fields)
+
+
+class MessageQuerySet(EmbeddingQuerySet):
+    """按使用场景只取需要的列"""
+    PREVIEW_LENGTH = 200
+    
+    def for_list(self):
+        """列表: 不取正文，只带前 PREVIEW_LENGTH 个字符的预览(preview)和正文长度(content_length)"""
+        return self.only('id', 'conversation_id', 'role', 'timestamp').annotate(
+            preview=Substr('content', 1, self.PREVIEW_LENGTH),
+            content_length=Length('content'),
+        )
+    
+    def for_history(self):
+        """对话历史/详情: 正文和元数据(引用来源)，不含哈希、请求ID等内部字段"""
+        return self.only('id', 'conversation_id', 'role', 'content', 'metadata', 'timestamp').with_reasoning_flag()
+    
+    def with_reasoning_flag(self):
+        """标注是否有思考过程(has_reasoning)，不读取其内容"""
+        return self.annotate(has_reasoning=Exists(MessageReasoning.objects.filter(message=OuterRef('pk'))))
+
+
 class Message(models.Model):
     """对话消息"""
     ROLE_CHOICES = [
@@ -60,7 +179,7 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
-    embedding = models.JSONField(null=True, blank=True)
+    embedding = VectorField(null=True, blank=True)
     metadata = models.JSONField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     
@@ -68,6 +187,12 @@ class Message(models.Model):
     message_hash = models.CharField(max_length=40, blank=True, null=True, db_index=True)
     # 或者添加一个请求ID字段
     request_id = models.CharField(max_length=100, blank=True, null=True)
+    # 生成 embedding 时对应的 message_hash，与当前值不同说明需要重新计算
+    embedding_hash = models.CharField(max_length=40, blank=True, null=True, editable=False)
+    # 全文检索词项(见 knowledge.search)
+    search_tokens = models.TextField(blank=True, null=True, editable=False)
+    
+    objects = EmbeddingManager.from_queryset(MessageQuerySet)()
     
     class Meta:
         verbose_name = "消息"
@@ -82,32 +207,279 @@ class Message(models.Model):
             ),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录读取时的内容(未读取 content 时为 None)，保存时据此判断内容是否被修改
+        instance._loaded_content = instance.__dict__.get('content')
+        return instance
+    
+    def content_changed(self):
+        if self._state.adding:
+            return False
+        loaded = getattr(self, '_loaded_content', None)
+        if loaded is None:
+            # 读取时延迟了 content，只能与哈希比较
+            return self.message_hash != hashlib.md5(self.content.encode()).hexdigest()
+        return self.content != loaded
+    
     def save(self, *args, **kwargs):
-        # 生成消息哈希值（如果未提供）
-        if not self.message_hash and self.content:
-            import hashlib
+        from .search import index_text
+        # 生成消息哈希值（如果未提供）；内容修改后重新计算，向量也随之标记为待更新
+        if self.content and (not self.message_hash or self.content_changed()):
             self.message_hash = hashlib.md5(self.content.encode()).hexdigest()
+        self.search_tokens = index_text(self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['message_hash', 'search_tokens']
         super().save(*args, **kwargs)
+        self._loaded_content = self.content
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
 
+class MessageReasoning(models.Model):
+    """模型的思考过程
+
+    推理模型的思考过程往往比回复本身长得多，压缩后单独存放，关联到对应的
+    助手消息，只在需要时按消息读取，消息表保持窄行。
+    """
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, primary_key=True, related_name='reasoning')
+    codec = models.CharField(max_length=10, default='zlib')
+    data = models.BinaryField()
+    size = models.IntegerField(default=0)  # 原文字符数
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "思考过程"
+        verbose_name_plural = "思考过程"
+    
+    def __str__(self):
+        return f"{self.message_id} 的思考过程"
+    
+    @classmethod
+    def build(cls, message, text):
+        """压缩并构造(未保存的)实例，供 bulk_create 使用"""
+        from .compression import compress
+        codec, data = compress(text)
+        return cls(message=message, codec=codec, data=data, size=len(text))
+    
+    @classmethod
+    def store(cls, message, text):
+        reasoning = cls.build(message, text)
+        reasoning.save()
+        return reasoning
+    
+    @property
+    def content(self):
+        from .compression import decompress
+        return decompress(self.codec, self.data)
+
+class ConversationArchive(models.Model):
+    """冷存储中的对话消息
+
+    闲置对话的消息(含思考过程和向量)序列化后压缩为一个 blob，从消息表
+    删除；打开对话时按原ID写回(见 knowledge.cold_storage)。
+    """
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True,
+                                        related_name='archive')
+    codec = models.CharField(max_length=10, default='zlib')
+    data = models.BinaryField()
+    message_count = models.IntegerField(default=0)
+    size = models.IntegerField(default=0)  # 压缩前的字符数
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "对话归档"
+        verbose_name_plural = "对话归档"
+    
+    def __str__(self):
+        return f"{self.conversation_id} 的归档"
+
 class KnowledgePoint(models.Model):
     """知识点"""
     title = models.CharField(max_length=200)
     content = models.TextField()
     source_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True)
+    # source_message 之外的来源: 合并的重复知识点的来源、再次提取出同一知识点的消息
+    extra_sources = models.ManyToManyField(Message, blank=True, related_name='merged_points')
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # 标题+内容的SimHash指纹及其16位分段，用于近似重复检测(见 knowledge.dedup)
+    simhash = models.BigIntegerField(null=True, blank=True, editable=False)
+    simhash_band0 = models.IntegerField(null=True, blank=True, editable=False)
+    simhash_band1 = models.IntegerField(null=True, blank=True, editable=False)
+    simhash_band2 = models.IntegerField(null=True, blank=True, editable=False)
+    simhash_band3 = models.IntegerField(null=True, blank=True, editable=False)
+    
+    # 标题+内容的md5，及生成 embedding 时的取值(见 knowledge.embeddings)
+    content_hash = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    embedding = VectorField(null=True, blank=True)
+    embedding_hash = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    # 全文检索词项(见 knowledge.search)
+    search_tokens = models.TextField(null=True, blank=True, editable=False)
+    
+    objects = EmbeddingManager()
+    
     class Meta:
         verbose_name = "知识点"
         verbose_name_plural = "知识点"
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', 'simhash_band0']),
+            models.Index(fields=['user', 'simhash_band1']),
+            models.Index(fields=['user', 'simhash_band2']),
+            models.Index(fields=['user', 'simhash_band3']),
+        ]
     
     def __str__(self):
         return self.title
+    
+    @staticmethod
+    def make_content_hash(title, content):
+        return hashlib.md5(f"{title}\n{content}".encode()).hexdigest()
+    
+    def save(self, *args, **kwargs):
+        from .dedup import fingerprint
+        from .search import index_text
+        for name, value in fingerprint(self.title, self.content).items():
+            setattr(self, name, value)
+        self.content_hash = self.make_content_hash(self.title, self.content)
+        self.search_tokens = index_text(self.title, self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'title', 'content'} & set(update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['simhash', 'simhash_band0', 'simhash_band1',
+                                                             'simhash_band2', 'simhash_band3', 'content_hash',
+                                                             'search_tokens']
+        super().save(*args, **kwargs)
 
+
+class UserStats(models.Model):
+    """用户知识库统计
+
+    计数由 knowledge.signals 在对话、知识点、分类、标签增删时增量维护；
+    version 在任何相关数据(含消息的增删)变化时递增，用作"最近内容"、检索结果
+    缓存和对话列表 ETag 的版本号。
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                primary_key=True, related_name='knowledge_stats')
+    conversations = models.IntegerField(default=0)
+    knowledge_points = models.IntegerField(default=0)
+    categories = models.IntegerField(default=0)
+    tags = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "用户统计"
+        verbose_name_plural = "用户统计"
+    
+    def __str__(self):
+        return f"{self.user_id} 的统计"
+    
+    @classmethod
+    def bump(cls, user_id, field=None, delta=0):
+        """调整计数并递增版本号；统计行不存在时跳过，读取时再全量计算"""
+        updates = {'version': F('version') + 1}
+        if field:
+            updates[field] = F(field) + delta
+        cls.objects.filter(user_id=user_id).update(**updates)
+    
+    @classmethod
+    def bump_for_conversation(cls, conversation_id):
+        """递增对话所属用户的版本号，一条 UPDATE 完成，不需要先取出用户ID"""
+        user_id = Conversation.objects.filter(pk=conversation_id).values('user_id')[:1]
+        cls.objects.filter(user_id=Subquery(user_id)).update(version=F('version') + 1)
+    
+    @classmethod
+    def recompute(cls, user_id):
+        """全量重新计算，用于首次读取或批量写入之后"""
+        counts = {
+            'conversations': Conversation.objects.filter(user_id=user_id).count(),
+            'knowledge_points': KnowledgePoint.objects.filter(user_id=user_id).count(),
+            'categories': Category.objects.filter(user_id=user_id).count(),
+            'tags': Tag.objects.filter(user_id=user_id).count(),
+        }
+        stats, created = cls.objects.get_or_create(user_id=user_id, defaults=counts)
+        if not created:
+            cls.objects.filter(user_id=user_id).update(version=F('version') + 1, **counts)
+            stats.refresh_from_db()
+        return stats
+    
+    @classmethod
+    def for_user(cls, user_id):
+        stats = cls.objects.filter(user_id=user_id).first()
+        return stats if stats is not None else cls.recompute(user_id)
+
+class KnowledgePointNeighbor(models.Model):
+    """知识点的近邻列表(离线计算的内容相似度 top-k)"""
+    point = models.ForeignKey(KnowledgePoint, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(KnowledgePoint, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    
+    class Meta:
+        verbose_name = "相似知识点"
+        verbose_name_plural = "相似知识点"
+        constraints = [
+            models.UniqueConstraint(fields=['point', 'neighbor'], name='unique_knowledge_neighbor'),
+        ]
+    
+    def __str__(self):
+        return f"{self.point_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+class KnowledgeRecommendation(models.Model):
+    """为用户预先计算的知识点推荐"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    point = models.ForeignKey(KnowledgePoint, on_delete=models.CASCADE, related_name='recommendations')
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "知识点推荐"
+        verbose_name_plural = "知识点推荐"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'point'], name='unique_user_recommendation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.point_id} ({self.score:.3f})"
+
+class EmbeddingJob(models.Model):
+    """批量生成 embedding 的进度检查点
+
+    每个 (目标, 模型) 一行；按主键顺序处理，每写回一批就推进 last_id，
+    进程中断后从 last_id 之后继续。上一轮已完成时，下一轮从头重新扫描
+    缺少向量或内容有变化的行。
+    """
+    STATUS_CHOICES = [
+        ('running', '运行中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+    
+    name = models.CharField(max_length=150, unique=True)
+    target = models.CharField(max_length=50)
+    model_id = models.CharField(max_length=100)
+    last_id = models.BigIntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    tokens = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "向量生成任务"
+        verbose_name_plural = "向量生成任务"
+    
+    def __str__(self):
+        return f"{self.name} ({self.status}, last_id={self.last_id})"
@@ -2,17 +2,21 @@ import os
 import json
 import time
 import requests
+import threading
 import tiktoken
 import openai
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 from typing import List, Dict, Any, Optional, Tuple
 
 from knowledge.ai_models import ModelProvider, AIModel, TokenUsage
+from knowledge.instrumentation import timed, track
 
 class TokenCounter:
     """Token计数工具"""
     @staticmethod
+    @timed('tokenize')
     def count_tokens(text: str, model_name: str) -> int:
         """计算文本的token数量"""
         try:
@@ -30,6 +34,7 @@ class TokenCounter:
                 return chinese_chars + english_words
 
     @staticmethod
+    @timed('tokenize')
     def count_message_tokens(messages: List[Dict[str, str]], model_name: str) -> int:
         """计算消息列表的token数量"""
         total_tokens = 0
@@ -43,17 +48,98 @@ class TokenCounter:
         # 额外添加2个tokens作为格式开销
         return total_tokens + 2
 
+# 所有提供商共用的默认能力描述
+DEFAULT_CAPABILITIES = {
+    'api_base': '',                # 默认API基础URL
+    'token_model': None,           # 用于本地计数的tokenizer模型名，None表示使用model_id
+    'params': ['max_tokens', 'temperature', 'top_p'],  # 支持的采样参数
+    'stream_usage': True,          # 流式响应是否支持 stream_options.include_usage
+    'reasoning': False,            # 增量中是否携带 reasoning_content
+    'extra_body': {},              # 透传给接口的额外参数
+    'timeout': 60,                 # 请求超时(秒)
+    'embedding_batch_size': 64,    # 每次 embeddings 请求最多的输入条数
+    'embedding_batch_tokens': 8000,  # 每次 embeddings 请求最多的token数
+    'rate_limit_rpm': None,        # 每分钟请求数上限，None表示不限
+    'rate_limit_tpm': None,        # 每分钟token数上限，None表示不限
+}
+
+# 已注册的OpenAI兼容提供商: slug -> 能力描述
+PROVIDER_REGISTRY: Dict[str, Dict[str, Any]] = {}
+
+
+def register_provider(slug: str, **capabilities) -> Dict[str, Any]:
+    """注册OpenAI兼容的模型提供商
+
+    capabilities 会覆盖 DEFAULT_CAPABILITIES 中的同名项；数据库中
+    ModelProvider.capabilities 与 AIModel.capabilities 可以再逐级覆盖。
+    """
+    unknown = set(capabilities) - set(DEFAULT_CAPABILITIES)
+    if unknown:
+        raise ValueError(f"未知的提供商能力: {', '.join(sorted(unknown))}")
+    PROVIDER_REGISTRY[slug] = {**DEFAULT_CAPABILITIES, **capabilities}
+    return PROVIDER_REGISTRY[slug]
+
+
+register_provider(
+    'openai',
+    api_base='https://api.openai.com/v1',
+    params=['max_tokens', 'temperature', 'top_p', 'presence_penalty', 'frequency_penalty'],
+)
+register_provider(
+    'aliyun',
+    api_base='https://dashscope.aliyuncs.com/compatible-mode/v1',
+    token_model='qwen',
+    reasoning=True,
+)
+register_provider(
+    'deepseek',
+    api_base='https://api.deepseek.com/v1',
+    token_model='deepseek',
+    reasoning=True,
+)
+# 本地模拟服务(python manage.py run_mock_llm)，用于压测和基准测试
+register_provider(
+    'mock',
+    api_base=getattr(settings, 'MOCK_LLM_URL', 'http://127.0.0.1:8765/v1'),
+    params=['max_tokens', 'temperature', 'top_p', 'presence_penalty', 'frequency_penalty'],
+)
+
+
+# 共享的客户端连接池: (api_key, base_url, timeout) -> OpenAI客户端
+_client_pool: Dict[Tuple[str, str, float], Any] = {}
+_client_pool_lock = threading.Lock()
+
+
+def get_client(api_key: str, base_url: str, timeout: float = 60):
+    """获取共享的OpenAI兼容客户端，复用底层HTTP连接"""
+    key = (api_key or '', base_url, float(timeout))
+    client = _client_pool.get(key)
+    if client is None:
+        with _client_pool_lock:
+            client = _client_pool.get(key)
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=api_key or 'EMPTY',
+                    base_url=base_url,
+                    timeout=timeout,
+                )
+                _client_pool[key] = client
+    return client
+
+
 class ModelService:
     """大模型服务基类"""
-    def __init__(self, model_id: str):
+    def __init__(self, model_id: str, model_config: Optional[AIModel] = None):
         # 从数据库获取模型配置
-        try:
-            self.model_config = AIModel.objects.select_related('provider').get(model_id=model_id)
-            self.model_name = self.model_config.name
-            self.provider = self.model_config.provider
-            self.is_active = self.model_config.is_active and self.provider.is_active
-        except AIModel.DoesNotExist:
-            raise ValueError(f"找不到模型配置: {model_id}")
+        if model_config is None:
+            try:
+                model_config = AIModel.objects.select_related('provider').get(model_id=model_id)
+            except AIModel.DoesNotExist:
+                raise ValueError(f"找不到模型配置: {model_id}")
+        self.model_config = model_config
+        self.model_name = self.model_config.name
+        self.provider = self.model_config.provider
+        self.is_active = self.model_config.is_active and self.provider.is_active
         
     def generate_response(self, messages: List[Dict[str, str]], user=None, conversation=None, message=None) -> Tuple[str, Dict]:
         """生成响应，由子类实现"""
@@ -65,52 +151,35 @@ class ModelService:
         print(f"👉 尝试获取模型服务 - 模型ID: {model_id}")
         
         try:
-            # 查询模型配置
-            print(f"   查询数据库中的模型配置...")
             model_config = AIModel.objects.select_related('provider').get(model_id=model_id)
-            print(f"   ✅ 找到模型配置: {model_config.name} (ID: {model_config.model_id})")
+            provider = model_config.provider
+            print(f"   ✅ 找到模型配置: {model_config.name} (提供商: {provider.name}, slug: {provider.slug})")
             
-            # 根据提供商类型选择服务类
-            provider_slug = model_config.provider.slug
-            print(f"   📋 提供商信息: {model_config.provider.name} (slug: {provider_slug})")
-
-            # 根据提供商类型创建相应的服务实例
-            print(f"   🔧 准备创建模型服务实例 ({provider_slug})...")
+            if provider.slug not in PROVIDER_REGISTRY and not (
+                provider.api_base or (provider.capabilities or {}).get('api_base')
+            ):
+                print(f"   ❌ 不支持的提供商类型: {provider.slug}")
+                raise ValueError(f"不支持的模型提供商: {provider.slug}")
             
-            if provider_slug == 'openai':
-                print(f"   🚀 创建 OpenAI 服务实例")
-                return OpenAIService(model_id)
-            elif provider_slug == 'aliyun':
-                print(f"   🚀 创建阿里云服务实例")
-                return AliyunService(model_id)
-            elif provider_slug == 'deepseek':
-                print(f"   🚀 创建 DeepSeek 服务实例")
-                return DeepSeekService(model_id)
-            else:
-                print(f"   ❌ 不支持的提供商类型: {provider_slug}")
-                raise ValueError(f"不支持的模型提供商: {provider_slug}")
+            return OpenAICompatibleService(model_id, model_config=model_config)
                 
         except AIModel.DoesNotExist:
             # 如果找不到模型，使用默认模型
             print(f"   ⚠️ 模型ID: {model_id} 在数据库中不存在")
-            print(f"   🔍 尝试获取默认模型...")
             
             default_model = AIModel.objects.filter(is_default=True).first()
             if default_model:
                 print(f"   📎 使用默认模型: {default_model.name} (ID: {default_model.model_id})")
                 return ModelService.get_service(default_model.model_id)
-            else:
-                print(f"   ❌ 系统中没有设置默认模型")
-                
-                # 尝试获取任意活跃模型
-                print(f"   🔍 尝试获取任意活跃模型...")
-                any_model = AIModel.objects.filter(is_active=True).first()
-                if any_model:
-                    print(f"   📎 使用活跃模型: {any_model.name} (ID: {any_model.model_id})")
-                    return ModelService.get_service(any_model.model_id)
-                else:
-                    print(f"   ❌ 系统中没有任何可用模型")
-                    raise ValueError(f"未找到模型配置，且没有默认模型")
+            
+            # 尝试获取任意活跃模型
+            any_model = AIModel.objects.filter(is_active=True).first()
+            if any_model:
+                print(f"   📎 使用活跃模型: {any_model.name} (ID: {any_model.model_id})")
+                return ModelService.get_service(any_model.model_id)
+            
+            print(f"   ❌ 系统中没有任何可用模型")
+            raise ValueError(f"未找到模型配置，且没有默认模型")
         except Exception as e:
             print(f"   ❌ 获取模型服务时发生异常: {str(e)}")
             raise
@@ -160,173 +229,88 @@ class ModelService:
             metadata=metadata or {}
         )
 
-class OpenAIService(ModelService):
-    """OpenAI模型服务"""
-    def __init__(self, model_id: str):
-        super().__init__(model_id)
-        
-    def generate_response(self, messages: List[Dict[str, str]], user=None, conversation=None, message=None) -> Tuple[str, Dict]:
-        start_time = time.time()
-        
-        api_key = self.provider.api_key
-        api_base = self.provider.api_base or "https://api.openai.com/v1"
-        
-        prompt_tokens = TokenCounter.count_message_tokens(messages, self.model_config.model_id)
-        completion_tokens = 0
-        usage_info = {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
-        
-        try:
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=api_base
-            )
-            
-            response = client.chat.completions.create(
-                model=self.model_config.model_id,
-                messages=messages,
-                max_tokens=self.model_config.max_tokens,
-                temperature=self.model_config.temperature,
-                top_p=self.model_config.top_p,
-                presence_penalty=self.model_config.presence_penalty,
-                frequency_penalty=self.model_config.frequency_penalty
-            )
-            
-            content = response.choices[0].message.content or "无响应内容"
-            
-            # 获取Token使用情况
-            if hasattr(response, 'usage') and response.usage:
-                usage_info = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-                completion_tokens = response.usage.completion_tokens
-            else:
-                # 如果OpenAI没有返回token使用情况，则计算回复文本的tokens
-                completion_tokens = TokenCounter.count_tokens(content, self.model_config.model_id)
-                usage_info["completion_tokens"] = completion_tokens
-                usage_info["total_tokens"] = prompt_tokens + completion_tokens
-            
-            response_time = time.time() - start_time
-            
-            # 记录使用情况
-            if user:
-                self.record_token_usage(
-                    user=user,
-                    conversation=conversation,
-                    message=message,
-                    prompt_tokens=usage_info["prompt_tokens"],
-                    completion_tokens=usage_info["completion_tokens"],
-                    response_time=response_time,
-                    metadata={"model_id": self.model_config.model_id}
-                )
-                
-            return content, usage_info
-            
-        except Exception as e:
-            response_time = time.time() - start_time
-            error_message = str(e)
-            
-            # 记录失败的请求
-            if user:
-                self.record_token_usage(
-                    user=user,
-                    conversation=conversation,
-                    message=message,
-                    prompt_tokens=prompt_tokens,
-                    completion_tokens=0,
-                    response_time=response_time,
-                    is_successful=False,
-                    error_message=error_message
-                )
-                
-            raise
+class OpenAICompatibleService(ModelService):
+    """OpenAI兼容接口的统一模型服务
 
-class AliyunService(ModelService):
-    """阿里云百炼模型服务"""
-    def __init__(self, model_id: str):
-        super().__init__(model_id)
-        print(f"   🔧 初始化阿里云服务，模型ID: {model_id}")
+    各提供商之间的差异(基础URL、支持的参数、是否返回思考过程等)由能力描述决定，
+    优先级: AIModel.capabilities > ModelProvider.capabilities > 注册表默认值。
+    """
+    def __init__(self, model_id: str, model_config: Optional[AIModel] = None):
+        super().__init__(model_id, model_config=model_config)
+        self.capabilities = self.resolve_capabilities()
         
+    def resolve_capabilities(self) -> Dict[str, Any]:
+        """合并注册表、提供商和模型三级能力描述"""
+        capabilities = dict(PROVIDER_REGISTRY.get(self.provider.slug, DEFAULT_CAPABILITIES))
+        if self.provider.api_base:
+            capabilities['api_base'] = self.provider.api_base
+        for overrides in (self.provider.capabilities, self.model_config.capabilities):
+            if isinstance(overrides, dict):
+                capabilities.update({k: v for k, v in overrides.items() if k in DEFAULT_CAPABILITIES})
+        return capabilities
+    
+    @property
+    def token_model(self) -> str:
+        return self.capabilities.get('token_model') or self.model_config.model_id
+    
+    def build_request(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """根据能力描述构造请求参数"""
+        request = {
+            'model': self.model_config.model_id,
+            'messages': messages,
+            'stream': True,
+        }
+        for param in self.capabilities.get('params') or []:
+            value = getattr(self.model_config, param, None)
+            if value is not None:
+                request[param] = value
+        if self.capabilities.get('stream_usage'):
+            request['stream_options'] = {"include_usage": True}
+        if self.capabilities.get('extra_body'):
+            request['extra_body'] = self.capabilities['extra_body']
+        return request
+    
     def generate_response(self, messages: List[Dict[str, str]], user=None, conversation=None, message=None) -> Tuple[str, Dict]:
+        """流式生成回复，返回 (回复内容, 用量)；有思考过程时放在用量的 reasoning_content 中"""
         start_time = time.time()
-        print(f"   🚀 开始调用阿里云模型: {self.model_config.name}")
         
-        api_key = self.provider.api_key
-        # 兼容模式的base_url
-        base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
-        
-        prompt_tokens = TokenCounter.count_message_tokens(messages, "qwen")
-        completion_tokens = 0
-        usage_info = {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
+        prompt_tokens = TokenCounter.count_message_tokens(messages, self.token_model)
+        usage = None
+        first_token_time = None
+        content_parts: List[str] = []
+        reasoning_parts: List[str] = []
         
         try:
-            print(f"   📡 使用OpenAI兼容模式连接阿里云API (流式模式)")
-            # 使用OpenAI客户端连接阿里云
-            from openai import OpenAI
-            
-            client = OpenAI(
-                api_key=api_key,
-                base_url=base_url
+            client = get_client(
+                self.provider.api_key,
+                self.capabilities['api_base'],
+                self.capabilities.get('timeout') or 60,
             )
-            
-            print(f"   📤 发送流式请求到阿里云，消息数: {len(messages)}")
-            # 使用流式模式创建聊天完成请求
-            completion = client.chat.completions.create(
-                model=self.model_config.model_id,
-                messages=messages,
-                max_tokens=self.model_config.max_tokens,
-                temperature=self.model_config.temperature,
-                top_p=self.model_config.top_p,
-                stream=True,  # 启用流式模式
-                stream_options={"include_usage": True}  # 包含用量统计
-            )
-            
-            # 收集完整响应
-            full_content = ""
-            reasoning_content = ""
-            
-            print(f"   📥 开始接收流式响应...")
-            for chunk in completion:
-                # 检查是否是用量信息
-                if not hasattr(chunk, 'choices') or not chunk.choices:
-                    if hasattr(chunk, 'usage') and chunk.usage:
-                        usage_info = {
-                            "prompt_tokens": chunk.usage.prompt_tokens,
-                            "completion_tokens": chunk.usage.completion_tokens,
-                            "total_tokens": chunk.usage.total_tokens
-                        }
-                        completion_tokens = chunk.usage.completion_tokens
-                        print(f"   📊 Token使用情况: {usage_info}")
-                    continue
-                
-                delta = chunk.choices[0].delta
+            with track('llm'):
+                stream = client.chat.completions.create(**self.build_request(messages))
                 
-                # 检查是否有思考过程内容
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content is not None:
-                    reasoning_content += delta.reasoning_content
-                    print(f"   💭 接收思考内容: {len(reasoning_content)} 字符", end="\r")
+                for chunk in stream:
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if not getattr(chunk, 'choices', None):
+                        continue
                     
-                # 检查是否有回复内容
-                if hasattr(delta, 'content') and delta.content:
-                    full_content += delta.content
-                    print(f"   💬 接收回复内容: {len(full_content)} 字符", end="\r")
-            
-            # 如果没有获取到使用情况，估算一下
-            if completion_tokens == 0:
-                completion_tokens = TokenCounter.count_tokens(full_content, "qwen")
-                usage_info["completion_tokens"] = completion_tokens
-                usage_info["total_tokens"] = prompt_tokens + completion_tokens
-                print(f"   📊 估算Token使用情况: {usage_info}")
-            
-            print(f"   ✅ 流式响应接收完成，总长度: {len(full_content)} 字符")
+                    delta = chunk.choices[0].delta
+                    reasoning = getattr(delta, 'reasoning_content', None) if self.capabilities.get('reasoning') else None
+                    if reasoning:
+                        reasoning_parts.append(reasoning)
+                    if delta.content:
+                        content_parts.append(delta.content)
+                    if first_token_time is None and (reasoning or delta.content):
+                        first_token_time = time.time() - start_time
             
+            content = ''.join(content_parts) or "无响应内容"
+            reasoning_content = ''.join(reasoning_parts)
+            usage_info = self.extract_usage(usage, prompt_tokens, content)
             response_time = time.time() - start_time
-            print(f"   ⏱️ 响应时间: {response_time:.2f}秒")
             
             # 记录使用情况
             if user:
-                print(f"   💾 记录Token使用情况")
                 self.record_token_usage(
                     user=user,
                     conversation=conversation,
@@ -336,116 +320,22 @@ class AliyunService(ModelService):
                     response_time=response_time,
                     metadata={
                         "model_id": self.model_config.model_id,
-                        "has_reasoning": len(reasoning_content) > 0
+                        "provider": self.provider.slug,
+                        "has_reasoning": bool(reasoning_content),
+                        "ttft": first_token_time,
                     }
                 )
             
-            # 如果有思考内容，可以选择添加到元数据或直接合并到回复中
+            # 思考过程不合并到回复中，由调用方压缩后挂到助手消息上
             if reasoning_content:
-                print(f"   📝 模型提供了思考过程 ({len(reasoning_content)} 字符)")
-                # 可以选择下面两种方式之一:
-                
-                # 1. 将思考过程添加到回复前面
-                # full_content = f"思考过程：\n{reasoning_content}\n\n回答：\n{full_content}"
-                
-                # 2. 只保留回复内容，思考过程作为元数据记录
-                if message:
-                    try:
-                        # 假设Message模型有一个metadata字段
-                        message.metadata = message.metadata or {}
-                        message.metadata['reasoning'] = reasoning_content
-                        message.save(update_fields=['metadata'])
-                        print(f"   ✅ 思考过程已保存到消息元数据")
-                    except:
-                        print(f"   ⚠️ 无法将思考过程保存到元数据")
-                
-            return full_content, usage_info
-                
-        except Exception as e:
-            response_time = time.time() - start_time
-            error_message = str(e)
-            print(f"   ❌ 阿里云API错误: {error_message}")
-            
-            # 记录失败的请求
-            if user:
-                print(f"   💾 记录失败请求")
-                self.record_token_usage(
-                    user=user,
-                    conversation=conversation,
-                    message=message,
-                    prompt_tokens=prompt_tokens,
-                    completion_tokens=0,
-                    response_time=response_time,
-                    is_successful=False,
-                    error_message=error_message
-                )
-                
-            raise
-
-class DeepSeekService(ModelService):
-    """DeepSeek模型服务"""
-    def __init__(self, model_id: str):
-        super().__init__(model_id)
-        
-    def generate_response(self, messages: List[Dict[str, str]], user=None, conversation=None, message=None) -> Tuple[str, Dict]:
-        start_time = time.time()
-        
-        api_key = self.provider.api_key
-        api_base = self.provider.api_base or "https://api.deepseek.com/v1"
-        
-        prompt_tokens = TokenCounter.count_message_tokens(messages, "deepseek")
-        completion_tokens = 0
-        usage_info = {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
-        
-        try:
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=api_base
-            )
-            
-            response = client.chat.completions.create(
-                model=self.model_config.model_id,
-                messages=messages,
-                max_tokens=self.model_config.max_tokens,
-                temperature=self.model_config.temperature,
-                top_p=self.model_config.top_p
-            )
-            
-            content = response.choices[0].message.content or "无响应内容"
-            
-            # 获取Token使用情况
-            if hasattr(response, 'usage') and response.usage:
-                usage_info = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-                completion_tokens = response.usage.completion_tokens
-            else:
-                # 如果没有返回token使用情况，则计算回复文本的tokens
-                completion_tokens = TokenCounter.count_tokens(content, "deepseek")
-                usage_info["completion_tokens"] = completion_tokens
-                usage_info["total_tokens"] = prompt_tokens + completion_tokens
-            
-            response_time = time.time() - start_time
-            
-            # 记录使用情况
-            if user:
-                self.record_token_usage(
-                    user=user,
-                    conversation=conversation,
-                    message=message,
-                    prompt_tokens=usage_info["prompt_tokens"],
-                    completion_tokens=usage_info["completion_tokens"],
-                    response_time=response_time,
-                    metadata={"model_id": self.model_config.model_id}
-                )
+                usage_info["reasoning_content"] = reasoning_content
                 
             return content, usage_info
             
         except Exception as e:
             response_time = time.time() - start_time
             error_message = str(e)
+            print(f"   ❌ {self.provider.name} API错误: {error_message}")
             
             # 记录失败的请求
             if user:
@@ -457,13 +347,63 @@ class DeepSeekService(ModelService):
                     completion_tokens=0,
                     response_time=response_time,
                     is_successful=False,
-                    error_message=error_message
+                    error_message=error_message,
+                    metadata={"model_id": self.model_config.model_id, "provider": self.provider.slug}
                 )
                 
             raise
+    
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], Dict[str, int]]:
+        """一次请求计算一批文本的向量，返回 (按输入顺序排列的向量, 用量)
+
+        调用方负责按 embedding_batch_size/embedding_batch_tokens 分批和限速。
+        """
+        client = get_client(
+            self.provider.api_key,
+            self.capabilities['api_base'],
+            self.capabilities.get('timeout') or 60,
+        )
+        with track('llm'):
+            response = client.embeddings.create(model=self.model_config.model_id, input=texts)
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        if len(vectors) != len(texts):
+            raise ValueError(f"向量数量与输入不一致: {len(vectors)} != {len(texts)}")
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        if prompt_tokens is None:
+            prompt_tokens = sum(TokenCounter.count_tokens(text, self.token_model) for text in texts)
+        return vectors, {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+    
+    def extract_usage(self, usage, prompt_tokens: int, content: str) -> Dict[str, int]:
+        """优先使用接口返回的用量，缺失时在本地估算"""
+        if usage and getattr(usage, 'completion_tokens', None) is not None:
+            return {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            }
+        completion_tokens = TokenCounter.count_tokens(content, self.token_model)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
 
-def get_ai_response(conversation, user_message: str, model_id: str = None, user=None, existing_message_id=None) -> str:
-    """统一接口，从指定大模型获取回复"""
+# 模型调用失败时返回的后备响应(压测等据此识别失败的回复)
+FALLBACK_RESPONSES = [
+    "抱歉，AI服务暂时不可用。请稍后再试。",
+    "由于技术原因，无法处理您的请求。我们正在努力修复问题。",
+    "连接AI服务时遇到问题。请稍后重试或尝试使用其他模型。"
+]
+
+def get_ai_response(conversation, user_message: str, model_id: str = None, user=None, existing_message_id=None,
+                    system_prompt: str = None) -> str:
+    """统一接口，从指定大模型获取回复
+
+    system_prompt 为渲染好的模板系统提示词，未提供时使用默认系统信息。
+    上下文中会加入从用户知识库检索到的参考资料(见 knowledge.rag)，
+    引用来源保存在助手消息的 metadata['sources'] 中。
+    """
     # 获取用户偏好的模型，如未指定则使用默认模型
     if not model_id:
         if user and hasattr(user, 'preferred_model'):
@@ -471,43 +411,13 @@ def get_ai_response(conversation, user_message: str, model_id: str = None, user=
         else:
             model_id = ModelService.get_default_model()
     
-    # 构建对话历史
-    messages = []
-    
-    # 添加系统信息
-    messages.append({
-        "role": "system",
-        "content": "你是一个知识助手，帮助用户回答问题并提供准确的信息。"
-    })
-    
-    # 添加历史消息
-    history = conversation.messages.order_by('-timestamp')[:10]
-    for msg in reversed(list(history)):
-        messages.append({
-            "role": msg.role,
-            "content": msg.content
-        })
-    
-    # 添加当前用户消息
-    messages.append({
-        "role": "user",
-        "content": user_message
-    })
-    
-    # 后备响应
-    fallback_responses = [
-        "抱歉，AI服务暂时不可用。请稍后再试。",
-        "由于技术原因，无法处理您的请求。我们正在努力修复问题。",
-        "连接AI服务时遇到问题。请稍后重试或尝试使用其他模型。"
-    ]
-    
     # 获取已存在的用户消息对象，而不是创建新的
     from knowledge.models import Message
     
     if existing_message_id:
         # 如果提供了现有消息ID，直接获取
         try:
-            user_message_obj = Message.objects.get(id=existing_message_id)
+            user_message_obj = Message.objects.only('id', 'conversation_id', 'role').get(id=existing_message_id)
             print(f"[DEBUG] 使用已存在的用户消息 ID: {existing_message_id}")
         except Message.DoesNotExist:
             print(f"[WARNING] 找不到指定ID的消息: {existing_message_id}，将创建新消息")
@@ -520,7 +430,7 @@ def get_ai_response(conversation, user_message: str, model_id: str = None, user=
             conversation=conversation,
             role='user',
             message_hash=message_hash
-        ).order_by('-timestamp').first()
+        ).only('id', 'conversation_id', 'role').order_by('-timestamp').first()
         
         print(f"[DEBUG] 查找匹配消息 hash: {message_hash[:8]}, 结果: {'找到' if user_message_obj else '未找到'}")
     
@@ -538,6 +448,18 @@ def get_ai_response(conversation, user_message: str, model_id: str = None, user=
         # 只使用用户选择的模型，不再尝试备选模型
         service = ModelService.get_service(model_id)
         
+        # 组装上下文: 系统信息 + 知识库检索到的参考资料 + 对话历史 + 当前用户消息，按token预算裁剪
+        from knowledge.rag import build_messages
+        messages, sources = build_messages(
+            conversation,
+            user_message,
+            system_prompt or "你是一个知识助手，帮助用户回答问题并提供准确的信息。",
+            service.model_config,
+            service.token_model,
+            exclude_message_id=user_message_obj.id,
+            user=user or conversation.user,
+        )
+        
         # 生成响应
         content, usage_info = service.generate_response(
             messages, 
@@ -546,12 +468,18 @@ def get_ai_response(conversation, user_message: str, model_id: str = None, user=
             message=user_message_obj
         )
         
-        # 创建助手消息 - 不使用metadata参数
-        assistant_message = Message.objects.create(
-            conversation=conversation,
-            role='assistant',
-            content=content
-        )
+        # 创建助手消息，引用的知识来源记录在元数据中，思考过程压缩后单独存放
+        from knowledge.models import MessageReasoning
+        reasoning = usage_info.pop('reasoning_content', None)
+        with transaction.atomic():
+            assistant_message = Message.objects.create(
+                conversation=conversation,
+                role='assistant',
+                content=content,
+                metadata={'sources': sources} if sources else None
+            )
+            if reasoning:
+                MessageReasoning.store(assistant_message, reasoning)
         
         return content
             
@@ -559,7 +487,7 @@ def get_ai_response(conversation, user_message: str, model_id: str = None, user=
         print(f"模型 {model_id} 调用失败: {e}")
         # 返回后备响应
         import random
-        fallback_response = random.choice(fallback_responses)
+        fallback_response = random.choice(FALLBACK_RESPONSES)
         
         # 创建失败的助手消息 - 不使用metadata参数
         Message.objects.create(
@@ -0,0 +1,170 @@
+"""TokenUsage 按月范围分区的维护与归档
+
+PostgreSQL 上 knowledge_tokenusage 是以 request_time 为分区键的分区表
+(见迁移 0013)，每月一个分区，另有一个默认分区兜底。这里负责:
+  - 提前创建未来月份的分区(默认分区中已有的对应数据会一并迁入)；
+  - 按保留期把旧分区导出为 gzip 压缩的CSV后卸载并删除。
+其他数据库没有分区，保留策略退化为导出后按时间删除。
+"""
+import csv
+import gzip
+import os
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .ai_models import TokenUsage
+
+TABLE = TokenUsage._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+PARTITIONS_AHEAD = getattr(settings, 'TOKEN_USAGE_PARTITIONS_AHEAD', 3)
+RETENTION_MONTHS = getattr(settings, 'TOKEN_USAGE_RETENTION_MONTHS', 12)
+ARCHIVE_DIR = getattr(settings, 'TOKEN_USAGE_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive', 'token_usage'))
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(value):
+    """所在月份第一天零点，分区边界统一使用UTC(与迁移 0013 一致)"""
+    value = value.astimezone(dt_timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start.year}_{start.month:02d}'
+
+
+def list_partitions():
+    """返回 [(分区名, 月份起点)]，按时间排序，不含默认分区"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    prefix = f'{TABLE}_p'
+    partitions = []
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        year, month = name[len(prefix):].split('_')
+        start = datetime(int(year), int(month), 1, tzinfo=dt_timezone.utc)
+        partitions.append((name, start))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+@transaction.atomic
+def create_partition(start):
+    """创建 [start, 下月) 的分区；默认分区中落在该范围的数据先迁入新表再挂载"""
+    end = add_months(start, 1)
+    name = partition_name(start)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {quote(DEFAULT_PARTITION)}
+                WHERE request_time >= %s AND request_time < %s
+                RETURNING *
+            )
+            INSERT INTO {quote(name)} SELECT * FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    return name
+
+
+def ensure_partitions(start=None, months_ahead=PARTITIONS_AHEAD):
+    """确保从 start 所在月份(默认本月)到未来 months_ahead 个月的分区都已存在"""
+    if not is_partitioned():
+        return []
+    existing = {name for name, _ in list_partitions()}
+    current = month_start(start or timezone.now())
+    last = add_months(month_start(timezone.now()), months_ahead)
+    created = []
+    while current <= last:
+        if partition_name(current) not in existing:
+            created.append(create_partition(current))
+        current = add_months(current, 1)
+    return created
+
+
+def export_rows(cursor_sql, params, path):
+    """把查询结果以 gzip 压缩的CSV写入文件(PostgreSQL 使用 COPY TO)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as output:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                sql = cursor.mogrify(cursor_sql, params).decode()
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", output)
+                return
+            cursor.execute(cursor_sql, params)
+            writer = csv.writer(output)
+            writer.writerow([column[0] for column in cursor.description])
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                writer.writerows(rows)
+
+
+def archive_expired(retention_months=RETENTION_MONTHS, directory=ARCHIVE_DIR, dry_run=False):
+    """导出并删除早于保留期的数据，返回处理过的 [(名称, 文件路径)]"""
+    cutoff = add_months(month_start(timezone.now()), -retention_months)
+    quote = connection.ops.quote_name
+    archived = []
+
+    if is_partitioned():
+        for name, start in list_partitions():
+            if start >= cutoff:
+                break
+            path = os.path.join(directory, f'{name}.csv.gz')
+            archived.append((name, path))
+            if dry_run:
+                continue
+            export_rows(f"SELECT * FROM {quote(name)}", [], path)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+                cursor.execute(f"DROP TABLE {quote(name)}")
+        return archived
+
+    # 未分区: 整体导出保留期之前的数据后删除
+    name = f'{TABLE}_before_{cutoff:%Y_%m}'
+    path = os.path.join(directory, f'{name}.csv.gz')
+    if not TokenUsage.objects.filter(request_time__lt=cutoff).exists():
+        return archived
+    archived.append((name, path))
+    if not dry_run:
+        export_rows(f"SELECT * FROM {quote(TABLE)} WHERE request_time < %s ORDER BY id", [cutoff], path)
+        # 直接DELETE，避免 QuerySet.delete() 因存在 post_delete 接收器而逐行加载
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {quote(TABLE)} WHERE request_time < %s", [cutoff])
+    return archived
@@ -0,0 +1,183 @@
+"""提示词模板渲染
+
+模板内容中的 {变量名} 为占位符(与前端 ChatWindow 的解析规则一致)。
+模板首次使用时编译为“静态片段 + 占位符”列表并缓存在进程内，缓存键为
+(模板ID, updated_at, 系统提示词ID, 系统提示词updated_at)，模板被修改后
+键自然变化，无需显式失效。静态片段的token数按tokenizer模型各计算一次。
+"""
+import re
+
+from django.conf import settings
+from django.db.models import Q
+
+from knowledge_hub.cache import LocalTTLCache
+from .ai_models import PromptTemplate
+
+PLACEHOLDER_RE = re.compile(r'\{([^{}\s]+)\}')
+
+# 编译结果缓存条数和有效期(秒)
+COMPILED_CACHE_SIZE = getattr(settings, 'PROMPT_COMPILED_CACHE_SIZE', 512)
+COMPILED_CACHE_TTL = getattr(settings, 'PROMPT_COMPILED_CACHE_TTL', 3600)
+
+_compiled_cache = LocalTTLCache(COMPILED_CACHE_SIZE, COMPILED_CACHE_TTL)
+
+
+class TemplateRenderError(ValueError):
+    """模板变量校验失败"""
+
+    def __init__(self, message, missing=None, unknown=None):
+        super().__init__(message)
+        self.missing = missing or []
+        self.unknown = unknown or []
+
+
+class CompiledTemplate:
+    """编译后的单个提示词模板"""
+
+    def __init__(self, template_id, content, declared=None, examples=None):
+        self.template_id = template_id
+        self.segments = []  # [(静态文本, 变量名或None)]
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(content):
+            self.segments.append((content[position:match.start()], match.group(1)))
+            position = match.end()
+        self.segments.append((content[position:], None))
+
+        self.placeholders = list(dict.fromkeys(name for _, name in self.segments if name))
+        self.declared = dict(declared or {})
+        self.examples = dict(examples or {})
+        self.static_text = ''.join(text for text, _ in self.segments)
+        self._static_tokens = {}
+
+    def static_tokens(self, token_model):
+        """静态片段的token数，按tokenizer模型缓存"""
+        if token_model not in self._static_tokens:
+            from .models_service import TokenCounter
+            self._static_tokens[token_model] = TokenCounter.count_tokens(self.static_text, token_model)
+        return self._static_tokens[token_model]
+
+    def validate(self, values, use_examples=False, placeholders=None):
+        """校验变量，返回补全后的取值
+
+        placeholders 为必须提供的变量(默认为本模板的占位符)，
+        取值只能是占位符或 variables 中声明过的变量。
+        """
+        values = dict(values or {})
+        placeholders = self.placeholders if placeholders is None else placeholders
+        allowed = set(placeholders) | set(self.declared)
+        unknown = sorted(key for key in values if key not in allowed)
+        if use_examples:
+            for name in placeholders:
+                if name not in values and name in self.examples:
+                    values[name] = self.examples[name]
+        missing = [name for name in placeholders if name not in values]
+        if unknown or missing:
+            parts = []
+            if missing:
+                parts.append(f"缺少变量: {', '.join(missing)}")
+            if unknown:
+                parts.append(f"未定义的变量: {', '.join(unknown)}")
+            raise TemplateRenderError('；'.join(parts), missing=missing, unknown=unknown)
+        return values
+
+    def render(self, values):
+        return ''.join(
+            text + (str(values[name]) if name else '')
+            for text, name in self.segments
+        )
+
+
+class CompiledPrompt:
+    """用户提示词模板及其关联的系统提示词"""
+
+    def __init__(self, template):
+        self.template_id = template.id
+        self.template_type = template.template_type
+        self.user = CompiledTemplate(template.id, template.content, template.variables, template.example_values)
+        system = template.system_prompt if template.template_type == 'user' else None
+        self.system = CompiledTemplate(system.id, system.content) if system else None
+
+    @property
+    def variables(self):
+        names = list(self.user.placeholders)
+        if self.system:
+            names += [name for name in self.system.placeholders if name not in names]
+        return names
+
+    def render(self, values=None, use_examples=False, token_model=None):
+        """渲染模板，返回系统/用户提示词及token数
+
+        变量部分的token数单独计算后与缓存的静态部分相加，结果为近似值。
+        """
+        values = self.user.validate(values, use_examples, placeholders=self.variables)
+        user_prompt = self.user.render(values)
+        system_prompt = self.system.render(values) if self.system else None
+
+        result = {
+            'template_id': self.template_id,
+            'system_prompt': system_prompt,
+            'user_prompt': user_prompt,
+            'variables': values,
+        }
+        if token_model:
+            from .models_service import TokenCounter
+            dynamic = ''.join(str(value) for value in values.values())
+            tokens = self.user.static_tokens(token_model)
+            if self.system:
+                tokens += self.system.static_tokens(token_model)
+            result['prompt_tokens'] = tokens + (TokenCounter.count_tokens(dynamic, token_model) if dynamic else 0)
+        return result
+
+    def messages(self, values=None, use_examples=False):
+        """渲染为对话消息列表"""
+        rendered = self.render(values, use_examples)
+        messages = []
+        if rendered['system_prompt']:
+            messages.append({'role': 'system', 'content': rendered['system_prompt']})
+        messages.append({'role': 'user', 'content': rendered['user_prompt']})
+        return messages
+
+
+def _cache_key(template_id, updated_at, system_id, system_updated_at):
+    return (
+        template_id,
+        updated_at.isoformat() if updated_at else None,
+        system_id,
+        system_updated_at.isoformat() if system_updated_at else None,
+    )
+
+
+def get_compiled(template):
+    """编译已加载的模板实例(会访问 system_prompt)"""
+    system = template.system_prompt if template.system_prompt_id else None
+    key = _cache_key(template.id, template.updated_at, template.system_prompt_id,
+                     system.updated_at if system else None)
+    compiled = _compiled_cache.get(key)
+    if compiled is None:
+        compiled = CompiledPrompt(template)
+        _compiled_cache.set(key, compiled)
+    return compiled
+
+
+def get_compiled_by_id(template_id, queryset=None):
+    """按ID获取编译结果，缓存命中时只需一次取时间戳的窄查询"""
+    queryset = queryset if queryset is not None else PromptTemplate.objects.all()
+    row = queryset.filter(pk=template_id).values_list(
+        'updated_at', 'system_prompt_id', 'system_prompt__updated_at'
+    ).first()
+    if row is None:
+        raise PromptTemplate.DoesNotExist(f"提示词模板不存在: {template_id}")
+
+    key = _cache_key(template_id, *row)
+    compiled = _compiled_cache.get(key)
+    if compiled is None:
+        template = PromptTemplate.objects.select_related('system_prompt').get(pk=template_id)
+        compiled = get_compiled(template)
+    return compiled
+
+
+def visible_templates(user):
+    """用户可用的模板: 管理员可见全部，其他用户可见公开的和自己创建的"""
+    if user.is_staff:
+        return PromptTemplate.objects.all()
+    return PromptTemplate.objects.filter(Q(is_public=True) | Q(created_by=user))
@@ -0,0 +1,150 @@
+"""检索增强生成(RAG)
+
+回答前用混合检索(knowledge.search，GIN索引 + 进程内向量矩阵 + 结果缓存)
+找出与新问题相关的知识点和其他对话中的消息，与对话历史一起按token预算
+打包进提示词；引用的来源记录在助手消息的 metadata['sources'] 中。
+"""
+from django.conf import settings
+
+from .instrumentation import track
+from .models import KnowledgePoint, Message
+from .models_service import TokenCounter
+from .search import hybrid_search
+
+ENABLED = getattr(settings, 'RAG_ENABLED', True)
+TOP_K_POINTS = getattr(settings, 'RAG_TOP_K_POINTS', 5)
+TOP_K_MESSAGES = getattr(settings, 'RAG_TOP_K_MESSAGES', 3)
+# 参考资料最多占用的token数，以及单条资料的上限
+CONTEXT_TOKENS = getattr(settings, 'RAG_CONTEXT_TOKENS', 1500)
+ITEM_TOKENS = getattr(settings, 'RAG_ITEM_TOKENS', 400)
+# 等待向量检索的时间(秒)，超时或查询向量未缓存时只用全文检索结果
+VECTOR_TIMEOUT = getattr(settings, 'RAG_VECTOR_TIMEOUT', 0.05)
+HISTORY_LIMIT = 20
+# 每条消息的格式开销，与 TokenCounter.count_message_tokens 一致
+MESSAGE_OVERHEAD = 4
+
+CONTEXT_HEADER = "以下是用户知识库中与问题相关的资料，回答时可以参考，引用时标注对应编号，如[1]:"
+
+
+def truncate(text, max_tokens, token_model):
+    """按token数截断(按字符比例估算，不逐字计数)"""
+    tokens = TokenCounter.count_tokens(text, token_model)
+    if tokens <= max_tokens:
+        return text, tokens
+    text = text[:max(1, int(len(text) * max_tokens / tokens))] + '…'
+    return text, TokenCounter.count_tokens(text, token_model)
+
+
+def retrieve(user, query, conversation_id=None):
+    """返回相关资料 [{'type', 'id', 'title', 'content', 'score', ...}]，已按相关度排序
+
+    当前对话中的消息已在历史里，排除在外。
+    """
+    hits = hybrid_search(
+        user, query, limit=(TOP_K_POINTS + TOP_K_MESSAGES) * 2, vector_timeout=VECTOR_TIMEOUT,
+        exclude_conversation_id=conversation_id,
+    )
+    point_ids = [pk for target, pk, _, _ in hits if target == 'knowledge']
+    message_ids = [pk for target, pk, _, _ in hits if target == 'messages']
+    points = {
+        row['id']: row for row in
+        KnowledgePoint.objects.filter(id__in=point_ids).values('id', 'title', 'content')
+    }
+    messages = {
+        row['id']: row for row in
+        Message.objects.filter(id__in=message_ids)
+        .values('id', 'role', 'content', 'conversation_id', 'conversation__title')
+    }
+
+    items = []
+    counts = {'knowledge': 0, 'messages': 0}
+    limits = {'knowledge': TOP_K_POINTS, 'messages': TOP_K_MESSAGES}
+    for target, pk, score, matched in hits:
+        if counts[target] >= limits[target]:
+            continue
+        if target == 'knowledge' and pk in points:
+            row = points[pk]
+            items.append({'type': 'knowledge', 'id': pk, 'title': row['title'], 'content': row['content'],
+                          'score': score, 'matched': matched})
+        elif target == 'messages' and pk in messages:
+            row = messages[pk]
+            items.append({'type': 'message', 'id': pk, 'title': row['conversation__title'],
+                          'content': row['content'], 'role': row['role'],
+                          'conversation': row['conversation_id'], 'score': score, 'matched': matched})
+        else:
+            continue
+        counts[target] += 1
+    return items
+
+
+def format_item(index, item):
+    if item['type'] == 'knowledge':
+        return f"[{index}] 知识点《{item['title']}》: {item['content']}"
+    speaker = '用户' if item['role'] == 'user' else '助手'
+    return f"[{index}] 历史对话《{item['title']}》中{speaker}的发言: {item['content']}"
+
+
+def build_context(items, token_model, budget):
+    """在预算内拼接参考资料，返回 (文本, 引用列表, 已用token数)"""
+    lines = []
+    sources = []
+    used = TokenCounter.count_tokens(CONTEXT_HEADER, token_model)
+    for item in items:
+        if used >= budget:
+            break
+        content, _ = truncate(item['content'], min(ITEM_TOKENS, budget - used), token_model)
+        line = format_item(len(sources) + 1, {**item, 'content': content})
+        tokens = TokenCounter.count_tokens(line, token_model)
+        if used + tokens > budget:
+            break
+        lines.append(line)
+        used += tokens
+        source = {'index': len(sources) + 1, 'type': item['type'], 'id': item['id'],
+                  'title': item['title'], 'score': round(item['score'], 6), 'matched': item['matched']}
+        if item['type'] == 'message':
+            source['conversation'] = item['conversation']
+        sources.append(source)
+    if not lines:
+        return '', [], 0
+    return '\n'.join([CONTEXT_HEADER] + lines), sources, used
+
+
+def build_messages(conversation, user_message, system_prompt, model_config, token_model,
+                   exclude_message_id=None, user=None):
+    """按token预算组装发送给模型的消息，返回 (messages, sources)
+
+    预算为上下文窗口减去回复预留的 max_tokens；系统提示词和当前问题必须保留，
+    参考资料最多占 CONTEXT_TOKENS 且不超过剩余预算的一半，其余留给对话历史
+    (从最近的消息往前取)。
+    """
+    budget = max(model_config.context_window - model_config.max_tokens, 1024)
+    system_tokens = TokenCounter.count_tokens(system_prompt, token_model) + MESSAGE_OVERHEAD
+    question_tokens = TokenCounter.count_tokens(user_message, token_model) + MESSAGE_OVERHEAD
+    remaining = budget - system_tokens - question_tokens - 2
+
+    context, sources = '', []
+    if ENABLED and user is not None and remaining > 0:
+        try:
+            with track('retrieval'):
+                items = retrieve(user, user_message, conversation.id)
+            context, sources, used = build_context(items, token_model, min(CONTEXT_TOKENS, remaining // 2))
+            remaining -= used
+        except Exception as e:
+            print(f"知识检索失败，不使用参考资料: {e}")
+
+    history = (
+        conversation.messages.exclude(id=exclude_message_id)
+        .order_by('-timestamp').values_list('role', 'content')[:HISTORY_LIMIT]
+    )
+    packed = []
+    for role, content in history:
+        tokens = TokenCounter.count_tokens(content, token_model) + MESSAGE_OVERHEAD
+        if tokens > remaining:
+            break
+        packed.append({'role': role, 'content': content})
+        remaining -= tokens
+    packed.reverse()
+
+    system_content = f"{system_prompt}\n\n{context}" if context else system_prompt
+    messages = [{'role': 'system', 'content': system_content}, *packed, {'role': 'user', 'content': user_message}]
+    return messages, sources
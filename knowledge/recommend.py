@@ -0,0 +1,164 @@
+"""基于内容的知识点推荐
+
+离线批量计算:
+1. 对用户的全部知识点计算 TF-IDF 向量(中文按字二元组切分，英文按单词)，
+   通过倒排索引求余弦相似度，为每个知识点保存 top-k 近邻;
+2. 以用户最近对话涉及的分类、标签和来源知识点为种子，沿近邻列表扩散打分，
+   并按分类、标签共现加权，结果写入 KnowledgeRecommendation。
+
+接口只需读取预先计算的结果，不在请求时计算相似度。
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from .models import Conversation, KnowledgePoint, KnowledgePointNeighbor, KnowledgeRecommendation
+
+NEIGHBORS_PER_POINT = 10
+RECOMMENDATIONS_PER_USER = 20
+RECENT_CONVERSATIONS = 20
+# 出现在超过该比例文档中的词项不参与相似度计算，控制倒排链长度
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+WORD_RE = re.compile(r'[a-z0-9_]{2,}|[\u4e00-\u9fff]+')
+
+
+def tokenize(text):
+    """英文/数字按单词切分，连续中文按字二元组切分"""
+    tokens = []
+    for match in WORD_RE.findall((text or '').lower()):
+        if '\u4e00' <= match[0] <= '\u9fff':
+            if len(match) == 1:
+                tokens.append(match)
+            else:
+                tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+def tfidf_vectors(documents):
+    """documents: {id: text}，返回 {id: {term: weight}}，向量已做L2归一化"""
+    term_counts = {doc_id: Counter(tokenize(text)) for doc_id, text in documents.items()}
+    df = Counter()
+    for counts in term_counts.values():
+        df.update(counts.keys())
+
+    n_docs = len(documents)
+    max_df = max(2, int(n_docs * MAX_DOCUMENT_FREQUENCY))
+    idf = {term: math.log((n_docs + 1) / (freq + 1)) + 1 for term, freq in df.items() if freq <= max_df}
+
+    vectors = {}
+    for doc_id, counts in term_counts.items():
+        vector = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items() if term in idf}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        vectors[doc_id] = {term: w / norm for term, w in vector.items()} if norm else {}
+    return vectors
+
+
+def top_k_neighbors(vectors, k=NEIGHBORS_PER_POINT):
+    """通过倒排索引计算每个向量的 top-k 余弦近邻"""
+    postings = defaultdict(list)
+    for doc_id, vector in vectors.items():
+        for term, weight in vector.items():
+            postings[term].append((doc_id, weight))
+
+    neighbors = {}
+    for doc_id, vector in vectors.items():
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            for other_id, other_weight in postings[term]:
+                if other_id != doc_id:
+                    scores[other_id] += weight * other_weight
+        neighbors[doc_id] = sorted(scores.items(), key=lambda item: -item[1])[:k]
+    return neighbors
+
+
+@transaction.atomic
+def build_neighbors(user_id, k=NEIGHBORS_PER_POINT):
+    """重新计算用户全部知识点的近邻列表"""
+    documents = {
+        pk: f"{title}\n{title}\n{content}"  # 标题加倍权重
+        for pk, title, content in KnowledgePoint.objects.filter(user_id=user_id)
+        .values_list('id', 'title', 'content').order_by()
+    }
+    neighbors = top_k_neighbors(tfidf_vectors(documents), k)
+
+    KnowledgePointNeighbor.objects.filter(point__user_id=user_id).delete()
+    KnowledgePointNeighbor.objects.bulk_create([
+        KnowledgePointNeighbor(point_id=point_id, neighbor_id=neighbor_id, score=score)
+        for point_id, items in neighbors.items()
+        for neighbor_id, score in items
+    ], batch_size=5000)
+    return len(documents)
+
+
+@transaction.atomic
+def build_recommendations(user_id, limit=RECOMMENDATIONS_PER_USER):
+    """根据最近对话为用户计算推荐列表"""
+    recent = list(
+        Conversation.objects.filter(user_id=user_id)
+        .order_by('-updated_at').values_list('id', 'category_id')[:RECENT_CONVERSATIONS]
+    )
+    conversation_ids = [conversation_id for conversation_id, _ in recent]
+    # 越近的对话权重越高
+    category_weight = defaultdict(float)
+    for position, (_, category_id) in enumerate(recent):
+        if category_id:
+            category_weight[category_id] += 1 / (1 + position)
+    tag_weight = Counter(
+        Conversation.tags.through.objects.filter(conversation_id__in=conversation_ids)
+        .values_list('tag_id', flat=True)
+    )
+
+    points = {
+        pk: (category_id, source_conversation_id)
+        for pk, category_id, source_conversation_id in KnowledgePoint.objects.filter(user_id=user_id)
+        .values_list('id', 'category_id', 'source_message__conversation_id').order_by()
+    }
+    point_tags = defaultdict(set)
+    for point_id, tag_id in KnowledgePoint.tags.through.objects.filter(
+        knowledgepoint__user_id=user_id
+    ).values_list('knowledgepoint_id', 'tag_id'):
+        point_tags[point_id].add(tag_id)
+
+    def affinity(point_id):
+        """知识点与最近对话的分类、标签共现程度"""
+        category_id, _ = points[point_id]
+        return category_weight.get(category_id, 0.0) + 0.5 * sum(tag_weight.get(t, 0) for t in point_tags[point_id])
+
+    # 种子: 来自最近对话的知识点，以及与最近对话分类/标签共现的知识点
+    recent_set = set(conversation_ids)
+    seeds = {}
+    for point_id, (_, source_conversation_id) in points.items():
+        weight = affinity(point_id) + (1.0 if source_conversation_id in recent_set else 0.0)
+        if weight > 0:
+            seeds[point_id] = weight
+
+    scores = defaultdict(float)
+    for point_id, neighbor_id, similarity in KnowledgePointNeighbor.objects.filter(
+        point_id__in=list(seeds)
+    ).values_list('point_id', 'neighbor_id', 'score'):
+        scores[neighbor_id] += seeds[point_id] * similarity
+    for point_id in scores:
+        scores[point_id] += 0.1 * affinity(point_id)
+
+    # 用户刚在最近对话中看过的知识点不再推荐
+    for point_id, (_, source_conversation_id) in points.items():
+        if source_conversation_id in recent_set:
+            scores.pop(point_id, None)
+
+    ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+    KnowledgeRecommendation.objects.filter(user_id=user_id).delete()
+    KnowledgeRecommendation.objects.bulk_create([
+        KnowledgeRecommendation(user_id=user_id, point_id=point_id, score=score)
+        for point_id, score in ranked
+    ])
+    return len(ranked)
+
+
+def refresh_user_recommendations(user_id):
+    build_neighbors(user_id)
+    return build_recommendations(user_id)
@@ -0,0 +1,365 @@
+"""知识点/消息的混合检索
+
+全文检索: search_tokens 列保存按 recommend.tokenize 切分后的词项(中文为字二元组)，
+PostgreSQL 上对 to_tsvector('simple', search_tokens) 建 GIN 索引(迁移 0016)，
+用 ts_rank_cd 排序；其他数据库退化为 LIKE 匹配全部词项、按ID倒序。
+
+向量检索: 用户全部向量按 (目标, 用户) 组成归一化矩阵缓存在进程内(总字节数受
+SEARCH_MATRIX_CACHE_MB 限制)，同时缓存每行的分类ID、所属对象和标签对，分类/标签
+筛选在打分后按这些数组屏蔽；查询向量与矩阵做一次矩阵乘法后取 top-k。
+
+向量检索在线程池中执行，全文检索同时在调用线程中执行，结果按倒数排名融合(RRF)。
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, connections
+
+from knowledge_hub.cache import LocalTTLCache, TieredCache
+
+from .models import Category, Conversation, KnowledgePoint, Message, UserStats
+from .recommend import tokenize
+
+# RRF 常数，越大越弱化头部排名的差异
+RRF_K = 60
+# 每一路检索取回的候选数
+CANDIDATES = 100
+DEFAULT_LIMIT = 20
+MAX_QUERY_TOKENS = 64
+
+# owner_field: 标签挂在哪个对象上(知识点自身，消息则为所属对话)
+# tag_through: (标签中间表, 对象列, 中间表上的用户字段)
+TARGETS = {
+    'knowledge': {
+        'model': KnowledgePoint,
+        'user_field': 'user',
+        'category_field': 'category_id',
+        'owner_field': 'id',
+        'tag_through': (KnowledgePoint.tags.through, 'knowledgepoint_id', 'knowledgepoint__user'),
+    },
+    'messages': {
+        'model': Message,
+        'user_field': 'conversation__user',
+        'category_field': 'conversation__category_id',
+        'owner_field': 'conversation_id',
+        'tag_through': (Conversation.tags.through, 'conversation_id', 'conversation__user'),
+    },
+}
+
+# 查询结果缓存: 键中带用户统计版本号，知识点等变化后自然失效
+result_cache = LocalTTLCache(maxsize=256, ttl=30)
+# 查询文本的向量
+query_vector_cache = LocalTTLCache(maxsize=1024, ttl=600)
+
+
+def matrix_nbytes(entry):
+    return sum(value.nbytes for value in entry.values() if isinstance(value, np.ndarray))
+
+
+# (目标, 用户) -> 矩阵条目(见 load_matrix)，按数组总字节数限制容量
+matrix_cache = LocalTTLCache(
+    maxsize=256, ttl=300,
+    maxweight=getattr(settings, 'SEARCH_MATRIX_CACHE_MB', 256) * 1024 * 1024, weigh=matrix_nbytes,
+)
+# 向量生成流水线写回后递增: 写回向量不递增用户统计版本号
+embedding_versions = TieredCache('search:embedding-version', timeout=None, local_ttl=5, local_size=8)
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='search')
+
+
+def index_text(*parts):
+    """生成 search_tokens 列的内容"""
+    return ' '.join(tokenize('\n'.join(part for part in parts if part)))
+
+
+def backfill_search_tokens(target, batch_size=1000):
+    """为缺少 search_tokens 的行(如批量写入的数据)补算词项"""
+    model = TARGETS[target]['model']
+    fields = ('title', 'content') if target == 'knowledge' else ('content',)
+    updated = 0
+    batch = []
+    queryset = model.objects.filter(search_tokens__isnull=True).only('id', *fields)
+    for obj in queryset.iterator(chunk_size=batch_size):
+        obj.search_tokens = index_text(*(getattr(obj, field) for field in fields))
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_update(batch, ['search_tokens'])
+            updated += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, ['search_tokens'])
+        updated += len(batch)
+    return updated
+
+
+def tsquery(tokens):
+    # 词项只含字母、数字、下划线和汉字，可以直接拼接
+    return ' | '.join(dict.fromkeys(tokens))
+
+
+def category_subtree(user, category_id):
+    """分类及其全部子分类的ID列表；分类不存在时返回 None"""
+    path = Category.objects.filter(user=user, pk=category_id).values_list('path', flat=True).first()
+    if path is None:
+        return None
+    return list(Category.objects.filter(user=user, path__startswith=path).values_list('id', flat=True))
+
+
+def base_queryset(target, user, category_ids=None, tag_ids=None):
+    """按用户、分类(category_subtree 的结果)和标签过滤后的查询集"""
+    spec = TARGETS[target]
+    queryset = spec['model'].objects.filter(**{spec['user_field']: user})
+    if category_ids is not None:
+        queryset = queryset.filter(**{f"{spec['category_field']}__in": category_ids})
+    if tag_ids:
+        through, column, _ = spec['tag_through']
+        queryset = queryset.filter(
+            **{f"{spec['owner_field']}__in": through.objects.filter(tag_id__in=tag_ids).values(column)}
+        )
+    if target == 'messages':
+        queryset = queryset.filter(role__in=['user', 'assistant'])
+    return queryset
+
+
+def text_search(queryset, tokens, limit=CANDIDATES):
+    """全文检索，返回按相关度排序的ID列表"""
+    if not tokens:
+        return []
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        vector = f"to_tsvector('simple', {table}.search_tokens)"
+        query = tsquery(tokens)
+        queryset = queryset.extra(
+            select={'rank': f"ts_rank_cd({vector}, to_tsquery('simple', %s))"},
+            select_params=[query],
+            where=[f"{vector} @@ to_tsquery('simple', %s)"],
+            params=[query],
+        ).order_by('-rank')
+    else:
+        # 没有全文索引时要求包含全部词项
+        for token in dict.fromkeys(tokens):
+            queryset = queryset.filter(search_tokens__contains=token)
+        queryset = queryset.order_by('-id')
+    return list(queryset.values_list('id', flat=True)[:limit])
+
+
+def query_vector(text, cached_only=False):
+    """查询文本的归一化向量；没有可用的向量模型时返回 None
+
+    cached_only 为真时只查缓存，未缓存时返回 None 而不调用向量模型。
+    """
+    from .embeddings import get_embedding_service
+
+    try:
+        service = get_embedding_service()
+    except ValueError:
+        return None
+    key = (service.model_config.model_id, text)
+    vector = query_vector_cache.get(key)
+    if vector is None and not cached_only:
+        vectors, _ = service.embed([text])
+        vector = np.asarray(vectors[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        query_vector_cache.set(key, vector)
+    return vector
+
+
+def bump_embedding_version(target):
+    """向量写回后调用，使该目标所有已缓存的矩阵失效"""
+    embedding_versions.incr(target)
+
+
+def load_matrix(target, user, version):
+    """用户全部向量组成的矩阵条目
+
+    返回 {'ids', 'matrix'(归一化), 'categories'(每行的分类ID，无分类为-1),
+    'owners'(每行挂标签的对象ID), 'tag_owners'/'tag_ids'(对象与标签的对应)}。
+
+    version 为用户统计版本号(知识点、对话、消息和标签变化时递增)，与向量写回版本号
+    一起作为缓存版本，检索时不再为判断矩阵是否过期查询数据库。
+    """
+    spec = TARGETS[target]
+    version = (version, embedding_versions.get(target, 0))
+    key = (target, user.pk)
+    cached = matrix_cache.get(key)
+    if cached is not None and cached['version'] == version:
+        return cached
+
+    queryset = base_queryset(target, user).filter(embedding__isnull=False).order_by('id')
+    rows = []
+    vectors = []
+    columns = ('id', 'embedding', spec['category_field'], spec['owner_field'])
+    for pk, vector, category_id, owner_id in queryset.values_list(*columns).iterator(chunk_size=2000):
+        if vectors and len(vector) != len(vectors[0]):
+            # 更换过向量模型的旧数据维度不同，跳过
+            continue
+        rows.append((pk, -1 if category_id is None else category_id, owner_id))
+        vectors.append(vector)
+    through, column, user_field = spec['tag_through']
+    tags = list(through.objects.filter(**{user_field: user}).values_list(column, 'tag_id'))
+
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+    tags = np.asarray(tags, dtype=np.int64).reshape(-1, 2)
+    if vectors:
+        matrix = np.vstack(vectors).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    entry = {
+        'version': version,
+        'ids': rows[:, 0].copy(),
+        'matrix': matrix,
+        'categories': rows[:, 1].copy(),
+        'owners': rows[:, 2].copy(),
+        'tag_owners': tags[:, 0].copy(),
+        'tag_ids': tags[:, 1].copy(),
+    }
+    matrix_cache.set(key, entry)
+    return entry
+
+
+def row_mask(entry, category_ids=None, tag_ids=None, exclude_owner=None):
+    """按缓存的分类/标签数组计算允许的行，没有筛选条件时返回 None"""
+    masks = []
+    if category_ids is not None:
+        masks.append(np.isin(entry['categories'], np.asarray(category_ids, dtype=np.int64)))
+    if tag_ids:
+        owners = entry['tag_owners'][np.isin(entry['tag_ids'], np.asarray(tag_ids, dtype=np.int64))]
+        masks.append(np.isin(entry['owners'], owners))
+    if exclude_owner is not None:
+        masks.append(entry['owners'] != exclude_owner)
+    return np.logical_and.reduce(masks) if masks else None
+
+
+def vector_search(target, user, vector, version, category_ids=None, tag_ids=None, exclude_owner=None,
+                  limit=CANDIDATES):
+    """向量检索，返回按余弦相似度排序的ID列表
+
+    exclude_owner 排除挂在该对象下的行(消息为对话ID)。
+    """
+    if vector is None:
+        return []
+    entry = load_matrix(target, user, version)
+    ids, matrix = entry['ids'], entry['matrix']
+    if not len(ids) or matrix.shape[1] != vector.shape[0]:
+        return []
+    scores = matrix @ vector
+    mask = row_mask(entry, category_ids, tag_ids, exclude_owner)
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    count = min(limit, len(ids))
+    top = np.argpartition(-scores, count - 1)[:count]
+    top = top[np.argsort(-scores[top])]
+    return [int(ids[i]) for i in top if np.isfinite(scores[i])]
+
+
+def rrf(rankings, k=RRF_K):
+    """倒数排名融合: rankings 为 {来源: [键, ...]}，返回 [(键, 分数, [命中来源])]"""
+    scores = {}
+    sources = {}
+    for source, keys in rankings.items():
+        for rank, key in enumerate(keys, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            sources.setdefault(key, []).append(source)
+    return [(key, score, sources[key]) for key, score in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+def _run(func, *args):
+    """在线程池中执行，结束时关闭本线程的数据库连接"""
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def vector_rankings(user, query, targets, version, filters, vector=None):
+    """生成一次查询向量(已传入时直接使用)，依次在各目标上做向量检索
+
+    filters 为 {目标: vector_search 的筛选参数}。
+    """
+    if vector is None:
+        try:
+            vector = query_vector(query)
+        except Exception as e:
+            print(f"查询向量生成失败，只使用全文检索: {e}")
+            return {}
+    if vector is None:
+        return {}
+    return {target: vector_search(target, user, vector, version, **filters[target]) for target in targets}
+
+
+def hybrid_search(user, query, targets=('knowledge', 'messages'), category_id=None, tag_ids=None,
+                  limit=DEFAULT_LIMIT, vector_timeout=None, exclude_conversation_id=None):
+    """返回 [(目标, ID, 分数, 命中来源)]，按融合分数排序
+
+    结果缓存的键中带用户统计版本号，知识点、对话和消息变化后失效。
+
+    vector_timeout(秒)用于有延迟要求的调用方: 只使用已缓存的查询向量(现算
+    的向量在时限内用不上，不调用向量模型)；向量检索超时后只使用全文检索结果，
+    且不写入结果缓存。
+
+    exclude_conversation_id 排除该对话中的消息(如正在进行的对话，已在历史里)。
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+    tag_ids = sorted(tag_ids or [])
+    stats = UserStats.for_user(user.pk)
+    cache_key = (user.pk, stats.version, query, tuple(targets), category_id, tuple(tag_ids), limit,
+                 exclude_conversation_id)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    category_ids = None
+    if category_id:
+        category_ids = category_subtree(user, category_id)
+        if category_ids is None:
+            # 分类不存在
+            targets = ()
+
+    querysets = {}
+    filters = {}
+    for target in targets:
+        querysets[target] = base_queryset(target, user, category_ids, tag_ids)
+        filters[target] = {'category_ids': category_ids, 'tag_ids': tag_ids}
+    if exclude_conversation_id is not None and 'messages' in querysets:
+        querysets['messages'] = querysets['messages'].exclude(conversation_id=exclude_conversation_id)
+        filters['messages']['exclude_owner'] = exclude_conversation_id
+
+    # 向量检索(含调用向量模型)在线程池中执行，全文检索在当前线程中同时进行，
+    # 不会排在线程池中等待向量模型的任务后面
+    vector_future = None
+    if vector_timeout is None:
+        vector_future = _executor.submit(_run, vector_rankings, user, query, list(querysets), stats.version, filters)
+    else:
+        try:
+            vector = query_vector(query, cached_only=True)
+        except Exception as e:
+            print(f"查询向量读取失败，只使用全文检索: {e}")
+            vector = None
+        if vector is not None:
+            vector_future = _executor.submit(
+                _run, vector_rankings, user, query, list(querysets), stats.version, filters, vector,
+            )
+
+    rankings = {}
+    for target, queryset in querysets.items():
+        rankings[f'{target}:text'] = [(target, pk) for pk in text_search(queryset, tokens)]
+    vector_results, partial = {}, vector_future is None and vector_timeout is not None
+    if vector_future is not None:
+        try:
+            vector_results = vector_future.result(timeout=vector_timeout)
+        except TimeoutError:
+            partial = True
+    for target, ids in vector_results.items():
+        rankings[f'{target}:vector'] = [(target, pk) for pk in ids]
+
+    results = [
+        (target, pk, score, sorted({source.split(':')[1] for source in matched}))
+        for (target, pk), score, matched in rrf(rankings)[:limit]
+    ]
+    if not partial:
+        result_cache.set(cache_key, results)
+    return results
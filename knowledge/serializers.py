@@ -1,27 +1,59 @@
 from rest_framework import serializers
-from .models import Category, Tag, Conversation, Message, KnowledgePoint
+from .instrumentation import TimedSerializerMixin
+from .models import Category, Tag, Conversation, ConversationArchive, Message, KnowledgePoint
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     parent_name = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'parent', 'parent_name', 'created_at']
+        fields = ['id', 'name', 'description', 'parent', 'parent_name', 'path', 'depth', 'created_at']
+        read_only_fields = ['path', 'depth']
     
     def get_parent_name(self, obj):
         return obj.parent.name if obj.parent else None
+    
+    def validate_parent(self, value):
+        if value is None:
+            return value
+        request = self.context.get('request')
+        if request and value.user_id != request.user.id:
+            raise serializers.ValidationError('父分类不存在')
+        if self.instance and value.path.startswith(self.instance.path):
+            raise serializers.ValidationError('不能将分类移动到它自己的子分类下')
+        return value
+
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    sources = serializers.SerializerMethodField()
+    has_reasoning = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'role', 'content', 'timestamp', 'sources', 'has_reasoning']
+    
+    def get_sources(self, obj):
+        # 助手回复引用的知识来源(见 knowledge.rag)
+        return (obj.metadata or {}).get('sources', [])
+    
+    def get_has_reasoning(self, obj):
+        # 由 with_reasoning_flag() 标注；思考过程通过 messages/<id>/reasoning 按需读取
+        return getattr(obj, 'has_reasoning', False)
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """消息列表: 只返回预览，需配合 Message.objects.for_list() 使用"""
+    preview = serializers.CharField(read_only=True)
+    content_length = serializers.IntegerField(read_only=True)
+    
     class Meta:
         model = Message
-        fields = ['id', 'role', 'content', 'timestamp']
+        fields = ['id', 'role', 'preview', 'content_length', 'timestamp']
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     category_name = serializers.SerializerMethodField()
     message_count = serializers.SerializerMethodField()
@@ -29,7 +61,8 @@ class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'summary', 'category', 'category_name', 
-                  'tags', 'created_at', 'updated_at', 'message_count']
+                  'tags', 'created_at', 'updated_at', 'archived_at', 'message_count']
+        read_only_fields = ['archived_at']
         extra_kwargs = {
             'title': {'required': False, 'default': '未命名对话'}
         }
@@ -38,7 +71,18 @@ class ConversationSerializer(serializers.ModelSerializer):
         return obj.category.name if obj.category else None
     
     def get_message_count(self, obj):
-        return obj.messages.count()
+        # 列表查询通过 annotate 预先计算，避免逐行 COUNT
+        count = getattr(obj, 'message_count', None)
+        if count is None:
+            count = obj.messages.count()
+        # 已归档的消息不在消息表中，加上归档中的条数
+        if obj.archived_at is not None:
+            archived = getattr(obj, 'archived_message_count', None)
+            if archived is None:
+                archived = ConversationArchive.objects.filter(conversation=obj).values_list(
+                    'message_count', flat=True).first()
+            count += archived or 0
+        return count
 
 class ConversationDetailSerializer(ConversationSerializer):
     messages = MessageSerializer(many=True, read_only=True)
@@ -46,7 +90,7 @@ class ConversationDetailSerializer(ConversationSerializer):
     class Meta(ConversationSerializer.Meta):
         fields = ConversationSerializer.Meta.fields + ['messages']
 
-class KnowledgePointSerializer(serializers.ModelSerializer):
+class KnowledgePointSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     category_name = serializers.SerializerMethodField()
     
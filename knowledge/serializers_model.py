@@ -1,7 +1,8 @@
 from rest_framework import serializers
+from knowledge.instrumentation import TimedSerializerMixin
 from knowledge.ai_models import ModelProvider, AIModel, TokenUsage, PromptTemplate, PromptScene
 
-class ModelProviderSerializer(serializers.ModelSerializer):
+class ModelProviderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ModelProvider
         fields = '__all__'
@@ -10,7 +11,7 @@ class ModelProviderSerializer(serializers.ModelSerializer):
             'api_secret': {'write_only': True}
         }
 
-class AIModelSerializer(serializers.ModelSerializer):
+class AIModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     provider_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -20,7 +21,7 @@ class AIModelSerializer(serializers.ModelSerializer):
     def get_provider_name(self, obj):
         return obj.provider.name if obj.provider else None
 
-class TokenUsageSerializer(serializers.ModelSerializer):
+class TokenUsageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_name = serializers.SerializerMethodField()
     model_name = serializers.SerializerMethodField()
     
@@ -34,7 +35,7 @@ class TokenUsageSerializer(serializers.ModelSerializer):
     def get_model_name(self, obj):
         return obj.model.name if obj.model else None
 
-class ModelStatSerializer(serializers.Serializer):
+class ModelStatSerializer(TimedSerializerMixin, serializers.Serializer):
     """用于模型使用统计的序列化器"""
     period = serializers.CharField()
     days = serializers.IntegerField()
@@ -45,7 +46,7 @@ class ModelStatSerializer(serializers.Serializer):
     user_stats = serializers.ListField(child=serializers.DictField())
     totals = serializers.DictField()
 
-class PromptSceneSerializer(serializers.ModelSerializer):
+class PromptSceneSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """提示词场景序列化器"""
     template_count = serializers.SerializerMethodField()
 
@@ -59,7 +60,9 @@ class PromptSceneSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
     def get_template_count(self, obj):
-        """获取场景下的模板数量"""
+        """获取场景下的模板数量，优先使用查询集中注解的数量"""
+        if hasattr(obj, 'template_count'):
+            return obj.template_count
         return obj.templates.count()
 
     def validate_code(self, value):
@@ -68,7 +71,7 @@ class PromptSceneSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("场景代码只能包含小写字母、数字和下划线")
         return value
 
-class PromptTemplateSerializer(serializers.ModelSerializer):
+class PromptTemplateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """提示词模板序列化器"""
     scene_name = serializers.CharField(source='scene.name', read_only=True)
     
@@ -87,4 +90,19 @@ class PromptTemplateSerializer(serializers.ModelSerializer):
         """验证变量字段格式"""
         if not isinstance(value, dict):
             raise serializers.ValidationError("变量必须是字典格式")
-        return value
\ No newline at end of file
+        return value
+
+class PromptTemplateListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """提示词模板列表序列化器，不包含 content 和 example_values 等大字段"""
+    scene_name = serializers.CharField(source='scene.name', read_only=True)
+    
+    class Meta:
+        model = PromptTemplate
+        fields = [
+            'id', 'name', 'description',
+            'scene', 'scene_name', 'template_type',
+            'system_prompt', 'model', 'variables',
+            'is_public', 'created_by',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
\ No newline at end of file
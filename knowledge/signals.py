@@ -0,0 +1,85 @@
+from django.db.models.functions import Now
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import model_catalog
+from .ai_models import AIModel, ModelProvider
+from .models import Category, Tag, Conversation, KnowledgePoint, Message, UserStats
+
+# 模型 -> UserStats 中对应的计数字段
+STATS_COUNTERS = {
+    Conversation: 'conversations',
+    KnowledgePoint: 'knowledge_points',
+    Category: 'categories',
+    Tag: 'tags',
+}
+
+
+def increment_user_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    field = STATS_COUNTERS[sender]
+    # 更新也会影响最近列表的展示内容，只递增版本号
+    UserStats.bump(instance.user_id, field if created else None, 1 if created else 0)
+
+
+def decrement_user_stats(sender, instance, **kwargs):
+    UserStats.bump(instance.user_id, STATS_COUNTERS[sender], -1)
+
+
+# 按模型分别连接: 不指定 sender 的 post_delete 接收器会让所有模型的级联删除
+# 都无法走快速删除，逐行加载并发送信号
+for model in STATS_COUNTERS:
+    post_save.connect(increment_user_stats, sender=model, dispatch_uid=f'stats_save_{model._meta.label}')
+    post_delete.connect(decrement_user_stats, sender=model, dispatch_uid=f'stats_delete_{model._meta.label}')
+
+
+def bump_message_version(sender, instance, created=True, raw=False, origin=None, **kwargs):
+    """消息增删改变对话列表中的消息数，递增所属用户的版本号
+
+    一次删除(删除对话、批量删除消息)中同一对话的消息只递增一次: 在发起删除的
+    对象上记录已处理的对话。
+    """
+    if raw or not created:
+        return
+    if origin is not None:
+        bumped = origin.__dict__.setdefault('_bumped_conversations', set())
+        if instance.conversation_id in bumped:
+            return
+        bumped.add(instance.conversation_id)
+    UserStats.bump_for_conversation(instance.conversation_id)
+
+
+post_save.connect(bump_message_version, sender=Message, dispatch_uid='stats_save_message')
+post_delete.connect(bump_message_version, sender=Message, dispatch_uid='stats_delete_message')
+
+
+def touch_tagged(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """标签增减不会改变对象自身的 updated_at，这里手动更新，
+    使列表的 ETag/Last-Modified(见 knowledge.conditional)随之变化；
+    同时递增用户版本号(检索结果和向量矩阵缓存中含标签)"""
+    if not reverse:
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        queryset = type(instance).objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        # 从标签一侧清空时 pk_set 为空，清空前取出受影响的对象
+        queryset = model.objects.filter(tags=instance)
+    elif action in ('post_add', 'post_remove'):
+        queryset = model.objects.filter(pk__in=pk_set or [])
+    else:
+        return
+    queryset.update(updated_at=Now())
+    UserStats.bump(instance.user_id)
+
+
+for model in (Conversation, KnowledgePoint):
+    m2m_changed.connect(touch_tagged, sender=model.tags.through, dispatch_uid=f'touch_tags_{model._meta.label}')
+
+
+@receiver([post_save, post_delete], sender=AIModel)
+@receiver([post_save, post_delete], sender=ModelProvider)
+def invalidate_model_catalog(sender, raw=False, **kwargs):
+    if raw:
+        return
+    model_catalog.bump_version()
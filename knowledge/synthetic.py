@@ -0,0 +1,399 @@
+"""可复现的大规模合成数据生成
+
+供 ``python manage.py generate_synthetic_data`` 使用。同一个种子生成的数据
+完全一致，便于在不同运行之间比较基准测试结果和查询计划。
+
+在 PostgreSQL 上使用 ``COPY ... FROM STDIN`` 分块写入(主键通过序列预先分配)，
+其他数据库回退到分块的 ``bulk_create``。
+
+时间以固定的基准时间(默认 DEFAULT_EPOCH，可用 --epoch 指定)往前分布，
+不随生成的日期变化。
+"""
+import csv
+import hashlib
+import io
+import json
+import math
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from .models import Category, Tag, Conversation, Message, KnowledgePoint, UserStats
+from .dedup import fingerprint
+from .partitions import ensure_partitions
+from .search import index_text
+
+User = get_user_model()
+
+NULL = '\\N'
+# 生成数据的时间截止于此
+DEFAULT_EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+ZH_WORDS = [
+    '数据库', '索引', '查询', '缓存', '模型', '向量', '检索', '分区', '事务', '并发',
+    '知识', '分类', '标签', '对话', '摘要', '性能', '优化', '延迟', '吞吐', '架构',
+    '函数', '接口', '部署', '监控', '日志', '算法', '结构', '网络', '安全', '测试',
+]
+EN_WORDS = [
+    'django', 'postgres', 'redis', 'celery', 'python', 'vue', 'index', 'query', 'cache', 'token',
+    'embedding', 'latency', 'throughput', 'partition', 'vector', 'search', 'api', 'stream', 'batch', 'worker',
+]
+
+
+def lognormal_count(rng, mean, sigma):
+    """按给定均值采样非负整数，sigma 为 0 时返回固定值"""
+    if mean <= 0:
+        return 0
+    if sigma <= 0:
+        return int(round(mean))
+    mu = math.log(mean) - sigma ** 2 / 2
+    return int(round(rng.lognormvariate(mu, sigma)))
+
+
+def random_text(rng, min_words, max_words):
+    words = []
+    for _ in range(rng.randint(min_words, max_words)):
+        words.append(rng.choice(ZH_WORDS) if rng.random() < 0.6 else rng.choice(EN_WORDS))
+    return ' '.join(words)
+
+
+class SyntheticDataGenerator:
+    """合成数据生成器"""
+
+    def __init__(self, seed=42, chunk_size=10000, use_copy=True, days=180, epoch=None, stdout=None):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.days = days
+        self.now = (epoch or DEFAULT_EPOCH).replace(microsecond=0)
+        self.stdout = stdout
+        self.counts = {}
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def reserve_ids(self, model, n):
+        """从主键序列中预先分配 n 个ID"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [model._meta.db_table, n],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def insert(self, model, rows, returning=True):
+        """分块写入行(字段名使用 attname)，returning 为真时返回新行ID"""
+        ids = []
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            if self.use_copy:
+                if returning:
+                    chunk_ids = self.reserve_ids(model, len(chunk))
+                    for row, pk in zip(chunk, chunk_ids):
+                        row['id'] = pk
+                    ids.extend(chunk_ids)
+                self.copy_rows(model, chunk)
+            else:
+                objs = model.objects.bulk_create([model(**row) for row in chunk])
+                # bulk_create 会用当前时间覆盖 auto_now/auto_now_add 字段，写入后恢复生成的时间
+                auto_fields = [
+                    field.attname for field in model._meta.concrete_fields
+                    if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+                ]
+                if auto_fields:
+                    for obj, row in zip(objs, chunk):
+                        for attname in auto_fields:
+                            setattr(obj, attname, row[attname])
+                    model.objects.bulk_update(objs, auto_fields)
+                if returning:
+                    ids.extend(obj.pk for obj in objs)
+        self.counts[model._meta.label] = self.counts.get(model._meta.label, 0) + len(rows)
+        return ids
+
+    def copy_rows(self, model, rows):
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([self.format_value(row[column]) for column in columns])
+        buffer.seek(0)
+        table = connection.ops.quote_name(model._meta.db_table)
+        column_sql = ', '.join(connection.ops.quote_name(model._meta.get_field(c).column) for c in columns)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table} ({column_sql}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+                buffer,
+            )
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return NULL
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def random_time(self, after=None):
+        if after is None:
+            return self.now - timedelta(seconds=self.rng.randint(0, self.days * 86400))
+        remaining = max(1, int((self.now - after).total_seconds()))
+        return after + timedelta(seconds=self.rng.randint(0, remaining))
+
+    # ------------------------------------------------------------------
+    # 生成
+    # ------------------------------------------------------------------
+
+    def generate(self, users=10, conversations=1000, messages=20, categories=200, tags=200,
+                 knowledge_ratio=0.5, token_usage=0, sigma=1.0):
+        """生成完整数据集
+
+        conversations/messages 分别为每用户对话数、每对话消息数的均值，
+        实际数量按对数正态分布采样，sigma 控制离散程度。
+        同一种子再次生成时先删除上次生成的用户及其全部数据。
+        """
+        self.clear_previous()
+        user_ids = self.create_users(users)
+        conversation_ids_by_user = {}
+        for index, user_id in enumerate(user_ids):
+            with transaction.atomic():
+                tag_ids = self.create_tags(user_id, tags)
+                category_ids = self.create_categories(user_id, categories)
+                conversation_ids_by_user[user_id] = self.create_conversations(
+                    user_id,
+                    lognormal_count(self.rng, conversations, sigma),
+                    messages, sigma, category_ids, tag_ids, knowledge_ratio,
+                )
+                # 批量写入不触发信号，直接重新计算统计
+                UserStats.recompute(user_id)
+            self.log(f"用户 {index + 1}/{len(user_ids)} 完成: {len(conversation_ids_by_user[user_id])} 个对话")
+
+        if token_usage:
+            with transaction.atomic():
+                self.create_token_usage(token_usage, conversation_ids_by_user)
+        return self.counts
+
+    def user_prefix(self):
+        return f'synth_{self.seed}_'
+
+    def clear_previous(self):
+        """删除本种子之前生成的用户及其数据，用户名才不会冲突
+
+        ORM 的级联删除会把百万级的对话、消息逐批取回再删除；这里按外键顺序
+        对每张大表执行一条 DELETE，最后用 ORM 删除用户本身和其余少量关联行
+        (Token、统计等)。
+        """
+        queryset = User.objects.filter(username__startswith=self.user_prefix())
+        user_ids = list(queryset.values_list('id', flat=True))
+        if not user_ids:
+            return
+        self.log(f"删除种子 {self.seed} 上次生成的 {len(user_ids)} 个用户及其数据")
+        from .ai_models import TokenUsage
+        from .models import ConversationArchive, KnowledgePointNeighbor, KnowledgeRecommendation, MessageReasoning
+
+        def table(model):
+            return connection.ops.quote_name(model._meta.db_table)
+
+        users = ', '.join(['%s'] * len(user_ids))
+        conversations = f"SELECT id FROM {table(Conversation)} WHERE user_id IN ({users})"
+        messages = f"SELECT id FROM {table(Message)} WHERE conversation_id IN ({conversations})"
+        points = f"SELECT id FROM {table(KnowledgePoint)} WHERE user_id IN ({users})"
+        statements = [
+            (KnowledgePointNeighbor, f"point_id IN ({points}) OR neighbor_id IN ({points})", 2),
+            (KnowledgeRecommendation, f"user_id IN ({users})", 1),
+            (KnowledgePoint.tags.through, f"knowledgepoint_id IN ({points})", 1),
+            (KnowledgePoint.extra_sources.through, f"knowledgepoint_id IN ({points})", 1),
+            (KnowledgePoint, f"user_id IN ({users})", 1),
+            (TokenUsage, f"user_id IN ({users})", 1),
+            (MessageReasoning, f"message_id IN ({messages})", 1),
+            (Message, f"conversation_id IN ({conversations})", 1),
+            (ConversationArchive, f"conversation_id IN ({conversations})", 1),
+            (Conversation.tags.through, f"conversation_id IN ({conversations})", 1),
+            (Conversation, f"user_id IN ({users})", 1),
+            (Tag, f"user_id IN ({users})", 1),
+            (Category, f"user_id IN ({users})", 1),
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model, where, repeat in statements:
+                cursor.execute(f"DELETE FROM {table(model)} WHERE {where}", user_ids * repeat)
+            queryset.delete()
+
+    def create_users(self, count):
+        rows = [{
+            'username': f'{self.user_prefix()}{i}',
+            'password': '!',
+            'email': f'{self.user_prefix()}{i}@example.com',
+            'first_name': '',
+            'last_name': '',
+            'bio': '',
+            'is_staff': False,
+            'is_active': True,
+            'is_superuser': False,
+            'date_joined': self.random_time(),
+        } for i in range(count)]
+        with transaction.atomic():
+            return self.insert(User, rows)
+
+    def create_tags(self, user_id, count):
+        rows = [
+            {'name': f'{self.rng.choice(ZH_WORDS)}-{i}', 'user_id': user_id, 'updated_at': self.random_time()}
+            for i in range(count)
+        ]
+        return self.insert(Tag, rows)
+
+    def create_categories(self, user_id, count):
+        """逐层生成分类树，每个节点的子节点数量服从几何分布"""
+        ids = []
+        level = [None]
+        while len(ids) < count and level:
+            rows = []
+            for parent_id in level:
+                n_children = 1 + int(self.rng.expovariate(1 / 3)) if parent_id else max(1, count // 20)
+                for _ in range(n_children):
+                    if len(ids) + len(rows) >= count:
+                        break
+                    created = self.random_time()
+                    rows.append({
+                        'name': random_text(self.rng, 1, 3),
+                        'description': '',
+                        'parent_id': parent_id,
+                        'user_id': user_id,
+                        'created_at': created,
+                        'updated_at': created,
+                    })
+            level = self.insert(Category, rows)
+            ids.extend(level)
+        Category.rebuild_paths(user_id=user_id)
+        return ids
+
+    def create_conversations(self, user_id, count, messages, sigma, category_ids, tag_ids, knowledge_ratio):
+        conversation_rows = []
+        for _ in range(count):
+            created = self.random_time()
+            conversation_rows.append({
+                'title': random_text(self.rng, 2, 6),
+                'summary': random_text(self.rng, 10, 30) if self.rng.random() < 0.7 else '',
+                'category_id': self.rng.choice(category_ids) if category_ids and self.rng.random() < 0.8 else None,
+                'user_id': user_id,
+                'created_at': created,
+                'updated_at': self.random_time(created),
+            })
+        conversation_ids = self.insert(Conversation, conversation_rows)
+
+        through_rows = []
+        message_rows = []
+        for conversation_id, conversation in zip(conversation_ids, conversation_rows):
+            for tag_id in self.rng.sample(tag_ids, min(len(tag_ids), self.rng.randint(0, 3))):
+                through_rows.append({'conversation_id': conversation_id, 'tag_id': tag_id})
+
+            timestamp = conversation['created_at']
+            for position in range(lognormal_count(self.rng, messages, sigma)):
+                content = random_text(self.rng, 5, 120)
+                timestamp = timestamp + timedelta(seconds=self.rng.randint(1, 600))
+                message_rows.append({
+                    'conversation_id': conversation_id,
+                    'role': 'user' if position % 2 == 0 else 'assistant',
+                    'content': content,
+                    'embedding': None,
+                    'metadata': None,
+                    'timestamp': timestamp,
+                    'message_hash': hashlib.md5(f'{content}#{position}'.encode()).hexdigest(),
+                    'search_tokens': index_text(content),
+                    'request_id': None,
+                })
+        self.insert(Conversation.tags.through, through_rows, returning=False)
+        message_ids = self.insert(Message, message_rows)
+
+        if knowledge_ratio and category_ids:
+            self.create_knowledge_points(user_id, message_rows, message_ids, category_ids, tag_ids, knowledge_ratio)
+        return conversation_ids
+
+    def create_knowledge_points(self, user_id, message_rows, message_ids, category_ids, tag_ids, ratio):
+        point_rows = []
+        point_tags = []
+        for row, message_id in zip(message_rows, message_ids):
+            if row['role'] != 'assistant' or self.rng.random() >= ratio:
+                continue
+            title = random_text(self.rng, 2, 5)
+            content = random_text(self.rng, 20, 150)
+            point_rows.append({
+                'title': title,
+                'content': content,
+                'source_message_id': message_id,
+                'category_id': self.rng.choice(category_ids),
+                'user_id': user_id,
+                'created_at': row['timestamp'],
+                'updated_at': row['timestamp'],
+                'content_hash': KnowledgePoint.make_content_hash(title, content),
+                'search_tokens': index_text(title, content),
+                **fingerprint(title, content),
+            })
+            point_tags.append(self.rng.sample(tag_ids, min(len(tag_ids), self.rng.randint(0, 4))))
+        point_ids = self.insert(KnowledgePoint, point_rows)
+
+        through = KnowledgePoint.tags.through
+        self.insert(through, [
+            {'knowledgepoint_id': point_id, 'tag_id': tag_id}
+            for point_id, tags in zip(point_ids, point_tags)
+            for tag_id in tags
+        ], returning=False)
+
+    def create_token_usage(self, count, conversation_ids_by_user):
+        from .ai_models import ModelProvider, AIModel, TokenUsage
+
+        # 分区表上先建好覆盖生成时间范围的月份分区，避免数据全部落入默认分区
+        ensure_partitions(start=self.now - timedelta(days=self.days))
+
+        provider, _ = ModelProvider.objects.get_or_create(slug='mock', defaults={'name': 'Mock'})
+        model_ids = [
+            AIModel.objects.get_or_create(
+                model_id=f'synth-model-{i}',
+                defaults={'name': f'Synthetic {i}', 'provider': provider,
+                          'cost_prompt': 0.001 * (i + 1), 'cost_completion': 0.002 * (i + 1)},
+            )[0].pk
+            for i in range(3)
+        ]
+        # 调用量与对话数成正比，少数重度用户占大部分用量
+        users = list(conversation_ids_by_user)
+        weights = [len(conversation_ids_by_user[u]) or 1 for u in users]
+
+        rows = []
+        for _ in range(count):
+            user_id = self.rng.choices(users, weights)[0]
+            conversations = conversation_ids_by_user[user_id]
+            prompt_tokens = lognormal_count(self.rng, 800, 0.8)
+            completion_tokens = lognormal_count(self.rng, 300, 0.8)
+            successful = self.rng.random() > 0.02
+            rows.append({
+                'user_id': user_id,
+                'model_id': self.rng.choice(model_ids),
+                'conversation_id': self.rng.choice(conversations) if conversations else None,
+                'message_id': None,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens if successful else 0,
+                'total_tokens': prompt_tokens + (completion_tokens if successful else 0),
+                'cost_usd': (prompt_tokens + completion_tokens) / 1000 * 0.002,
+                'cost_rmb': (prompt_tokens + completion_tokens) / 1000 * 0.002 * 7.2,
+                'request_time': self.random_time(),
+                'response_time': round(self.rng.lognormvariate(0, 0.6), 3),
+                'is_successful': successful,
+                'error_message': '' if successful else 'synthetic error',
+                'session_id': '',
+                'metadata': {},
+            })
+            if len(rows) >= self.chunk_size:
+                self.insert(TokenUsage, rows, returning=False)
+                rows = []
+                self.log(f"TokenUsage: {self.counts.get(TokenUsage._meta.label, 0)}/{count}")
+        self.insert(TokenUsage, rows, returning=False)
@@ -1,7 +1,109 @@
 from celery import shared_task
+from django.conf import settings
+from knowledge_hub.cache import TieredCache
 from .utils import extract_knowledge_structure
 
+# 对话产生新知识点后延迟多久刷新推荐(秒)，窗口内的多次变化合并为一次
+RECOMMENDATION_REFRESH_DELAY = getattr(settings, 'RECOMMENDATION_REFRESH_DELAY', 300)
+# 已投递但尚未执行的推荐刷新，只用共享缓存的原子 add
+pending_recommendations = TieredCache('recommend:pending', timeout=RECOMMENDATION_REFRESH_DELAY, local_ttl=0)
+
+def schedule_recommendations(user_id):
+    """合并刷新: 窗口内只投递一次延迟任务
+
+    同步执行(CELERY_TASK_ALWAYS_EAGER)时不投递，避免在请求中重建推荐，
+    由 build_recommendations 命令或 celery beat 定期调度 refresh_recommendations。
+    """
+    if refresh_recommendations.app.conf.task_always_eager:
+        return False
+    if not pending_recommendations.add(user_id, 1):
+        return False
+    refresh_recommendations.apply_async((user_id,), countdown=RECOMMENDATION_REFRESH_DELAY)
+    return True
+
 @shared_task
 def process_conversation_knowledge(conversation_id):
     """异步处理对话知识提取"""
-    return extract_knowledge_structure(conversation_id)
\ No newline at end of file
+    result = extract_knowledge_structure(conversation_id)
+    if result:
+        from .models import Conversation
+        user_id = Conversation.objects.filter(id=conversation_id).values_list('user_id', flat=True).first()
+        if user_id:
+            schedule_recommendations(user_id)
+    return result
+
+@shared_task
+def extract_conversations_batch(conversation_ids):
+    """批量导入后对一批对话做知识提取，整批结束后为每个用户安排一次合并的推荐刷新"""
+    from .models import Conversation
+    
+    processed = 0
+    for conversation_id in conversation_ids:
+        try:
+            if extract_knowledge_structure(conversation_id):
+                processed += 1
+        except Exception as e:
+            print(f"对话 {conversation_id} 知识提取失败: {e}")
+    if processed:
+        user_ids = Conversation.objects.filter(id__in=conversation_ids).values_list('user_id', flat=True).distinct()
+        for user_id in user_ids:
+            schedule_recommendations(user_id)
+    return processed
+
+@shared_task
+def refresh_recommendations(user_id=None):
+    """重新计算知识点近邻和推荐，未指定用户时处理全部用户"""
+    from django.contrib.auth import get_user_model
+    from .recommend import refresh_user_recommendations
+    
+    if user_id is not None:
+        return refresh_user_recommendations(user_id)
+    
+    total = 0
+    for uid in get_user_model().objects.values_list('id', flat=True).iterator():
+        total += refresh_user_recommendations(uid)
+    return total
+
+@shared_task
+def dedup_knowledge_points(user_id=None):
+    """补算指纹并合并近似重复的知识点，未指定用户时处理全部用户"""
+    from django.contrib.auth import get_user_model
+    from .dedup import backfill_fingerprints, dedup_user
+    
+    user_ids = [user_id] if user_id is not None else get_user_model().objects.values_list('id', flat=True)
+    total = 0
+    for uid in user_ids:
+        backfill_fingerprints(uid)
+        total += dedup_user(uid)
+    if total and user_id is not None:
+        schedule_recommendations(user_id)
+    return total
+
+@shared_task
+def maintain_token_usage_partitions():
+    """创建未来月份的分区并归档超出保留期的Token使用记录(建议每天由 celery beat 调度)"""
+    from .partitions import archive_expired, ensure_partitions
+    
+    created = ensure_partitions()
+    archived = archive_expired()
+    return {'created': created, 'archived': [name for name, _ in archived]}
+
+@shared_task
+def embed_pending(target=None, model_id=None, user_id=None):
+    """为缺少向量或内容已变化的消息/知识点批量生成向量(可由 celery beat 定期调度)；
+    指定 user_id 时只处理该用户的数据(如批量导入之后)"""
+    from .embeddings import embed_pending as run
+    
+    try:
+        return run([target] if target else None, model_id=model_id, user_id=user_id)
+    except ValueError as e:
+        # 没有配置向量模型时跳过
+        print(f"跳过向量生成: {e}")
+        return {}
+
+@shared_task
+def archive_idle_conversations(days=None, limit=None):
+    """把闲置对话的消息压缩转入冷存储(建议每天由 celery beat 调度)"""
+    from .cold_storage import ARCHIVE_DAYS, archive_idle
+    
+    return archive_idle(days or ARCHIVE_DAYS, limit=limit)
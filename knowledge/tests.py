@@ -1,3 +1,411 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import zlib
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.admin import site
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+
+from .ai_models import TokenUsage
+from .cold_storage import archive_conversation, archive_idle, idle_conversations, restore_conversation
+from .dedup import add_source, merge_points
+from .importers import ImportFormatError, import_file
+from .models import (
+    Category, Conversation, ConversationArchive, KnowledgePoint, Message, MessageReasoning, Tag, UserStats,
+)
+from .search import category_subtree, matrix_cache, vector_search
+
+
+def jsonl(*records):
+    return io.StringIO('\n'.join(json.dumps(record, ensure_ascii=False) for record in records))
+
+
+class ImporterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='importer')
+
+    def test_jsonl_keeps_original_times(self):
+        counts = import_file(jsonl({
+            'title': '导入',
+            'created_at': '2024-01-02T03:04:05+00:00',
+            'messages': [
+                {'role': 'user', 'content': '你好', 'timestamp': 1704164645},
+                {'role': 'assistant', 'content': '你好，有什么可以帮你？', 'timestamp': 1704164650},
+                {'role': 'tool', 'content': '忽略'},
+            ],
+        }), self.user)
+        self.assertEqual((counts['conversations'], counts['messages']), (1, 2))
+        conversation = Conversation.objects.get(user=self.user)
+        self.assertEqual(conversation.created_at.year, 2024)
+        self.assertEqual(
+            [m.timestamp.timestamp() for m in conversation.messages.order_by('timestamp')],
+            [1704164645, 1704164650],
+        )
+
+    def test_malformed_records_raise_format_error(self):
+        cases = [
+            [1],
+            {'messages': [1]},
+            {'messages': 'abc'},
+            {'messages': [{'role': 'user', 'content': ['a']}]},
+            {'created_at': '2024-02-30T00:00:00', 'messages': [{'role': 'user', 'content': 'a'}]},
+            {'messages': [{'role': 'user', 'content': 'a', 'timestamp': 1e20}]},
+            {'mapping': [1]},
+        ]
+        for record in cases:
+            with self.subTest(record=record), self.assertRaises(ImportFormatError):
+                import_file(jsonl(record), self.user)
+
+    def test_failure_keeps_committed_batches(self):
+        good = {'title': 'ok', 'messages': [{'role': 'user', 'content': '第一条'}]}
+        with self.assertRaises(ImportFormatError) as raised:
+            import_file(jsonl(good, {'messages': [1]}), self.user, batch_size=1)
+        self.assertEqual(raised.exception.counts['conversations'], 1)
+        self.assertEqual(Conversation.objects.filter(user=self.user).count(), 1)
+
+    def test_api_skips_follow_up_processing_in_eager_mode(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = io.BytesIO(json.dumps({'messages': [{'role': 'user', 'content': 'hi'}]}).encode())
+        upload.name = 'history.jsonl'
+        response = client.post('/api/conversations/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['processing_skipped'])
+
+    def test_api_rejects_malformed_input(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = io.BytesIO(b'{"messages": [{"role": "user", "content": "a", "timestamp": 1e20}]}')
+        upload.name = 'history.jsonl'
+        response = client.post('/api/conversations/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageHashTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='editor')
+        self.conversation = Conversation.objects.create(title='对话', user=user)
+
+    def test_hash_follows_content_changes(self):
+        message = Message.objects.create(conversation=self.conversation, role='user', content='旧内容')
+        Message.objects.filter(pk=message.pk).update(embedding_hash=message.message_hash)
+
+        message = Message.objects.get(pk=message.pk)
+        message.content = '新内容'
+        message.save(update_fields=['content'])
+        message.refresh_from_db()
+        self.assertEqual(message.message_hash, hashlib.md5('新内容'.encode()).hexdigest())
+        self.assertNotEqual(message.message_hash, message.embedding_hash)
+
+    def test_custom_hash_kept_when_content_unchanged(self):
+        message = Message.objects.create(
+            conversation=self.conversation, role='user', content='内容', message_hash='custom',
+        )
+        message = Message.objects.get(pk=message.pk)
+        message.metadata = {'edited': False}
+        message.save()
+        message.refresh_from_db()
+        self.assertEqual(message.message_hash, 'custom')
+
+
+class MessageAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='secret', email='a@example.com')
+        conversation = Conversation.objects.create(title='对话', user=self.admin)
+        self.message = Message.objects.create(conversation=conversation, role='user', content='完整的消息正文')
+        self.client.force_login(self.admin)
+
+    def test_changelist_uses_preview(self):
+        response = self.client.get('/admin/knowledge/message/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '完整的消息正文')
+
+    def admin_request(self, path):
+        request = RequestFactory().get(path)
+        request.user, request.resolver_match = self.admin, resolve(path)
+        return request
+
+    def test_only_changelist_defers_content(self):
+        model_admin = site._registry[Message]
+        request = self.admin_request('/admin/knowledge/message/')
+        self.assertIn('content', model_admin.get_queryset(request).get().get_deferred_fields())
+        request = self.admin_request(f'/admin/knowledge/message/{self.message.pk}/change/')
+        message = model_admin.get_object(request, str(self.message.pk))
+        self.assertNotIn('content', message.get_deferred_fields())
+
+    def test_change_view_saves_message(self):
+        response = self.client.get(f'/admin/knowledge/message/{self.message.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '完整的消息正文')
+        response = self.client.post(f'/admin/knowledge/message/{self.message.pk}/change/', {
+            'conversation': self.message.conversation_id, 'role': 'user', 'content': '修改后的正文',
+            'metadata': '{}', 'message_hash': self.message.message_hash, 'request_id': '',
+            'embedding_hash': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.content, '修改后的正文')
+
+
+class KnowledgePointListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.parent = Category.objects.create(name='数据库', user=self.user)
+        child = Category.objects.create(name='索引', parent=self.parent, user=self.user)
+        other = Category.objects.create(name='前端', user=self.user)
+        self.points = [
+            KnowledgePoint.objects.create(title=f'知识点{i}', content='内容', category=category, user=self.user)
+            for i, category in enumerate([self.parent, child, other])
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_category_subtree_filter(self):
+        response = self.client.get('/api/knowledge-points/', {'category_subtree': self.parent.pk})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        items = data['results'] if isinstance(data, dict) else data
+        self.assertEqual(sorted(item['id'] for item in items), [p.id for p in self.points[:2]])
+
+    def test_non_integer_category_subtree_is_rejected(self):
+        response = self.client.get('/api/knowledge-points/', {'category_subtree': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AddMessageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='chatter')
+        self.conversation = Conversation.objects.create(title='对话', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_non_integer_template_id_is_rejected(self):
+        for template_id in ['abc', [1], {'id': 1}]:
+            with self.subTest(template_id=template_id):
+                response = self.client.post(
+                    f'/api/conversations/{self.conversation.pk}/add_message/',
+                    {'message': '你好', 'template_id': template_id}, format='json',
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.conversation.messages.exists())
+
+
+class MergeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='merger')
+        self.category = Category.objects.create(name='分类', user=self.user)
+        conversation = Conversation.objects.create(title='对话', user=self.user)
+        self.messages = [
+            Message.objects.create(conversation=conversation, role='assistant', content=f'回复{i}')
+            for i in range(4)
+        ]
+
+    def point(self, source=None):
+        return KnowledgePoint.objects.create(
+            title='索引', content='联合索引的列顺序', category=self.category, user=self.user, source_message=source,
+        )
+
+    def test_merge_keeps_tags_and_every_source(self):
+        survivor = self.point(self.messages[0])
+        first, second = self.point(self.messages[1]), self.point(self.messages[2])
+        first.extra_sources.add(self.messages[3])
+        tag = Tag.objects.create(name='数据库', user=self.user)
+        second.tags.add(tag)
+
+        merge_points(survivor, [first, second])
+
+        self.assertEqual(KnowledgePoint.objects.filter(user=self.user).count(), 1)
+        survivor.refresh_from_db()
+        self.assertEqual(survivor.source_message_id, self.messages[0].id)
+        self.assertEqual(
+            set(survivor.extra_sources.values_list('id', flat=True)),
+            {m.id for m in self.messages[1:]},
+        )
+        self.assertEqual(list(survivor.tags.all()), [tag])
+
+    def test_merge_fills_missing_primary_source(self):
+        survivor = self.point()
+        merge_points(survivor, [self.point(self.messages[1])])
+        survivor.refresh_from_db()
+        self.assertEqual(survivor.source_message_id, self.messages[1].id)
+        self.assertFalse(survivor.extra_sources.exists())
+
+    def test_add_source_ignores_current_primary(self):
+        point = self.point(self.messages[0])
+        add_source(point, self.messages[0].id)
+        add_source(point, self.messages[1].id)
+        self.assertEqual(list(point.extra_sources.values_list('id', flat=True)), [self.messages[1].id])
+
+
+class VectorSearchTests(TestCase):
+    def setUp(self):
+        matrix_cache.clear()
+        self.user = User.objects.create(username='searcher')
+        self.parent = Category.objects.create(name='数据库', user=self.user)
+        self.child = Category.objects.create(name='索引', parent=self.parent, user=self.user)
+        self.other = Category.objects.create(name='前端', user=self.user)
+        self.points = [
+            KnowledgePoint.objects.create(
+                title=f'知识点{i}', content='内容', category=category, user=self.user, embedding=[1.0, i + 1.0],
+            )
+            for i, category in enumerate([self.parent, self.child, self.other])
+        ]
+        self.vector = np.asarray([1.0, 0.0], dtype=np.float32)
+
+    def search(self, **filters):
+        version = UserStats.for_user(self.user.pk).version
+        return vector_search('knowledge', self.user, self.vector, version, **filters)
+
+    def test_filters_mask_cached_rows(self):
+        ids = [point.id for point in self.points]
+        self.assertEqual(self.search(), ids)
+        subtree = category_subtree(self.user, self.parent.pk)
+        self.assertEqual(sorted(subtree), [self.parent.pk, self.child.pk])
+        with self.assertNumQueries(1):
+            # 只有读取版本号的一次查询，矩阵和筛选都来自缓存
+            self.assertEqual(self.search(category_ids=subtree), ids[:2])
+
+        tag = Tag.objects.create(name='重点', user=self.user)
+        self.points[2].tags.add(tag)
+        self.assertEqual(self.search(tag_ids=[tag.pk]), [ids[2]])
+        self.assertEqual(self.search(category_ids=subtree, tag_ids=[tag.pk]), [])
+
+    def test_new_rows_reload_matrix(self):
+        self.search()
+        point = KnowledgePoint.objects.create(
+            title='新知识点', content='内容', category=self.other, user=self.user, embedding=[1.0, 0.0],
+        )
+        self.assertEqual(self.search()[0], point.id)
+
+
+class ColdStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='archiver')
+        self.conversation = Conversation.objects.create(title='旧对话', user=self.user)
+        self.question = Message.objects.create(conversation=self.conversation, role='user', content='什么是分区表？')
+        self.answer = Message.objects.create(conversation=self.conversation, role='assistant', content='按键拆分的表。')
+        MessageReasoning.store(self.answer, '先解释概念' * 50)
+        self.usage = TokenUsage.objects.create(
+            user=self.user, conversation=self.conversation, message=self.question, prompt_tokens=10,
+        )
+        self.old = timezone.now() - timedelta(days=365)
+        Conversation.objects.filter(pk=self.conversation.pk).update(updated_at=self.old)
+        Message.objects.filter(conversation=self.conversation).update(timestamp=self.old)
+
+    def test_archive_and_restore_round_trip(self):
+        self.assertEqual(archive_idle(days=90), {'conversations': 1, 'messages': 2})
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+        self.assertEqual(ConversationArchive.objects.get(conversation=self.conversation).message_count, 2)
+        self.usage.refresh_from_db()
+        self.assertIsNone(self.usage.message_id)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(restore_conversation(self.conversation), 2)
+        self.assertFalse(ConversationArchive.objects.exists())
+        restored = list(Message.objects.filter(conversation=self.conversation).order_by('id'))
+        self.assertEqual([m.id for m in restored], [self.question.id, self.answer.id])
+        self.assertEqual([m.content for m in restored], [self.question.content, self.answer.content])
+        self.assertEqual(restored[0].timestamp, self.old)
+        self.assertEqual(MessageReasoning.objects.get(message=self.answer).content, '先解释概念' * 50)
+        self.usage.refresh_from_db()
+        self.assertEqual(self.usage.message_id, self.question.id)
+
+    def test_restore_is_noop_for_live_conversation(self):
+        self.assertEqual(restore_conversation(self.conversation), 0)
+
+    def test_recent_conversation_is_not_archived(self):
+        self.assertEqual(archive_conversation(self.conversation.pk, cutoff=self.old - timedelta(days=1)), 0)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+
+    def test_source_messages_stay_in_message_table(self):
+        category = Category.objects.create(name='数据库', user=self.user)
+        KnowledgePoint.objects.create(
+            title='分区表', content='按键拆分', category=category, user=self.user, source_message=self.answer,
+        )
+        self.assertEqual(archive_conversation(self.conversation.pk), 1)
+        self.assertEqual(list(Message.objects.filter(conversation=self.conversation)), [self.answer])
+
+    def test_fully_pinned_conversation_is_not_idle(self):
+        category = Category.objects.create(name='数据库', user=self.user)
+        point = KnowledgePoint.objects.create(
+            title='分区表', content='按键拆分', category=category, user=self.user, source_message=self.answer,
+        )
+        point.extra_sources.add(self.question)
+        Conversation.objects.filter(pk=self.conversation.pk).update(updated_at=self.old)
+        queryset, _ = idle_conversations(days=90)
+        self.assertFalse(queryset.filter(pk=self.conversation.pk).exists())
+        self.assertEqual(archive_idle(days=90), {'conversations': 0, 'messages': 0})
+
+    def test_retrieve_restores_archived_conversation(self):
+        archive_conversation(self.conversation.pk)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/conversations/{self.conversation.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 2)
+
+
+class MigrationTests(TransactionTestCase):
+    """0018 压缩思考过程，回滚时解压写回 content；0019 回滚时恢复已归档的消息"""
+
+    before = [('knowledge', '0017_messagereasoning')]
+    after = [('knowledge', '0018_compress_reasoning')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # 恢复到最新状态，供后续测试使用
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        cache.clear()
+
+    def test_reasoning_round_trip(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('accounts', 'User').objects.create(username='migrator')
+        conversation = apps.get_model('knowledge', 'Conversation').objects.create(title='t', user_id=user.pk)
+        message = apps.get_model('knowledge', 'Message').objects.create(
+            conversation_id=conversation.pk, role='assistant', content='答案',
+        )
+        text = '推理过程' * 200
+        apps.get_model('knowledge', 'MessageReasoning').objects.create(message_id=message.pk, content=text)
+
+        apps = self.migrate(self.after)
+        reasoning = apps.get_model('knowledge', 'MessageReasoning').objects.get(message_id=message.pk)
+        self.assertEqual(reasoning.codec, 'zlib')
+        self.assertEqual(zlib.decompress(bytes(reasoning.data)).decode(), text)
+        self.assertLess(len(reasoning.data), len(text.encode()))
+
+        apps = self.migrate(self.before)
+        reasoning = apps.get_model('knowledge', 'MessageReasoning').objects.get(message_id=message.pk)
+        self.assertEqual(reasoning.content, text)
+
+    def test_archive_rollback_restores_messages(self):
+        user = User.objects.create(username='rollback')
+        conversation = Conversation.objects.create(title='旧对话', user=user)
+        question = Message.objects.create(conversation=conversation, role='user', content='问题')
+        answer = Message.objects.create(conversation=conversation, role='assistant', content='回答')
+        MessageReasoning.store(answer, '思考' * 100)
+        usage = TokenUsage.objects.create(user=user, conversation=conversation, message=question)
+        self.assertEqual(archive_conversation(conversation.pk), 2)
+
+        apps = self.migrate(self.after)
+        messages = apps.get_model('knowledge', 'Message').objects.filter(conversation_id=conversation.pk)
+        self.assertEqual(sorted(messages.values_list('id', flat=True)), [question.id, answer.id])
+        reasoning = apps.get_model('knowledge', 'MessageReasoning').objects.get(message_id=answer.id)
+        self.assertEqual(zlib.decompress(bytes(reasoning.data)).decode(), '思考' * 100)
+        usage = apps.get_model('knowledge', 'TokenUsage').objects.get(pk=usage.pk)
+        self.assertEqual(usage.message_id, question.id)
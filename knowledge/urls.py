@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, TagViewSet, ConversationViewSet, KnowledgePointViewSet
+from .views import CategoryViewSet, TagViewSet, ConversationViewSet, KnowledgePointViewSet, SearchViewSet
 from .views_model import ModelProviderViewSet, AIModelViewSet, TokenUsageViewSet, PromptTemplateViewSet, PromptSceneViewSet
 
 router = DefaultRouter()
@@ -8,6 +8,7 @@ router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'tags', TagViewSet, basename='tag')
 router.register(r'conversations', ConversationViewSet, basename='conversation')
 router.register(r'knowledge-points', KnowledgePointViewSet, basename='knowledge-point')
+router.register(r'search', SearchViewSet, basename='search')
 
 # 确保这些路径正确
 router.register(r'model-providers', ModelProviderViewSet, basename='model-provider')
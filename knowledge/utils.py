@@ -48,9 +48,13 @@ def extract_knowledge_structure(conversation_id):
     这个函数会在异步任务中被调用
     """
     from .models import Conversation, Category, Tag, KnowledgePoint
+    from .dedup import add_source, find_duplicate
     
     try:
         conversation = Conversation.objects.get(id=conversation_id)
+        # 已归档的对话需要完整消息，先从冷存储恢复
+        from .cold_storage import restore_conversation
+        restore_conversation(conversation)
         
         # 获取对话内容
         messages = conversation.messages.all().order_by('timestamp')  # type: ignore
@@ -129,15 +133,13 @@ def extract_knowledge_structure(conversation_id):
         # 更新对话标签
         conversation.tags.set(tags)
         
+        # 知识点来源：对话中最后一条助手回复
+        source_message = next((msg for msg in reversed(list(messages)) if msg.role == 'assistant'), None)
+        
         # 处理知识点
         for point_data in analysis.get('knowledge_points', []):
-            # 创建知识点
-            knowledge_point = KnowledgePoint.objects.create(
-                title=point_data.get('title', '未命名知识点'),
-                content=point_data.get('content', ''),
-                category=category,
-                user=conversation.user
-            )
+            title = point_data.get('title', '未命名知识点')
+            content = point_data.get('content', '')
             
             # 添加标签
             point_tags = []
@@ -148,6 +150,22 @@ def extract_knowledge_structure(conversation_id):
                 )
                 point_tags.append(tag)
             
+            # 已存在近似重复的知识点时只合并标签，不再新建
+            duplicate = find_duplicate(conversation.user_id, title, content)
+            if duplicate is not None:
+                duplicate.tags.add(*point_tags)
+                if source_message is not None:
+                    add_source(duplicate, source_message.pk)
+                continue
+            
+            # 创建知识点
+            knowledge_point = KnowledgePoint.objects.create(
+                title=title,
+                content=content,
+                category=category,
+                source_message=source_message,
+                user=conversation.user
+            )
             knowledge_point.tags.set(point_tags)
         
         return True
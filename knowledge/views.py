@@ -1,16 +1,19 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Q, QuerySet
+from django.db.models import Q, QuerySet, Count, Max, Prefetch
 from typing import Type, Union
 from rest_framework.serializers import Serializer
-from .models import Category, Tag, Conversation, Message, KnowledgePoint
+from .models import Category, Tag, Conversation, Message, MessageReasoning, KnowledgePoint, UserStats
 from .serializers import (
     CategorySerializer, TagSerializer, 
     ConversationSerializer, ConversationDetailSerializer,
-    MessageSerializer, KnowledgePointSerializer
+    MessageSerializer, MessageListSerializer, KnowledgePointSerializer
 )
 from .tasks import process_conversation_knowledge
+from .cold_storage import restore_conversation
+from .conditional import ConditionalListMixin, conditional_response
 from django.utils import timezone
 from datetime import timedelta
 import hashlib
@@ -18,22 +21,83 @@ from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.db.models import F
 from django.db import transaction
-from django.core.cache import cache
+from knowledge_hub.cache import TieredCache
+from django.http import StreamingHttpResponse
 import traceback
 import threading
 import os
 
-class CategoryViewSet(viewsets.ModelViewSet):
+# 重复消息检测只用共享缓存(需要跨进程原子性)
+message_dedup_cache = TieredCache('chat:dedup', timeout=60, local_ttl=0)
+# 最近列表的键带统计版本号，本地副本可以放心保留
+stats_cache = TieredCache('stats', timeout=60 * 60, local_ttl=60)
+
+class CategoryViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):  # type: ignore
-        return Category.objects.filter(user=self.request.user)
+        return Category.objects.filter(user=self.request.user).select_related('parent')
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+    
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """返回完整分类树及每个节点的对话数、知识点数(含子树合计)"""
+        user = request.user
+        return conditional_response(
+            request,
+            [
+                Category.objects.filter(user=user),
+                Conversation.objects.filter(user=user),
+                KnowledgePoint.objects.filter(user=user),
+            ],
+            lambda: self.build_tree(user),
+            extra=(user.pk, 'tree'),
+        )
+    
+    def build_tree(self, user):
+        nodes = list(
+            Category.objects.filter(user=user)
+            .values('id', 'name', 'description', 'parent_id', 'path', 'depth')
+            .order_by('depth', 'name')
+        )
+        conversation_counts = dict(
+            Conversation.objects.filter(user=user, category__isnull=False)
+            .values_list('category').annotate(count=Count('id')).order_by()
+        )
+        knowledge_counts = dict(
+            KnowledgePoint.objects.filter(user=user)
+            .values_list('category').annotate(count=Count('id')).order_by()
+        )
+        
+        by_id = {}
+        for node in nodes:
+            node['conversation_count'] = conversation_counts.get(node['id'], 0)
+            node['knowledge_count'] = knowledge_counts.get(node['id'], 0)
+            node['total_conversation_count'] = node['conversation_count']
+            node['total_knowledge_count'] = node['knowledge_count']
+            node['children'] = []
+            by_id[node['id']] = node
+        
+        # 自底向上累加子树合计
+        roots = []
+        for node in reversed(nodes):
+            parent = by_id.get(node['parent_id'])
+            if parent is None:
+                roots.append(node)
+                continue
+            parent['children'].append(node)
+            parent['total_conversation_count'] += node['total_conversation_count']
+            parent['total_knowledge_count'] += node['total_knowledge_count']
+        
+        for node in nodes:
+            node['children'].reverse()
+        roots.reverse()
+        return Response(roots)
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = TagSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -43,7 +107,7 @@ class TagViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_serializer_class(self):  # type: ignore
@@ -52,7 +116,39 @@ class ConversationViewSet(viewsets.ModelViewSet):
         return ConversationSerializer
     
     def get_queryset(self):  # type: ignore
-        return Conversation.objects.filter(user=self.request.user)
+        queryset = Conversation.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            queryset = (
+                queryset.select_related('category').prefetch_related('tags')
+                .annotate(message_count=Count('messages'), archived_message_count=Max('archive__message_count'))
+            )
+        elif self.action == 'retrieve':
+            queryset = queryset.select_related('category').prefetch_related(
+                'tags', Prefetch('messages', queryset=Message.objects.for_history())
+            )
+        return queryset
+    
+    def get_validator_querysets(self):
+        # 列表中还有分类名称和标签
+        user = self.request.user
+        return [
+            Conversation.objects.filter(user=user),
+            Category.objects.filter(user=user),
+            Tag.objects.filter(user=user),
+        ]
+    
+    def get_validator_extra(self):
+        # 消息数随消息增删变化: 用用户统计的版本号代替扫描该用户的全部消息
+        # (统计行不存在时先全量计算建立，之后的增删才会递增版本号)
+        version = UserStats.for_user(self.request.user.pk).version
+        return (*super().get_validator_extra(), version)
+    
+    def retrieve(self, request, *args, **kwargs):
+        conversation = self.get_object()
+        # 已归档的对话先把消息从冷存储写回，再按原方式读取
+        if restore_conversation(conversation):
+            conversation = self.get_object()
+        return Response(self.get_serializer(conversation).data)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -64,6 +160,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         print(f"[DEBUG-STACK] add_message 方法调用堆栈:\n{stack_trace}")
         
         conversation = self.get_object()
+        restore_conversation(conversation)
         print(f"[DEBUG-CALL] add_message 被调用，会话ID: {pk}, 请求ID: {request.META.get('HTTP_X_REQUEST_ID', 'unknown')}")
         
         print("请求数据类型:", type(request.data))
@@ -76,17 +173,41 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 model_id = request.data.get('model_id')
                 # 获取客户端时间戳（如果有）
                 client_timestamp = request.data.get('client_timestamp')
+                template_id = request.data.get('template_id')
                 print(f"解析到消息: {message_content}, 模型ID: {model_id}")
             else:
                 message_content = str(request.data)
                 model_id = None
                 client_timestamp = None
+                template_id = None
                 print(f"收到纯文本消息: {message_content}")
         except Exception as e:
             print(f"解析请求数据出错: {e}")
             message_content = str(request.data)
             model_id = None
             client_timestamp = None
+            template_id = None
+        
+        # 使用提示词模板时由服务端渲染，编译结果有缓存
+        system_prompt = None
+        if template_id:
+            from .ai_models import PromptTemplate
+            from .prompts import get_compiled_by_id, visible_templates, TemplateRenderError
+            try:
+                template_id = int(template_id)
+            except (TypeError, ValueError):
+                return Response({'detail': '模板ID必须为整数'}, status=status.HTTP_400_BAD_REQUEST)
+            variables = request.data.get('variables') or {}
+            if not isinstance(variables, dict):
+                return Response({'detail': '变量必须是字典格式'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                rendered = get_compiled_by_id(template_id, visible_templates(request.user)).render(variables)
+            except PromptTemplate.DoesNotExist:
+                return Response({'detail': '提示词模板不存在'}, status=status.HTTP_404_NOT_FOUND)
+            except TemplateRenderError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            system_prompt = rendered['system_prompt']
+            message_content = message_content or rendered['user_prompt']
         
         # 验证消息内容
         if not message_content:
@@ -97,49 +218,19 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         # 生成唯一键
         message_hash = hashlib.md5(message_content.encode()).hexdigest()
-        cache_key = f"message_{request.user.id}_{conversation.id}_{message_hash}"
+        dedup_key = f"{request.user.id}:{conversation.id}:{message_hash}"
         
-        # 检查是否最近处理过相同消息
-        if cache.get(cache_key):
-            print(f"[DEBUG] 缓存命中，发现在短时间内处理过相同消息: {message_hash}")
-            # 处理重复逻辑...
-            # 可以返回已有的消息响应
+        # 共享缓存上的原子add: 60秒内相同消息只有一个请求能拿到处理权，跨进程同样有效
+        if not message_dedup_cache.add(dedup_key, True, timeout=60):
+            print(f"[DEBUG] 发现在短时间内处理过相同消息: {message_hash}")
             return Response({'detail': '重复消息检测到'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # 设置缓存标记这个消息正在处理
-        cache.set(cache_key, True, timeout=60)  # 60秒内不允许重复处理
-        
         # 创建消息前记录日志
         print(f"[DEBUG-CREATE] 即将创建用户消息, 会话ID: {conversation.id}, 内容: '{message_content[:30]}...'")
         print(f"[DEBUG-CREATE] 当前线程ID: {threading.get_ident()}, 进程ID: {os.getpid()}")
         
-        # 1. 先检查重复
-        if Message.objects.filter(
-            conversation=conversation,
-            role='user',
-            content=message_content,
-            timestamp__gte=timezone.now() - timedelta(seconds=30)
-        ).exists():
-            # 处理重复消息...
-            return Response({'detail': '重复消息检测到'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 2. 在短小的事务中创建用户消息
+        # 在短小的事务中创建用户消息
         with transaction.atomic():
-            # 检查是否已存在相同消息
-            existing_count = Message.objects.filter(
-                conversation=conversation,
-                role='user',
-                content=message_content,
-                timestamp__gte=timezone.now() - timedelta(seconds=1)
-            ).count()
-            print(f"[DEBUG-CREATE] 检查到过去1秒内相同内容的消息数量: {existing_count}")
-            
-            # 创建消息前捕获消息ID的最大值
-            max_id_before = Message.objects.all().order_by('-id').first()
-            max_id_before = max_id_before.id if max_id_before else 0
-            print(f"[DEBUG-CREATE] 创建消息前的最大ID: {max_id_before}")
-            
-            message_hash = hashlib.md5(message_content.encode()).hexdigest()
             user_message, created = Message.objects.get_or_create(
                 conversation=conversation,
                 role='user',
@@ -154,28 +245,21 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 print(f"[DEBUG] 创建了新消息，ID: {user_message.id}")
             else:
                 print(f"[DEBUG] 找到现有消息，ID: {user_message.id}，不创建新消息")
-            
-            # 创建消息后再次检查
-            new_messages = Message.objects.filter(
-                conversation=conversation,
-                role='user',
-                content=message_content,
-                timestamp__gte=timezone.now() - timedelta(seconds=1)
-            ).order_by('id')
-            print(f"[DEBUG-CREATE] 创建后检查到的消息: {[m.id for m in new_messages]}")
         
-        # 3. 事务外处理AI响应
+        # 事务外处理AI响应
         try:
             from .models_service import get_ai_response
             ai_response = get_ai_response(
                 conversation=conversation, 
                 user_message=message_content, 
                 model_id=model_id,
-                user=request.user
+                user=request.user,
+                existing_message_id=user_message.id,
+                system_prompt=system_prompt
             )
             
             # 获取AI回复
-            assistant_message = conversation.messages.filter(role='assistant').latest('timestamp')
+            assistant_message = conversation.messages.for_history().filter(role='assistant').latest('timestamp')
             
             # 更新对话时间 (短事务)
             with transaction.atomic():
@@ -207,22 +291,120 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         return Response(ConversationSerializer(conversations, many=True).data)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """流式导出对话列表CSV；管理员可用 user_id 指定用户或导出全部"""
+        from .exports import build_queryset, iter_csv, iter_rows, parse_date
+        
+        user_id = request.user.id
+        if request.user.is_staff:
+            user_id = request.query_params.get('user_id') or None
+        try:
+            queryset = build_queryset(
+                'conversations',
+                start=parse_date(request.query_params.get('start_date')),
+                end=parse_date(request.query_params.get('end_date'), end=True),
+                user_id=user_id,
+            )
+        except ValueError:
+            return Response({'detail': '日期格式应为YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(
+            iter_csv('conversations', iter_rows('conversations', queryset)),
+            content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = 'attachment; filename="conversations.csv"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_conversations(self, request):
+        """批量导入 ChatGPT/DeepSeek 导出的 conversations.json 或 JSONL
+        
+        参数: file(上传文件), format(auto/chatgpt/deepseek/jsonl), extract(是否提取知识，默认是)
+        同步执行任务(CELERY_TASK_ALWAYS_EAGER)时不在请求中做知识提取和向量生成，
+        返回 processing_skipped=true。
+        """
+        import io
+        from .importers import ImportFormatError, import_file
+        
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': '请上传 file'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format', 'auto')
+        if fmt not in ('auto', 'chatgpt', 'deepseek', 'json', 'jsonl'):
+            return Response({'detail': f'不支持的格式: {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+        extract = str(request.data.get('extract', 'true')).lower() not in ('0', 'false', 'no')
+        
+        try:
+            # 上传文件按块解码，不整体读入内存
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig')
+            counts = import_file(stream, request.user, fmt=fmt, extract=extract)
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            # 出错前已提交的批次保留，一并返回已导入的数量
+            return Response({'detail': f'导入失败: {e}', 'imported': getattr(e, 'counts', None)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(counts, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """获取指定对话的所有消息"""
+        """获取指定对话的所有消息；?mode=preview 时只返回每条消息的开头部分"""
         conversation = self.get_object()
+        restore_conversation(conversation)
         
-        # 获取消息，按时间排序
-        messages = conversation.messages.all().order_by('timestamp')  # type: ignore
+        # 获取消息，按时间排序，只取需要的列
+        if request.query_params.get('mode') == 'preview':
+            messages = conversation.messages.for_list().order_by('timestamp')  # type: ignore
+            return Response(MessageListSerializer(messages, many=True).data)
         
+        messages = conversation.messages.for_history().order_by('timestamp')  # type: ignore
         return Response(MessageSerializer(messages, many=True).data)
 
-class KnowledgePointViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], url_path=r'messages/(?P<message_id>\d+)/reasoning')
+    def reasoning(self, request, pk=None, message_id=None):
+        """按需读取单条消息的思考过程(解压后返回)"""
+        conversation = self.get_object()
+        restore_conversation(conversation)
+        try:
+            reasoning = MessageReasoning.objects.get(message_id=message_id, message__conversation=conversation)
+        except MessageReasoning.DoesNotExist:
+            return Response({'detail': '该消息没有思考过程'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'message': reasoning.message_id,
+            'reasoning': reasoning.content,
+            'size': reasoning.size,
+            'codec': reasoning.codec,
+        })
+
+class KnowledgePointViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = KnowledgePointSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):  # type: ignore
-        return KnowledgePoint.objects.filter(user=self.request.user)
+        queryset = KnowledgePoint.objects.filter(user=self.request.user)
+        
+        # 按分类子树筛选: ?category_subtree=<分类ID>
+        subtree_id = self.request.query_params.get('category_subtree')
+        if subtree_id:
+            try:
+                subtree_id = int(subtree_id)
+            except ValueError:
+                raise ValidationError({'category_subtree': '分类ID必须为整数'})
+            path = Category.objects.filter(
+                user=self.request.user, pk=subtree_id
+            ).values_list('path', flat=True).first()
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(category__path__startswith=path)
+        return queryset
+    
+    def get_validator_querysets(self):
+        # 列表中还有分类名称和标签
+        user = self.request.user
+        return [
+            self.get_queryset(),
+            Category.objects.filter(user=user),
+            Tag.objects.filter(user=user),
+        ]
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -245,38 +427,104 @@ class KnowledgePointViewSet(viewsets.ModelViewSet):
         """返回知识库统计信息"""
         user = request.user
         
-        # 计算各种统计数据
+        # 计数由信号增量维护，一次查询即可取得
+        user_stats = UserStats.for_user(user.id)
         stats_data = {
-            'conversations': Conversation.objects.filter(user=user).count(),
-            'knowledgePoints': KnowledgePoint.objects.filter(user=user).count(),
-            'categories': Category.objects.filter(user=user).count(),
-            'tags': Tag.objects.filter(user=user).count(),
+            'conversations': user_stats.conversations,
+            'knowledgePoints': user_stats.knowledge_points,
+            'categories': user_stats.categories,
+            'tags': user_stats.tags,
         }
         
-        # 获取最近的知识点和对话
-        recent_knowledge = KnowledgePoint.objects.filter(user=user).order_by('-created_at')[:5]
-        recent_conversations = Conversation.objects.filter(user=user).order_by('-updated_at')[:5]
-        
-        # 组织响应数据
-        response_data = {
-            'stats': stats_data,
-            'recentKnowledge': KnowledgePointSerializer(recent_knowledge, many=True).data,
-            'recentConversations': ConversationSerializer(recent_conversations, many=True).data
-        }
+        # 最近的知识点和对话按统计版本号缓存，数据变化后版本号递增即自然失效
+        recent_key = f"recent:{user.id}:{user_stats.version}"
+        recent = stats_cache.get(recent_key)
+        if recent is None:
+            recent_knowledge = (
+                KnowledgePoint.objects.filter(user=user)
+                .select_related('category').prefetch_related('tags')
+                .order_by('-created_at')[:5]
+            )
+            recent_conversations = (
+                Conversation.objects.filter(user=user)
+                .select_related('category').prefetch_related('tags')
+                .annotate(message_count=Count('messages'), archived_message_count=Max('archive__message_count'))
+                .order_by('-updated_at')[:5]
+            )
+            recent = {
+                'recentKnowledge': KnowledgePointSerializer(recent_knowledge, many=True).data,
+                'recentConversations': ConversationSerializer(recent_conversations, many=True).data,
+            }
+            stats_cache.set(recent_key, recent)
         
-        return Response(response_data)
+        return Response({'stats': stats_data, **recent})
 
     @action(detail=False, methods=['get'])
     def recommended(self, request):
         """返回推荐的知识点"""
         user = request.user
         
-        # 这里可以实现各种推荐逻辑，例如:
-        # - 最近创建的知识点
-        # - 基于用户查询历史的推荐
-        # - 基于内容相似度的推荐
-        # 简单起见，我们暂时返回最近创建的知识点
+        # 推荐结果由 refresh_recommendations 任务离线计算
+        recommended_points = list(
+            KnowledgePoint.objects.filter(recommendations__user=user)
+            .select_related('category').prefetch_related('tags')
+            .order_by('-recommendations__score')[:10]
+        )
+        
+        # 尚未计算出推荐时退回到最近创建的知识点
+        if not recommended_points:
+            recommended_points = (
+                KnowledgePoint.objects.filter(user=user)
+                .select_related('category').prefetch_related('tags')
+                .order_by('-created_at')[:10]
+            )
+        
+        return Response(KnowledgePointSerializer(recommended_points, many=True).data)
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """知识点和消息的混合检索(全文 + 向量，倒数排名融合)
+    
+    参数: q, type(all/knowledge/messages), category(分类ID，含子分类), tags(逗号分隔的标签ID), limit
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def list(self, request):
+        from .search import hybrid_search
+        
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'query': query, 'results': []})
+        
+        search_type = request.query_params.get('type', 'all')
+        targets = {'all': ('knowledge', 'messages'), 'knowledge': ('knowledge',), 'messages': ('messages',)}.get(search_type)
+        if targets is None:
+            return Response({'detail': f'不支持的检索类型: {search_type}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            category_id = int(request.query_params['category']) if request.query_params.get('category') else None
+            tag_ids = [int(tag) for tag in request.query_params.get('tags', '').split(',') if tag.strip()]
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 50)
+        except ValueError:
+            return Response({'detail': 'category、tags、limit 必须为整数'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        hits = hybrid_search(request.user, query, targets=targets, category_id=category_id,
+                             tag_ids=tag_ids, limit=limit)
         
-        recommended_points = KnowledgePoint.objects.filter(user=user).order_by('-created_at')[:10]
+        # 按命中的ID批量取出对象，保持融合后的顺序
+        point_ids = [pk for target, pk, _, _ in hits if target == 'knowledge']
+        message_ids = [pk for target, pk, _, _ in hits if target == 'messages']
+        points = KnowledgePoint.objects.filter(id__in=point_ids).select_related('category').prefetch_related('tags')
+        messages = Message.objects.filter(id__in=message_ids).select_related('conversation').with_reasoning_flag()
+        items = {('knowledge', p.id): KnowledgePointSerializer(p).data for p in points}
+        for message in messages:
+            items[('messages', message.id)] = {
+                **MessageSerializer(message).data,
+                'conversation': message.conversation_id,
+                'conversation_title': message.conversation.title,
+            }
         
-        return Response(KnowledgePointSerializer(recommended_points, many=True).data)
\ No newline at end of file
+        results = [
+            {'type': target, 'id': pk, 'score': round(score, 6), 'matched': matched, 'item': items[(target, pk)]}
+            for target, pk, score, matched in hits if (target, pk) in items
+        ]
+        return Response({'query': query, 'results': results})
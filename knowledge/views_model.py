@@ -1,7 +1,5 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework.response import Response
 from django.db.models import Sum, Avg, Count, F, ExpressionWrapper, fields
 from django.db.models.functions import TruncDay, TruncMonth
@@ -10,7 +8,13 @@ import datetime
 from rest_framework import serializers
 
 from knowledge.ai_models import ModelProvider, AIModel, TokenUsage, PromptTemplate, PromptScene
-from knowledge.serializers_model import ModelProviderSerializer, AIModelSerializer, TokenUsageSerializer, ModelStatSerializer, PromptTemplateSerializer, PromptSceneSerializer
+from knowledge.serializers_model import ModelProviderSerializer, AIModelSerializer, TokenUsageSerializer, ModelStatSerializer, PromptTemplateSerializer, PromptTemplateListSerializer, PromptSceneSerializer
+from knowledge.conditional import ConditionalListMixin, conditional_response, set_validators
+from knowledge import model_catalog
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.http import StreamingHttpResponse
+from django.db.models import Q
 
 class ModelProviderViewSet(viewsets.ModelViewSet):
     """模型提供商管理"""
@@ -54,13 +58,24 @@ class AIModelViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save()
     
-    @method_decorator(cache_page(60 * 15))  # 缓存15分钟
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def available(self, request):
-        """获取可用的AI模型列表"""
-        models = AIModel.objects.filter(is_active=True, provider__is_active=True)
-        serializer = self.get_serializer(models, many=True)
-        return Response(serializer.data)
+        """获取可用的AI模型列表
+
+        目录对所有登录用户相同，按版本号缓存；ETag 直接由版本号得出，
+        客户端缓存有效时不访问数据库。
+        """
+        etag = quote_etag(f'ai-models-available-{model_catalog.get_version()}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            def build():
+                models = AIModel.objects.filter(is_active=True, provider__is_active=True).select_related('provider')
+                return self.get_serializer(models, many=True).data
+            
+            version, data = model_catalog.get_available_catalog(build)
+            etag = quote_etag(f'ai-models-available-{version}')
+            response = Response(data)
+        return set_validators(response, etag, None)
     
     @action(detail=True, methods=['post'])
     def set_default(self, request, pk=None):
@@ -124,6 +139,8 @@ class AIModelViewSet(viewsets.ModelViewSet):
         
         try:
             updated = AIModel.objects.filter(id__in=model_ids).update(is_active=is_active)
+            # queryset.update 不触发信号，需手动使模型目录失效
+            model_catalog.bump_version()
             return Response({
                 'status': 'success',
                 'message': f'已更新{updated}个模型的状态',
@@ -154,25 +171,49 @@ class TokenUsageViewSet(viewsets.ReadOnlyModelViewSet):
         if model_id:
             queryset = queryset.filter(model__model_id=model_id)
             
-        # 筛选时间范围
+        # 筛选时间范围: 换算成 request_time 上的区间条件(不对列做 ::date 转换)，
+        # 才能使用 (user, request_time) 索引并裁剪按月分区
         start_date = self.request.query_params.get('start_date')
         if start_date:
             try:
-                start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
-                queryset = queryset.filter(request_time__date__gte=start_date)
+                start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+                queryset = queryset.filter(request_time__gte=timezone.make_aware(start_date))
             except ValueError:
                 pass
                 
         end_date = self.request.query_params.get('end_date')
         if end_date:
             try:
-                end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
-                queryset = queryset.filter(request_time__date__lte=end_date)
+                end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d') + datetime.timedelta(days=1)
+                queryset = queryset.filter(request_time__lt=timezone.make_aware(end_date))
             except ValueError:
                 pass
                 
         return queryset
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """流式导出CSV: 支持 user_id、model_id、start_date、end_date 参数，只读取导出列"""
+        from knowledge.exports import build_queryset, iter_csv, iter_rows, parse_date
+        
+        try:
+            queryset = build_queryset(
+                'token-usage',
+                start=parse_date(request.query_params.get('start_date')),
+                end=parse_date(request.query_params.get('end_date'), end=True),
+                user_id=request.query_params.get('user_id') or None,
+                model_id=request.query_params.get('model_id') or None,
+            )
+        except ValueError:
+            return Response({'detail': '日期格式应为YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(
+            iter_csv('token-usage', iter_rows('token-usage', queryset)),
+            content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = 'attachment; filename="token_usage.csv"'
+        return response
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """获取Token使用统计数据"""
@@ -189,11 +230,11 @@ class TokenUsageViewSet(viewsets.ReadOnlyModelViewSet):
         end_date = timezone.now()
         start_date = end_date - datetime.timedelta(days=days)
         
-        # 使用select_related减少数据库查询
+        # 聚合查询只按 request_time 区间过滤，分区表上只扫描涉及的月份分区
         base_queryset = TokenUsage.objects.filter(
             request_time__gte=start_date,
             request_time__lte=end_date
-        ).select_related('user', 'model', 'model__provider')
+        )
         
         # 根据周期选择截断函数
         if period == 'month':
@@ -241,16 +282,17 @@ class TokenUsageViewSet(viewsets.ReadOnlyModelViewSet):
             request_count=Count('id')
         ).order_by('-total_tokens')
         
-        # 计算总计
-        totals = base_queryset.aggregate(
-            total_prompt_tokens=Sum('prompt_tokens'),
-            total_completion_tokens=Sum('completion_tokens'),
-            total_tokens=Sum('total_tokens'),
-            total_cost_usd=Sum('cost_usd'),
-            total_cost_rmb=Sum('cost_rmb'),
-            avg_response_time=Avg('response_time'),
-            request_count=Count('id')
-        )
+        # 总计由按时间分组的结果汇总，不再扫描一遍明细
+        usage_stats = list(usage_stats)
+        totals = {
+            key: sum(row[key] or 0 for row in usage_stats)
+            for key in ('total_prompt_tokens', 'total_completion_tokens', 'total_tokens',
+                        'total_cost_usd', 'total_cost_rmb', 'request_count')
+        }
+        totals['avg_response_time'] = (
+            sum((row['avg_response_time'] or 0) * row['request_count'] for row in usage_stats)
+            / totals['request_count']
+        ) if totals['request_count'] else None
         
         # 整合数据
         serializer = ModelStatSerializer(data={
@@ -267,12 +309,33 @@ class TokenUsageViewSet(viewsets.ReadOnlyModelViewSet):
         serializer.is_valid()  # 验证数据
         return Response(serializer.data)
 
-class PromptTemplateViewSet(viewsets.ModelViewSet):
+class PromptTemplateViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     """提示词模板管理"""
-    queryset = PromptTemplate.objects.all()
+    queryset = PromptTemplate.objects.select_related('scene')
     serializer_class = PromptTemplateSerializer
     permission_classes = [permissions.IsAdminUser]
     
+    # 精简列表(?compact=1)不读取的大字段
+    COMPACT_DEFERRED_FIELDS = ('content', 'example_values')
+    
+    def is_compact(self):
+        return self.action in ('list', 'available') and self.request.query_params.get('compact') in ('1', 'true')
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_compact():
+            queryset = queryset.defer(*self.COMPACT_DEFERRED_FIELDS)
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.is_compact():
+            return PromptTemplateListSerializer
+        return super().get_serializer_class()
+    
+    def get_validator_querysets(self):
+        # 场景名称也在响应中
+        return [PromptTemplate.objects.all(), PromptScene.objects.all()]
+    
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
@@ -282,13 +345,54 @@ class PromptTemplateViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def available(self, request):
         """获取可用的提示词模板列表"""
-        templates = PromptTemplate.objects.filter(is_public=True)
+        templates = self.get_queryset().filter(is_public=True)
         if not request.user.is_staff:
-            # 非管理员只能看到公开的和自己创建的模板
-            templates = templates | PromptTemplate.objects.filter(created_by=request.user)
+            # 非管理员只能看到公开的和自己创建的模板，单个查询内用OR条件，无需distinct
+            templates = self.get_queryset().filter(Q(is_public=True) | Q(created_by=request.user))
         
-        serializer = self.get_serializer(templates.distinct(), many=True)
-        return Response(serializer.data)
+        def build_response():
+            serializer = self.get_serializer(templates, many=True)
+            return Response(serializer.data)
+        
+        # 场景名称也在响应中，场景变化同样使缓存失效
+        return conditional_response(
+            request, [templates, PromptScene.objects.all()], build_response,
+            extra=(request.user.id, request.get_full_path()),
+        )
+    
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def render(self, request, pk=None):
+        """渲染模板: 校验变量并返回系统/用户提示词及预估token数"""
+        from knowledge.prompts import get_compiled_by_id, visible_templates, TemplateRenderError
+        from knowledge.models_service import ModelService
+        
+        variables = request.data.get('variables') or {}
+        if not isinstance(variables, dict):
+            return Response({'detail': '变量必须是字典格式'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            compiled = get_compiled_by_id(pk, visible_templates(request.user))
+        except PromptTemplate.DoesNotExist:
+            return Response({'detail': '提示词模板不存在'}, status=status.HTTP_404_NOT_FOUND)
+        
+        model_id = request.data.get('model_id')
+        try:
+            token_model = ModelService.get_service(model_id).token_model if model_id else 'gpt-3.5-turbo'
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            result = compiled.render(
+                variables,
+                use_examples=bool(request.data.get('use_examples')),
+                token_model=token_model,
+            )
+        except TemplateRenderError as e:
+            return Response(
+                {'detail': str(e), 'missing': e.missing, 'unknown': e.unknown},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(result)
     
     @action(detail=True, methods=['post'])
     def duplicate(self, request, pk=None):
@@ -307,7 +411,7 @@ class PromptTemplateViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(new_template)
         return Response(serializer.data)
 
-class PromptSceneViewSet(viewsets.ModelViewSet):
+class PromptSceneViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     """提示词场景视图集"""
     queryset = PromptScene.objects.all()
     serializer_class = PromptSceneSerializer
@@ -321,23 +425,33 @@ class PromptSceneViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """根据请求类型过滤查询集"""
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().annotate(template_count=Count('templates'))
         if self.action == 'list' and not self.request.user.is_staff:
             return queryset.filter(is_active=True)
         return queryset
 
+    def get_validator_querysets(self):
+        # 模板数量也在响应中，模板增删同样使缓存失效
+        return [PromptScene.objects.all(), PromptTemplate.objects.all()]
+
+    def get_validator_extra(self):
+        return (self.request.user.is_staff, self.request.get_full_path())
+
     @action(detail=True, methods=['get'])
     def templates(self, request, pk=None):
         """获取场景下的所有模板"""
         scene = self.get_object()
-        templates = scene.templates.all()
+        templates = scene.templates.select_related('scene')
         
         # 非管理员只能看到公开的模板
         if not request.user.is_staff:
             templates = templates.filter(is_public=True)
-            
-        serializer = PromptTemplateSerializer(templates, many=True)
-        return Response(serializer.data)
+        
+        return conditional_response(
+            request, [templates, PromptScene.objects.filter(pk=scene.pk)],
+            lambda: Response(PromptTemplateSerializer(templates, many=True).data),
+            extra=(request.user.is_staff, scene.pk),
+        )
 
     @action(detail=True, methods=['post'])
     def reorder(self, request, pk=None):
@@ -0,0 +1,142 @@
+"""两级缓存
+
+L1 为进程内LRU(带过期时间)，L2 为 settings.CACHES 中的共享缓存(生产环境为Redis)。
+各业务通过 TieredCache(namespace) 取得独立的键空间；需要跨进程互斥的场景
+(如重复请求检测)使用 add()，它只在共享缓存上执行原子的 SET NX，不经过L1。
+
+跨进程的失效只能依靠L1的较短有效期，或在键中带上版本号。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+_MISSING = object()
+
+
+class LocalTTLCache:
+    """线程安全的进程内LRU缓存，条目带过期时间
+
+    指定 maxweight 时按 weigh(value) 的总和(如字节数)限制容量，超过时淘汰最久未用的条目；
+    单个超过 maxweight 的值不缓存。
+    """
+
+    def __init__(self, maxsize, ttl, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.weight -= item[2]
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value, _ = item
+            if expires < time.monotonic():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        weight = self.weigh(value) if self.maxweight is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.maxweight is not None and weight > self.maxweight:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.weight -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+
+class TieredCache:
+    """带命名空间的两级缓存
+
+    local_ttl 为0时不使用L1，所有操作直接访问共享缓存。
+    """
+
+    def __init__(self, namespace, timeout=300, local_ttl=10, local_size=1024, alias='default'):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.local_ttl = local_ttl
+        self.alias = alias
+        self.local = LocalTTLCache(local_size, local_ttl)
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def get(self, key, default=None, local_ttl=None):
+        key = self.make_key(key)
+        local_ttl = self.local_ttl if local_ttl is None else local_ttl
+        if local_ttl:
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        if local_ttl:
+            self.local.set(key, value, local_ttl)
+        return value
+
+    def set(self, key, value, timeout=_MISSING, local_ttl=None):
+        key = self.make_key(key)
+        self.shared.set(key, value, self.timeout if timeout is _MISSING else timeout)
+        local_ttl = self.local_ttl if local_ttl is None else local_ttl
+        if local_ttl:
+            self.local.set(key, value, local_ttl)
+
+    def add(self, key, value, timeout=_MISSING):
+        """键不存在时写入并返回True，已存在返回False(跨进程原子)"""
+        return self.shared.add(self.make_key(key), value, self.timeout if timeout is _MISSING else timeout)
+
+    def delete(self, key):
+        key = self.make_key(key)
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def incr(self, key, delta=1):
+        """原子递增，键不存在时从0开始，不过期"""
+        key = self.make_key(key)
+        self.local.delete(key)
+        try:
+            return self.shared.incr(key, delta)
+        except ValueError:
+            self.shared.add(key, 0, None)
+            return self.shared.incr(key, delta)
+
+    def get_or_set(self, key, default, timeout=_MISSING, local_ttl=None):
+        """未命中时调用 default() 生成并写入"""
+        value = self.get(key, _MISSING, local_ttl)
+        if value is _MISSING:
+            value = default() if callable(default) else default
+            self.set(key, value, timeout, local_ttl)
+        return value
+
+    def clear_local(self):
+        self.local.clear()
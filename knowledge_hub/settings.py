@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'knowledge.instrumentation.PerformanceMiddleware',  # 性能埋点放在最外层，统计完整请求
     'corsheaders.middleware.CorsMiddleware',  # CORS中间件要放在前面
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,7 +100,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # REST Framework设置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -107,6 +108,43 @@ REST_FRAMEWORK = {
     ],
 }
 
+# 缓存: 设置 REDIS_URL 时使用Redis(多进程部署必须，重复消息检测等依赖跨进程的原子add)，
+# 否则使用进程内缓存，仅适合单进程开发环境。
+# 测试时可设置 CACHE_FAKE_REDIS=True 使用 fakeredis(需要安装)模拟Redis。
+REDIS_URL = os.getenv('REDIS_URL')
+if os.getenv('CACHE_FAKE_REDIS', 'False') == 'True':
+    from fakeredis import FakeConnection
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://fakeredis:6379/0',
+            'OPTIONS': {'connection_class': FakeConnection},
+            'KEY_PREFIX': 'knowledge_hub',
+        }
+    }
+elif REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'knowledge_hub',
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'knowledge_hub',
+        }
+    }
+
+# Token认证缓存与有效期
+AUTH_TOKEN_EXPIRE_DAYS = int(os.getenv('AUTH_TOKEN_EXPIRE_DAYS', '0'))  # 0表示永不过期(默认)
+AUTH_TOKEN_CACHE_TTL = 300       # 共享缓存有效期(秒)
+AUTH_TOKEN_LOCAL_CACHE_TTL = 10  # 进程内缓存有效期(秒)
+AUTH_TOKEN_LOCAL_CACHE_SIZE = 1024
+
 # 国际化
 LANGUAGE_CODE = 'zh-hans'
 TIME_ZONE = 'Asia/Shanghai'
@@ -128,6 +166,51 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # OpenAI配置
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# 本地模拟大模型服务地址(provider slug: mock)
+MOCK_LLM_URL = os.getenv('MOCK_LLM_URL', 'http://127.0.0.1:8765/v1')
+
+# Token使用记录按月分区与保留策略
+TOKEN_USAGE_PARTITIONS_AHEAD = 3  # 提前创建的未来月份分区数
+TOKEN_USAGE_RETENTION_MONTHS = int(os.getenv('TOKEN_USAGE_RETENTION_MONTHS', '12'))  # 早于此的数据归档后删除
+TOKEN_USAGE_ARCHIVE_DIR = os.getenv('TOKEN_USAGE_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'token_usage'))
+
+# 批量生成向量(knowledge.embeddings)
+EMBEDDING_MODEL_ID = os.getenv('EMBEDDING_MODEL_ID')  # 为空时使用第一个启用的 embedding 类型模型
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))  # 并发请求数，仍受提供商限速约束
+
+# 知识推荐(knowledge.recommend)
+RECOMMENDATION_REFRESH_DELAY = 300  # 新知识点产生后延迟刷新推荐的秒数，窗口内合并为一次
+
+# 对话冷存储(knowledge.cold_storage)
+CONVERSATION_ARCHIVE_DAYS = int(os.getenv('CONVERSATION_ARCHIVE_DAYS', '90'))  # 闲置超过此天数的对话归档消息
+
+# 检索增强生成(knowledge.rag)
+RAG_ENABLED = os.getenv('RAG_ENABLED', 'True') == 'True'
+RAG_TOP_K_POINTS = 5  # 最多引用的知识点数
+RAG_TOP_K_MESSAGES = 3  # 最多引用的其他对话消息数
+RAG_CONTEXT_TOKENS = 1500  # 参考资料占用的token上限
+RAG_VECTOR_TIMEOUT = float(os.getenv('RAG_VECTOR_TIMEOUT', '0.05'))  # 等待向量检索的秒数，超时或查询向量未缓存时只用全文检索
+SEARCH_MATRIX_CACHE_MB = int(os.getenv('SEARCH_MATRIX_CACHE_MB', '256'))  # 每个进程缓存向量矩阵的总大小上限
+
+# 性能埋点
+PERF_SERVER_TIMING = os.getenv('PERF_SERVER_TIMING', 'True') == 'True'  # 输出Server-Timing响应头
+PERF_PROMETHEUS_ENABLED = os.getenv('PERF_PROMETHEUS_ENABLED', 'False') == 'True'  # 需要安装prometheus_client
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'knowledge.perf': {
+            'handlers': ['console'],
+            'level': os.getenv('PERF_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Celery配置
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/0')